@@ -0,0 +1,374 @@
+"""In-memory stand-ins for the AWS clients the Lambdas create, for offline runs.
+
+install() puts a minimal boto3 module into sys.modules whose client(), and
+session.Session().client() as used by aws_clients, hand out one shared stub per
+service, so handlers imported afterwards read and write the same in-memory
+buckets. Every call is counted per service and operation, and
+an optional latency can be injected per service to approximate network time.
+Errors are raised as botocore ClientErrors with the codes the real services use,
+so the handlers' error handling runs unchanged.
+"""
+import collections
+import glob
+import hashlib
+import io
+import json
+import os
+import sys
+import threading
+import time
+import types
+import uuid
+
+from botocore.exceptions import ClientError
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'expense_analysis')
+# Replaced in fixture text by the sequence number of the job replaying it, so
+# every job reads as a different invoice
+JOB_PLACEHOLDER = '${JOB}'
+
+
+def _client_error(code: str, message: str, operation: str, status: int = 400) -> ClientError:
+    return ClientError(
+        {'Error': {'Code': code, 'Message': message}, 'ResponseMetadata': {'HTTPStatusCode': status}},
+        operation
+    )
+
+
+class RequestStats:
+    """Thread-safe count of requests per (service, operation)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = collections.Counter()
+
+    def add(self, service: str, operation: str) -> None:
+        with self._lock:
+            self.counts[(service, operation)] += 1
+
+    def snapshot(self) -> collections.Counter:
+        with self._lock:
+            return collections.Counter(self.counts)
+
+    def by_service(self, service: str) -> dict:
+        return {op: n for (svc, op), n in sorted(self.snapshot().items()) if svc == service}
+
+
+class _Stub:
+    service = ''
+
+    def __init__(self, stats: RequestStats, latency_ms: float = 0.0):
+        self._stats = stats
+        self._latency = latency_ms / 1000
+
+    def _request(self, operation: str) -> None:
+        self._stats.add(self.service, operation)
+        if self._latency:
+            time.sleep(self._latency)
+
+
+class _Exceptions:
+    def __init__(self, **errors):
+        self.__dict__.update(errors)
+        self.ClientError = ClientError
+
+
+class S3Stub(_Stub):
+    service = 's3'
+
+    class NoSuchKey(ClientError):
+        pass
+
+    def __init__(self, stats: RequestStats, latency_ms: float = 0.0):
+        super().__init__(stats, latency_ms)
+        self._objects = {}
+        self._lock = threading.Lock()
+        self.exceptions = _Exceptions(NoSuchKey=S3Stub.NoSuchKey)
+
+    @staticmethod
+    def _etag(data: bytes) -> str:
+        return f'"{hashlib.md5(data).hexdigest()}"'
+
+    def _get(self, bucket: str, key: str, operation: str) -> bytes:
+        with self._lock:
+            data = self._objects.get((bucket, key))
+        if data is None:
+            raise S3Stub.NoSuchKey(
+                {'Error': {'Code': 'NoSuchKey', 'Message': 'The specified key does not exist.', 'Key': key},
+                 'ResponseMetadata': {'HTTPStatusCode': 404}},
+                operation
+            )
+        return data
+
+    def put_object(self, Bucket, Key, Body=b'', IfNoneMatch=None, IfMatch=None, **kwargs):
+        self._request('PutObject')
+        data = Body.encode() if isinstance(Body, str) else Body if isinstance(Body, bytes) else Body.read()
+        with self._lock:
+            current = self._objects.get((Bucket, Key))
+            if IfMatch is not None and current is None:
+                raise _client_error('NoSuchKey', 'The specified key does not exist.', 'PutObject', 404)
+            if (IfNoneMatch == '*' and current is not None) or (IfMatch is not None and IfMatch != self._etag(current)):
+                raise _client_error('PreconditionFailed', 'At least one of the pre-conditions you specified did not hold',
+                                    'PutObject', 412)
+            self._objects[(Bucket, Key)] = data
+        return {'ETag': self._etag(data)}
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, ExtraArgs=None, **kwargs):
+        # Counted as one request; the real transfer manager uses a multipart upload above 8MB
+        self._request('PutObject')
+        with self._lock:
+            self._objects[(Bucket, Key)] = Fileobj.read()
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None, Range=None, **kwargs):
+        self._request('GetObject')
+        data = self._get(Bucket, Key, 'GetObject')
+        etag = self._etag(data)
+        if IfNoneMatch is not None and IfNoneMatch == etag:
+            raise _client_error('304', 'Not Modified', 'GetObject', 304)
+        if Range:
+            start, end = Range.split('=', 1)[1].split('-')
+            data = data[int(start):int(end) + 1 if end else None]
+        return {'Body': io.BytesIO(data), 'ContentLength': len(data), 'ETag': etag}
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self._request('HeadObject')
+        try:
+            data = self._get(Bucket, Key, 'HeadObject')
+        except S3Stub.NoSuchKey:
+            raise _client_error('404', 'Not Found', 'HeadObject', 404)
+        return {'ContentLength': len(data), 'ETag': self._etag(data)}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self._request('DeleteObject')
+        with self._lock:
+            self._objects.pop((Bucket, Key), None)
+        return {}
+
+    def list_objects_v2(self, Bucket, Prefix='', ContinuationToken=None, MaxKeys=1000, **kwargs):
+        self._request('ListObjectsV2')
+        with self._lock:
+            keys = sorted(key for bucket, key in self._objects if bucket == Bucket and key.startswith(Prefix))
+        start = int(ContinuationToken or 0)
+        page = keys[start:start + MaxKeys]
+        response = {
+            'Contents': [{'Key': key, 'Size': len(self._objects[(Bucket, key)])} for key in page],
+            'KeyCount': len(page),
+            'IsTruncated': start + MaxKeys < len(keys)
+        }
+        if response['IsTruncated']:
+            response['NextContinuationToken'] = str(start + MaxKeys)
+        return response
+
+    def get_paginator(self, operation_name):
+        if operation_name != 'list_objects_v2':
+            raise NotImplementedError(operation_name)
+        stub = self
+
+        class _Paginator:
+            def paginate(self, **kwargs):
+                token = None
+                while True:
+                    page = stub.list_objects_v2(**kwargs, **({'ContinuationToken': token} if token else {}))
+                    yield page
+                    token = page.get('NextContinuationToken')
+                    if not token:
+                        return
+
+        return _Paginator()
+
+    def keys(self, bucket: str, prefix: str = '') -> list:
+        """Keys stored in a bucket, without counting a request."""
+        with self._lock:
+            return sorted(key for b, key in self._objects if b == bucket and key.startswith(prefix))
+
+    def read(self, bucket: str, key: str) -> bytes:
+        """Object contents, without counting a request."""
+        return self._get(bucket, key, 'GetObject')
+
+
+class TextractStub(_Stub):
+    """Replays recorded get_expense_analysis responses.
+
+    Each fixture file holds the list of response pages of one job; started jobs
+    take the fixtures in turn. A job reports IN_PROGRESS for the first
+    polls_before_success get_expense_analysis calls, and jobs started with a
+    notification channel are queued for notifications().
+    """
+    service = 'textract'
+
+    def __init__(self, stats: RequestStats, latency_ms: float = 0.0, fixtures_dir: str = FIXTURES_DIR,
+                 polls_before_success: int = 0):
+        super().__init__(stats, latency_ms)
+        paths = sorted(glob.glob(os.path.join(fixtures_dir, '*.json')))
+        if not paths:
+            raise ValueError(f"No get_expense_analysis fixtures in {fixtures_dir}")
+        # Pages are kept as text so each replay pays for deserializing them, as boto3 would
+        self._fixtures = [[json.dumps(page) for page in json.load(open(path))] for path in paths]
+        self._polls_before_success = polls_before_success
+        self._jobs = {}
+        self._notifications = []
+        self._lock = threading.Lock()
+        self.exceptions = _Exceptions()
+
+    def start_expense_analysis(self, DocumentLocation, JobTag=None, NotificationChannel=None, **kwargs):
+        self._request('StartExpenseAnalysis')
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            sequence = len(self._jobs) + 1
+            self._jobs[job_id] = {
+                'pages': self._fixtures[(sequence - 1) % len(self._fixtures)],
+                'sequence': sequence,
+                'polls': self._polls_before_success
+            }
+            if NotificationChannel:
+                self._notifications.append({
+                    'JobId': job_id,
+                    'Status': 'SUCCEEDED',
+                    'API': 'StartExpenseAnalysis',
+                    'JobTag': JobTag,
+                    'DocumentLocation': {
+                        'S3ObjectName': DocumentLocation['S3Object']['Name'],
+                        'S3Bucket': DocumentLocation['S3Object']['Bucket']
+                    }
+                })
+        return {'JobId': job_id}
+
+    def get_expense_analysis(self, JobId, NextToken=None, MaxResults=None, **kwargs):
+        self._request('GetExpenseAnalysis')
+        with self._lock:
+            job = self._jobs.get(JobId)
+            if job is None:
+                raise _client_error('InvalidJobIdException', f'Job {JobId} does not exist', 'GetExpenseAnalysis')
+            if job['polls'] > 0:
+                job['polls'] -= 1
+                return {'JobStatus': 'IN_PROGRESS'}
+        page_idx = int(NextToken or 0)
+        response = json.loads(job['pages'][page_idx].replace(JOB_PLACEHOLDER, f"{job['sequence']:06d}"))
+        response['JobStatus'] = 'SUCCEEDED'
+        if page_idx + 1 < len(job['pages']):
+            response['NextToken'] = str(page_idx + 1)
+        return response
+
+    def notifications(self) -> list:
+        """Take the completion notifications of the jobs started with a notification channel."""
+        with self._lock:
+            notifications, self._notifications = self._notifications, []
+        return notifications
+
+
+class BedrockRuntimeStub(_Stub):
+    """Answers assignment prompts with a canned accountant after the injected latency."""
+    service = 'bedrock-runtime'
+
+    def __init__(self, stats: RequestStats, latency_ms: float = 0.0, accountant: str = 'Alice'):
+        super().__init__(stats, latency_ms)
+        self._accountant = accountant
+        self.exceptions = _Exceptions()
+
+    def invoke_model(self, modelId, body, **kwargs):
+        self._request('InvokeModel')
+        prompt = json.loads(body)['messages'][0]['content']
+        assignment = {'accountant': self._accountant, 'rule_matched': 'Benchmark canned response', 'confidence': 'high'}
+        if 'each identified by its id' in prompt:
+            ids = [int(line.split('.', 1)[0]) for line in prompt.splitlines()
+                   if line[:1].isdigit() and '. Vendor name:' in line]
+            text = json.dumps([dict(assignment, id=invoice_id) for invoice_id in ids])
+        else:
+            text = json.dumps(assignment)
+        # Roughly four characters per token
+        usage = {'input_tokens': len(prompt) // 4, 'output_tokens': len(text) // 4}
+        return {'body': io.BytesIO(json.dumps({'content': [{'type': 'text', 'text': text}], 'usage': usage}).encode())}
+
+
+class SesStub(_Stub):
+    service = 'ses'
+
+    def __init__(self, stats: RequestStats, latency_ms: float = 0.0):
+        super().__init__(stats, latency_ms)
+        self.sent = []
+        self.exceptions = _Exceptions()
+
+    def send_raw_email(self, **kwargs):
+        self._request('SendRawEmail')
+        self.sent.append(kwargs)
+        return {'MessageId': uuid.uuid4().hex}
+
+
+class StepFunctionsStub(_Stub):
+    """Records task token callbacks, which the harness reads as the waiting state's output."""
+    service = 'stepfunctions'
+
+    class TaskTimedOut(ClientError):
+        pass
+
+    class InvalidToken(ClientError):
+        pass
+
+    def __init__(self, stats: RequestStats, latency_ms: float = 0.0):
+        super().__init__(stats, latency_ms)
+        self.results = {}
+        self.executions = []
+        self._lock = threading.Lock()
+        self.exceptions = _Exceptions(TaskTimedOut=StepFunctionsStub.TaskTimedOut,
+                                      InvalidToken=StepFunctionsStub.InvalidToken)
+
+    def _resolve(self, task_token: str, result: dict, operation: str) -> dict:
+        with self._lock:
+            if task_token in self.results:
+                raise StepFunctionsStub.TaskTimedOut(
+                    {'Error': {'Code': 'TaskTimedOut', 'Message': 'Task already completed'}}, operation)
+            self.results[task_token] = result
+        return {}
+
+    def send_task_success(self, taskToken, output):
+        self._request('SendTaskSuccess')
+        return self._resolve(taskToken, {'output': json.loads(output)}, 'SendTaskSuccess')
+
+    def send_task_failure(self, taskToken, error=None, cause=None):
+        self._request('SendTaskFailure')
+        return self._resolve(taskToken, {'error': error, 'cause': cause}, 'SendTaskFailure')
+
+    def start_execution(self, stateMachineArn, input, **kwargs):
+        self._request('StartExecution')
+        with self._lock:
+            self.executions.append(json.loads(input))
+        return {'executionArn': f'{stateMachineArn}:{uuid.uuid4().hex}'}
+
+
+class StubSession:
+    """One stub per service, shared by every client the handlers create."""
+
+    def __init__(self, latency_ms: dict = None, fixtures_dir: str = FIXTURES_DIR, polls_before_success: int = 0,
+                 accountant: str = 'Alice'):
+        latency_ms = latency_ms or {}
+        self.stats = RequestStats()
+        self.s3 = S3Stub(self.stats, latency_ms.get('s3', 0.0))
+        self.textract = TextractStub(self.stats, latency_ms.get('textract', 0.0), fixtures_dir, polls_before_success)
+        self.bedrock = BedrockRuntimeStub(self.stats, latency_ms.get('bedrock-runtime', 0.0), accountant)
+        self.ses = SesStub(self.stats, latency_ms.get('ses', 0.0))
+        self.stepfunctions = StepFunctionsStub(self.stats, latency_ms.get('stepfunctions', 0.0))
+        self._clients = {
+            's3': self.s3,
+            'textract': self.textract,
+            'bedrock-runtime': self.bedrock,
+            'ses': self.ses,
+            'stepfunctions': self.stepfunctions
+        }
+
+    def client(self, service_name: str, *args, **kwargs):
+        # The botocore config (pool size, retries) has no effect on the stand-ins
+        try:
+            return self._clients[service_name]
+        except KeyError:
+            raise ValueError(f"No offline stand-in for the {service_name} client") from None
+
+
+def install(session: StubSession) -> types.ModuleType:
+    """Make `import boto3` resolve to the session's stubs; call before importing any handler."""
+    module = types.ModuleType('boto3')
+    module.client = session.client
+    module.session = types.SimpleNamespace(Session=lambda *args, **kwargs: session)
+    module.Session = module.session.Session
+    module.__stub_session__ = session
+    sys.modules['boto3'] = module
+    return module
@@ -0,0 +1,97 @@
+"""Measure the module import cost of each Lambda handler, the bulk of its cold start.
+
+Imports every handler module in a fresh interpreter with -X importtime, several
+times, and reports the median wall time of the import, the median total import
+time and the heaviest modules imported by the handler itself. Install a
+handler's requirements into the running interpreter before measuring it;
+handlers whose dependencies are missing are reported and skipped.
+
+    python benchmarks/cold_start.py --runs 5
+    python benchmarks/cold_start.py processExcelAttachment processDocAttachment
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAYER = os.path.join(ROOT, 'lambda', 'layers', 'common', 'python')
+
+# Handler directory and the module Lambda imports from it
+HANDLERS = {
+    'processIncomingEmail': 'index',
+    'detectInvoice': 'index',
+    'processPDFAttachment': 'index',
+    'processExcelAttachment': 'index',
+    'processDocAttachment': 'index',
+    'processEmailBody': 'index',
+    'processAttachments': 'index',
+    'textractAnalysis': 'startTextractJob',
+    'processTextractResults': 'index',
+    'sendDailyEmail': 'index',
+    'updateAccountAssignment': 'index'
+}
+
+# "import time:  self [us] | cumulative | imported package"
+IMPORT_TIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+def measure(handler_dir: str, module: str) -> dict:
+    env = dict(os.environ)
+    env.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    env['PYTHONPATH'] = os.pathsep.join([os.path.join(ROOT, 'lambda', handler_dir), LAYER])
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        env=env, capture_output=True, text=True
+    )
+    wall_ms = (time.perf_counter() - start) * 1000
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    total_us = 0
+    direct = {}
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if not match:
+            continue
+        # Nesting is shown by indentation: one space for the outermost imports,
+        # three for the modules they import directly
+        depth = len(match[3])
+        if depth == 1:
+            total_us += int(match[2])
+        elif depth == 3:
+            direct[match[4]] = direct.get(match[4], 0) + int(match[2])
+    return {
+        'wall_ms': wall_ms,
+        'import_ms': total_us / 1000,
+        'direct': direct
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('handlers', nargs='*', default=list(HANDLERS), help='handler directories under lambda/')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=5, help='heaviest handler imports to show')
+    args = parser.parse_args()
+
+    print(f"{'handler':<26} {'p50 wall ms':>12} {'p50 import ms':>14}  heaviest imports")
+    for handler_dir in args.handlers:
+        try:
+            runs = [measure(handler_dir, HANDLERS[handler_dir]) for _ in range(args.runs)]
+        except RuntimeError as e:
+            print(f"{handler_dir:<26} skipped: {e}")
+            continue
+        wall = statistics.median(run['wall_ms'] for run in runs)
+        imports = statistics.median(run['import_ms'] for run in runs)
+        heaviest = sorted(runs[-1]['direct'].items(), key=lambda item: item[1], reverse=True)[:args.top]
+        print(f"{handler_dir:<26} {wall:>12.0f} {imports:>14.0f}  "
+              + ', '.join(f"{name} {us / 1000:.0f}" for name, us in heaviest))
+
+
+if __name__ == '__main__':
+    main()
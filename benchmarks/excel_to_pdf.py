@@ -0,0 +1,69 @@
+"""Time the Excel-to-PDF conversion of processExcelAttachment on a large sheet.
+
+Builds a vendor remittance-like workbook in memory and times streaming it
+into a PDF, without touching AWS. Peak RSS is reported so memory growth with
+workbook size can be compared against the Lambda's memory limit.
+
+    python benchmarks/excel_to_pdf.py --rows 50000 --sheets 2
+"""
+import argparse
+import datetime
+import io
+import os
+import resource
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [
+    os.path.join(ROOT, 'lambda', 'layers', 'common', 'python'),
+    os.path.join(ROOT, 'lambda', 'processExcelAttachment')
+]
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+from openpyxl import Workbook  # noqa: E402
+
+import index  # noqa: E402
+
+
+def build_workbook(rows: int, sheets: int = 1) -> bytes:
+    vendors = ['Acme Supply Co', 'Workquest', 'Northern Pipe & Valve', 'City Electric', None]
+    workbook = Workbook(write_only=True)
+    for sheet_idx in range(sheets):
+        sheet = workbook.create_sheet(f'Remittance {sheet_idx + 1}')
+        sheet.append(['Invoice', 'Vendor', 'Invoice Date', 'Amount', 'Memo'])
+        for i in range(rows):
+            sheet.append([
+                f'INV-{i:07d}',
+                vendors[i % len(vendors)],
+                datetime.datetime(2024, 1, 1) + datetime.timedelta(hours=i),
+                round(i * 1.37 % 10000, 2),
+                'Remittance for services rendered during the billing period, see attached statement' if i % 7 == 0 else None
+            ])
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--sheets', type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"Building a workbook of {args.sheets} sheet(s) with {args.rows} rows each...")
+    workbook = build_workbook(args.rows, args.sheets)
+    print(f"Workbook size: {len(workbook) / 1024 / 1024:.1f} MB")
+
+    start = time.perf_counter()
+    pdf = index.create_pdf_from_excel(index.extract_excel_data(workbook))
+    seconds = time.perf_counter() - start
+
+    # ru_maxrss is in kilobytes on Linux
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"Read and render: {seconds:.2f} s ({len(pdf) / 1024 / 1024:.1f} MB PDF)")
+    print(f"Peak RSS: {peak_mb:.0f} MB")
+
+
+if __name__ == '__main__':
+    main()
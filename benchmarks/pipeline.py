@@ -0,0 +1,365 @@
+"""Drive a synthetic email corpus through the Lambda handlers, offline.
+
+Runs the invoice branch of the state machine in process: detectInvoice, the
+attachment converters (batched through processAttachments, or one invocation
+per attachment above the map threshold), startTextractJob, the SNS callback
+through textractCompletion, and processTextractResults. AWS is replaced by the in-memory stand-ins of
+aws_stubs: Textract replays the get_expense_analysis fixtures under
+fixtures/expense_analysis and Bedrock answers with a canned assignment, each
+with an optional injected latency.
+
+Emails carry PDF, Excel (labelled invoice cells, read directly) and Word
+(unlabelled letter, rendered to PDF) attachments, or none so the body is
+converted. Reports per-stage latency, emails per minute and the requests made
+to each service. Excel and Word attachments need openpyxl and python-docx, and
+the converters reportlab.
+
+    python benchmarks/pipeline.py --emails 200 --attachments 3 --executions 8
+    python benchmarks/pipeline.py --mix pdf=1 --s3-ms 15 --bedrock-ms 800
+"""
+import argparse
+import contextlib
+import datetime
+import importlib.util
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from email.message import EmailMessage
+from email.utils import format_datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAMBDA = os.path.join(ROOT, 'lambda')
+sys.path[:0] = [
+    os.path.dirname(os.path.abspath(__file__)),
+    os.path.join(LAMBDA, 'layers', 'common', 'python'),
+    os.path.join(LAMBDA, 'textractAnalysis'),
+    os.path.join(LAMBDA, 'processTextractResults')
+]
+
+import aws_stubs  # noqa: E402
+
+EMAIL_BUCKET = 'benchmark-email'
+ARTEFACT_BUCKET = 'benchmark-artefact'
+RESULT_BUCKET = 'benchmark-result'
+ENVIRONMENT = {
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'EMAIL_BUCKET_NAME': EMAIL_BUCKET,
+    'INPUT_BUCKET_NAME': EMAIL_BUCKET,
+    'ARTEFACT_BUCKET_NAME': ARTEFACT_BUCKET,
+    'RESULT_BUCKET_NAME': RESULT_BUCKET,
+    'TIMEZONE': 'America/Chicago',
+    'TEXTRACT_SNS_TOPIC_ARN': 'arn:aws:sns:us-east-1:000000000000:benchmark-textract',
+    'TEXTRACT_ROLE_ARN': 'arn:aws:iam::000000000000:role/benchmark-textract',
+    'SENDER_EMAIL': 'reports@example.com',
+    'RECIPIENT_EMAILS': 'ap@example.com'
+}
+RULES = """Vendor Acme Supply Co goes to Alice
+Vendor Northern Pipe & Valve goes to Bob
+Invoices from @citylectric.example go to Carol
+"""
+# As in the stack: emails with more attachments fan out over the Process Attachments map
+MAP_ATTACHMENT_THRESHOLD = 20
+MAP_MAX_CONCURRENCY = 5
+NOTIFICATION_CONCURRENCY = 16
+# Converter modules as processAttachments imports them from its bundle
+CONVERTERS = {
+    'pdf_attachment': 'processPDFAttachment',
+    'excel_attachment': 'processExcelAttachment',
+    'doc_attachment': 'processDocAttachment',
+    'email_body': 'processEmailBody'
+}
+# Report order; converters are indented under the batch that invokes them
+STAGE_ORDER = ['detectInvoice', 'processAttachments', *CONVERTERS.values(), 'startTextractJob',
+               'textractCompletion', 'processTextractResults', 'sendDailyEmail', 'email (end to end)']
+ATTACHMENT_TYPES = {
+    'pdf': ('pdf', 'application', 'pdf'),
+    'excel': ('xlsx', 'application', 'vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    'doc': ('docx', 'application', 'vnd.openxmlformats-officedocument.wordprocessingml.document')
+}
+VENDORS = [
+    ('Acme Supply Co', 'acme.example'),
+    ('Northern Pipe & Valve', 'northernpipe.example'),
+    ('City Electric', 'citylectric.example')
+]
+
+
+def _pdf(text: str) -> bytes:
+    stream = f'BT /F1 12 Tf 72 720 Td ({text}) Tj ET'.encode()
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+        b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R '
+        b'/Resources << /Font << /F1 << /Type /Font /Subtype /Type1 /BaseFont /Helvetica >> >> >> >>',
+        b'<< /Length %d >>\nstream\n%s\nendstream' % (len(stream), stream)
+    ]
+    out = io.BytesIO(b'%PDF-1.4\n')
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(out.tell())
+        out.write(b'%d 0 obj\n%s\nendobj\n' % (number, body))
+    xref = out.tell()
+    out.write(b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1))
+    out.write(b''.join(b'%010d 00000 n \n' % offset for offset in offsets))
+    out.write(b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref))
+    return out.getvalue()
+
+
+def _xlsx(vendor: str, number: str, lines: int) -> bytes:
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Invoice')
+    sheet.append(['Vendor', vendor])
+    sheet.append(['Invoice #', number])
+    sheet.append([])
+    sheet.append(['Item', 'Qty', 'Amount'])
+    total = 0.0
+    for i in range(lines):
+        amount = round((i + 1) * 17.35, 2)
+        total += amount
+        sheet.append([f'Part {i}', i % 5 + 1, amount])
+    sheet.append(['Total', None, round(total, 2)])
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+def _docx(vendor: str, number: str, lines: int) -> bytes:
+    from docx import Document
+    document = Document()
+    document.add_paragraph(vendor)
+    document.add_paragraph(f'Please find below the charges for order {number}.')
+    table = document.add_table(rows=1, cols=3)
+    table.rows[0].cells[0].text, table.rows[0].cells[1].text, table.rows[0].cells[2].text = 'Item', 'Qty', 'Amount'
+    for i in range(lines):
+        cells = table.add_row().cells
+        cells[0].text, cells[1].text, cells[2].text = f'Part {i}', str(i % 5 + 1), f'{(i + 1) * 17.35:.2f}'
+    document.add_paragraph('Thank you for your business.')
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+
+def build_corpus(emails: int, attachments: int, mix: dict, repeat_rate: float, seed: int) -> list:
+    """Return (message_id, raw email) pairs; repeated attachments reuse earlier bytes exactly."""
+    rng = random.Random(seed)
+    kinds = list(mix)
+    weights = [mix[kind] for kind in kinds]
+    sent = {kind: [] for kind in ATTACHMENT_TYPES}
+    now = datetime.datetime.now(datetime.timezone(datetime.timedelta(hours=-6)))
+    corpus = []
+    for email_idx in range(emails):
+        vendor, domain = VENDORS[email_idx % len(VENDORS)]
+        message = EmailMessage()
+        message['From'] = f'Billing <billing@{domain}>'
+        message['To'] = 'ap@example.com'
+        message['Subject'] = f'Invoice {email_idx}'
+        message['Date'] = format_datetime(now)
+        message['Message-ID'] = f'<{uuid.uuid4().hex}@{domain}>'
+        if rng.choices(kinds, weights)[0] == 'body':
+            message.set_content(f'Invoice #: EB-{email_idx:06d}\nVendor: {vendor}\nTotal due: ${rng.randint(50, 5000)}.00\n')
+        else:
+            message.set_content('Please see the attached invoices.')
+            for attachment_idx in range(attachments):
+                kind = rng.choices([k for k in kinds if k != 'body'], [mix[k] for k in kinds if k != 'body'])[0]
+                extension, maintype, subtype = ATTACHMENT_TYPES[kind]
+                number = f'{kind[:2].upper()}-{email_idx:06d}-{attachment_idx}'
+                if sent[kind] and rng.random() < repeat_rate:
+                    data = rng.choice(sent[kind])
+                elif kind == 'pdf':
+                    data = _pdf(f'{vendor} invoice {number}')
+                elif kind == 'excel':
+                    data = _xlsx(vendor, number, rng.randint(5, 60))
+                else:
+                    data = _docx(vendor, number, rng.randint(5, 60))
+                sent[kind].append(data)
+                message.add_attachment(data, maintype=maintype, subtype=subtype, filename=f'{number}.{extension}')
+        corpus.append((uuid.uuid4().hex, message.as_bytes()))
+    return corpus
+
+
+def _load(name: str, handler_dir: str, module: str = 'index'):
+    """Import a handler module under a unique name, with its directory importable."""
+    path = os.path.join(LAMBDA, handler_dir)
+    if path not in sys.path:
+        sys.path.insert(0, path)
+    spec = importlib.util.spec_from_file_location(name, os.path.join(path, f'{module}.py'))
+    loaded = importlib.util.module_from_spec(spec)
+    sys.modules[name] = loaded
+    spec.loader.exec_module(loaded)
+    return loaded
+
+
+class StageTimer:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}
+
+    def record(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.samples.setdefault(stage, []).append(seconds)
+
+    def timed(self, stage: str, func):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - start)
+        return wrapper
+
+
+class Pipeline:
+    def __init__(self, session: aws_stubs.StubSession, timer: StageTimer):
+        self.session = session
+        self.timer = timer
+        self.failures = []
+        self.detect_invoice = _load('detect_invoice', 'detectInvoice')
+        # processAttachments imports the converters by their bundled names
+        self.converters = {}
+        for module_name, handler_dir in CONVERTERS.items():
+            converter = _load(module_name, handler_dir)
+            converter.handler = timer.timed(f'  {handler_dir}', converter.handler)
+            self.converters[module_name] = converter
+        self.process_attachments = _load('process_attachments', 'processAttachments')
+        self.start_textract_job = _load('startTextractJob', 'textractAnalysis', 'startTextractJob')
+        self.textract_completion = _load('textractCompletion', 'textractAnalysis', 'textractCompletion')
+        self.process_textract_results = _load('process_textract_results', 'processTextractResults')
+
+    def _stage(self, stage: str, handler, event):
+        return self.timer.timed(stage, handler)(event, None)
+
+    def _deliver_notifications(self) -> None:
+        # Whichever execution finds notifications delivers them, as SNS would to any Lambda instance
+        notifications = self.session.textract.notifications()
+        if not notifications:
+            return
+        # One invocation per notification, run concurrently as Lambda scales out for SNS
+        with ThreadPoolExecutor(max_workers=min(len(notifications), NOTIFICATION_CONCURRENCY)) as executor:
+            list(executor.map(
+                lambda notification: self._stage('textractCompletion', self.textract_completion.handler, {
+                    'Records': [{'Sns': {'Message': json.dumps(notification)}}]
+                }),
+                notifications
+            ))
+
+    def _wait_for_textract(self, items: list, timeout: float = 60.0) -> dict:
+        task_token = uuid.uuid4().hex
+        self._stage('startTextractJob', self.start_textract_job.handler, {'taskToken': task_token, 'items': items})
+        deadline = time.monotonic() + timeout
+        while task_token not in self.session.stepfunctions.results:
+            if time.monotonic() > deadline:
+                raise TimeoutError('Textract callback never arrived')
+            self._deliver_notifications()
+            time.sleep(0.001)
+        callback = self.session.stepfunctions.results[task_token]
+        if 'output' not in callback:
+            return {'jobStatus': 'FAILED', 'error': callback['cause']}
+        return callback['output']
+
+    def run_email(self, message_id: str, raw_email: bytes) -> None:
+        start = time.perf_counter()
+        self.session.s3.put_object(Bucket=EMAIL_BUCKET, Key=message_id, Body=raw_email)
+        detected = self._stage('detectInvoice', self.detect_invoice.handler, {'messageId': message_id})
+        attachments = detected['attachments']
+
+        if len(attachments) > MAP_ATTACHMENT_THRESHOLD:
+            def convert(attachment):
+                module_name = self.process_attachments.CONVERTERS.get(attachment['type'], 'email_body')
+                event = dict(attachment, messageId=message_id, bucketName=detected['bucketName'])
+                return self.converters[module_name].handler(event, None)
+            with ThreadPoolExecutor(max_workers=MAP_MAX_CONCURRENCY) as executor:
+                items = list(executor.map(convert, attachments))
+        else:
+            items = self._stage('processAttachments', self.process_attachments.handler, detected)
+
+        textract = self._wait_for_textract(items)
+        if textract.get('jobStatus') != 'SUCCEEDED':
+            self.failures.append((message_id, textract.get('error', 'Textract job failed')))
+            return
+        self._stage('processTextractResults', self.process_textract_results.handler, textract)
+        self.timer.record('email (end to end)', time.perf_counter() - start)
+
+
+def _percentile(samples: list, fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def report(timer: StageTimer, session: aws_stubs.StubSession, emails: int, elapsed: float, failures: list) -> None:
+    print(f"\n{emails} email(s) in {elapsed:.2f}s: {emails / elapsed * 60:.0f} emails/min"
+          + (f", {len(failures)} failed" if failures else ''))
+    print(f"\n{'stage':<28} {'calls':>6} {'p50 ms':>9} {'p95 ms':>9} {'total s':>9}")
+    stages = sorted(timer.samples, key=lambda stage: STAGE_ORDER.index(stage.strip()) if stage.strip() in STAGE_ORDER else len(STAGE_ORDER))
+    for stage in stages:
+        samples = timer.samples[stage]
+        print(f"{stage:<28} {len(samples):>6} {statistics.median(samples) * 1000:>9.1f} "
+              f"{_percentile(samples, 0.95) * 1000:>9.1f} {sum(samples):>9.2f}")
+    print(f"\n{'service':<16} {'operation':<22} {'requests':>9} {'per email':>10}")
+    for (service, operation), count in sorted(session.stats.snapshot().items()):
+        print(f"{service:<16} {operation:<22} {count:>9} {count / emails:>10.1f}")
+    for message_id, error in failures[:5]:
+        print(f"failed {message_id}: {error}")
+
+
+def _parse_mix(text: str) -> dict:
+    mix = {}
+    for item in text.split(','):
+        kind, _, weight = item.partition('=')
+        if kind not in ATTACHMENT_TYPES and kind != 'body':
+            raise argparse.ArgumentTypeError(f"unknown attachment type {kind}")
+        mix[kind] = float(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--emails', type=int, default=50)
+    parser.add_argument('--attachments', type=int, default=2, help='attachments per email that has any')
+    parser.add_argument('--mix', type=_parse_mix, default=_parse_mix('pdf=6,excel=2,doc=1,body=1'),
+                        help='relative weight of each attachment type; body means an email without attachments')
+    parser.add_argument('--repeat-rate', type=float, default=0.0, help='share of attachments resent unchanged')
+    parser.add_argument('--executions', type=int, default=4, help='state machine executions run concurrently')
+    parser.add_argument('--fixtures', default=aws_stubs.FIXTURES_DIR, help='directory of get_expense_analysis fixtures')
+    parser.add_argument('--s3-ms', type=float, default=0.0, help='latency injected per S3 request')
+    parser.add_argument('--textract-ms', type=float, default=0.0, help='latency injected per Textract request')
+    parser.add_argument('--bedrock-ms', type=float, default=0.0, help='latency injected per Bedrock request')
+    parser.add_argument('--report', action='store_true', help='also compact the day and send the daily report')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--verbose', action='store_true', help='show the handlers\' own output')
+    args = parser.parse_args()
+
+    os.environ.update(ENVIRONMENT)
+    session = aws_stubs.StubSession(
+        latency_ms={'s3': args.s3_ms, 'textract': args.textract_ms, 'bedrock-runtime': args.bedrock_ms},
+        fixtures_dir=args.fixtures
+    )
+    aws_stubs.install(session)
+    timer = StageTimer()
+    pipeline = Pipeline(session, timer)
+
+    corpus = build_corpus(args.emails, args.attachments, args.mix, args.repeat_rate, args.seed)
+    session.s3.put_object(Bucket=ARTEFACT_BUCKET, Key='account_assignment_rules.txt', Body=RULES)
+    session.stats.counts.clear()
+
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    start = time.perf_counter()
+    with output:
+        with ThreadPoolExecutor(max_workers=args.executions) as executor:
+            for future in [executor.submit(pipeline.run_email, *email) for email in corpus]:
+                future.result()
+        elapsed = time.perf_counter() - start
+        if args.report:
+            send_daily_email = _load('send_daily_email', 'sendDailyEmail')
+            pipeline._stage('sendDailyEmail', send_daily_email.handler, {})
+    report(timer, session, args.emails, elapsed, pipeline.failures)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+import csv
+import datetime
+import io
+import os
+import re
+from typing import Dict, List
+from aws_clients import get_client
+import metrics
+import ledger
+
+s3 = get_client('s3')
+
+DAILY_CSV = re.compile(r'^(\d{4}-\d{2}-\d{2})_(invoices|logs)\.csv$')
+# Days looked back when picking the months to rebuild, so the previous month is
+# finished off during the first days of a new one
+LOOKBACK_DAYS = 7
+
+
+def months_to_compact(event: dict) -> List[str]:
+    """Months given in the event (e.g. a backfill), or the current and recent ones."""
+    if event.get('months'):
+        return sorted(set(event['months']))
+    # Same reporting day as sendDailyEmail
+    today = datetime.datetime.now(datetime.timezone(datetime.timedelta(hours=-6))).date()
+    return sorted({today.strftime('%Y-%m'), (today - datetime.timedelta(days=LOOKBACK_DAYS)).strftime('%Y-%m')})
+
+
+def list_keys(bucket: str, prefix: str) -> List[str]:
+    keys = []
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        keys.extend(obj['Key'] for obj in page.get('Contents', []))
+    return keys
+
+
+def read_daily_csvs(bucket: str, month: str) -> Dict[str, Dict[str, List[dict]]]:
+    """Rows of the month's daily CSVs, by suffix and report date."""
+    daily = {'invoices': {}, 'logs': {}}
+    for key in list_keys(bucket, f'{month}-'):
+        match = DAILY_CSV.match(key)
+        if not match:
+            continue
+        with metrics.span('S3Get') as span:
+            body = s3.get_object(Bucket=bucket, Key=key)['Body'].read()
+            span.add('Bytes', len(body), 'Bytes')
+        daily[match[2]][match[1]] = list(csv.DictReader(io.StringIO(body.decode('utf-8'))))
+    return daily
+
+
+def read_parquet(bucket: str, key: str) -> List[dict]:
+    try:
+        with metrics.span('S3Get') as span:
+            body = s3.get_object(Bucket=bucket, Key=key)['Body'].read()
+            span.add('Bytes', len(body), 'Bytes')
+    except s3.exceptions.NoSuchKey:
+        return []
+    return ledger.from_parquet(body)
+
+
+def read_ledger_month(bucket: str, month: str) -> Dict[str, List[dict]]:
+    """Records already in the ledger for a month, by kind."""
+    invoices = []
+    for key in list_keys(bucket, ledger.invoices_month_prefix(month)):
+        invoices.extend(read_parquet(bucket, key))
+    return {'invoices': invoices, 'logs': read_parquet(bucket, ledger.logs_key(month))}
+
+
+def put_parquet(bucket: str, key: str, data: bytes) -> None:
+    with metrics.span('S3Put') as span:
+        s3.put_object(Bucket=bucket, Key=key, Body=data, ContentType='application/vnd.apache.parquet')
+        span.add('Bytes', len(data), 'Bytes')
+
+
+def compact_month(result_bucket: str, ledger_bucket: str, month: str) -> dict:
+    """Rebuild a month of the ledger from its daily CSVs.
+
+    Days that still have a daily CSV are rewritten from it, so running it again,
+    or after an invoice was reassigned, leaves no stale rows behind. Rows of
+    days whose CSVs have already expired from the result bucket are kept from
+    the existing ledger, so a backfill of an older month loses nothing.
+    """
+    print(f"Compacting ledger month [{month}]")
+    daily = read_daily_csvs(result_bucket, month)
+    if not daily['invoices'] and not daily['logs']:
+        print(f"No daily CSVs found for [{month}]")
+        return {'month': month, 'days': 0, 'invoices': 0, 'logs': 0}
+
+    existing = read_ledger_month(ledger_bucket, month)
+    kept = {
+        kind: [record for record in existing[kind] if record['ReportDate'] not in daily[kind]]
+        for kind in ('invoices', 'logs')
+    }
+    invoices = kept['invoices'] + [
+        record
+        for report_date, rows in sorted(daily['invoices'].items())
+        for record in ledger.invoice_records(report_date, rows)
+    ]
+    logs = kept['logs'] + [
+        record
+        for report_date, rows in sorted(daily['logs'].items())
+        for record in ledger.log_records(report_date, rows)
+    ]
+    kept_days = {record['ReportDate'] for records in kept.values() for record in records}
+    if kept_days:
+        print(f"Keeping ledger rows of {len(kept_days)} day(s) of [{month}] without daily CSVs")
+
+    by_accountant = {}
+    for record in invoices:
+        by_accountant.setdefault(record['AcctAssigned'], []).append(record)
+
+    with metrics.span('LedgerCompaction') as span:
+        written = set()
+        for accountant, records in by_accountant.items():
+            key = ledger.invoices_key(month, accountant)
+            put_parquet(ledger_bucket, key, ledger.to_parquet(
+                records, ledger.INVOICE_SCHEMA, ['VendorKey', 'InvoiceKey'], ledger.ROW_GROUP_SIZE))
+            written.add(key)
+        # Accountants with no invoices left in the month
+        for key in list_keys(ledger_bucket, ledger.invoices_month_prefix(month)):
+            if key not in written:
+                print(f"Removing stale ledger partition [{key}]")
+                s3.delete_object(Bucket=ledger_bucket, Key=key)
+
+        put_parquet(ledger_bucket, ledger.logs_key(month), ledger.to_parquet(
+            logs, ledger.LOG_SCHEMA, ['Timestamp'], ledger.ROW_GROUP_SIZE))
+        put_parquet(ledger_bucket, ledger.invoice_index_key(month), ledger.to_parquet(
+            ledger.invoice_index_records(invoices), ledger.INVOICE_INDEX_SCHEMA, ['InvoiceKey'], ledger.INDEX_ROW_GROUP_SIZE))
+        put_parquet(ledger_bucket, ledger.vendor_index_key(month), ledger.to_parquet(
+            ledger.vendor_index_records(invoices), ledger.VENDOR_INDEX_SCHEMA, ['VendorKey'], ledger.INDEX_ROW_GROUP_SIZE))
+        span.add('Invoices', len(invoices))
+        span.add('Logs', len(logs))
+
+    days = len(set(daily['invoices']) | set(daily['logs']))
+    print(f"Compacted {days} day(s) of [{month}]: {len(invoices)} invoice(s) for {len(by_accountant)} accountant(s), {len(logs)} log row(s)")
+    return {'month': month, 'days': days, 'keptDays': len(kept_days), 'invoices': len(invoices), 'logs': len(logs)}
+
+
+def handler(event, context):
+    result_bucket = os.environ['RESULT_BUCKET_NAME']
+    ledger_bucket = os.environ['LEDGER_BUCKET_NAME']
+    event = event if isinstance(event, dict) else {}
+    try:
+        months = [compact_month(result_bucket, ledger_bucket, month) for month in months_to_compact(event)]
+        return {
+            'statusCode': 200,
+            'months': months
+        }
+    except Exception as e:
+        print(f"Error compacting ledger: {str(e)}")
+        return {
+            'statusCode': 500,
+            'error': str(e)
+        }
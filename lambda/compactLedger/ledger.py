@@ -0,0 +1,135 @@
+import io
+from typing import Dict, List
+from urllib.parse import quote, unquote
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from invoice_keys import normalize_invoice_number, normalize_vendor, parse_amount
+
+LEDGER_PREFIX = 'ledger'
+# Rows per row group: each group carries min/max statistics, so a lookup reads
+# the footer and the few groups whose range can hold the value
+ROW_GROUP_SIZE = 5000
+INDEX_ROW_GROUP_SIZE = 1024
+UNASSIGNED = '__unassigned__'
+
+INVOICE_SCHEMA = pa.schema([
+    ('ReportDate', pa.string()),
+    ('ReceiptDate', pa.string()),
+    ('ReceiptTime', pa.string()),
+    ('InvoiceNbr', pa.string()),
+    ('VendorName', pa.string()),
+    ('Amount', pa.string()),
+    ('AmountValue', pa.float64()),
+    ('AcctAssigned', pa.string()),
+    ('VendorKey', pa.string()),
+    ('InvoiceKey', pa.string())
+])
+LOG_SCHEMA = pa.schema([
+    ('ReportDate', pa.string()),
+    ('Timestamp', pa.string()),
+    ('MessageId', pa.string()),
+    ('InvoiceNbr', pa.string()),
+    ('Status', pa.string()),
+    ('ErrorReason', pa.string()),
+    ('LLMConfidence', pa.string()),
+    ('AssignmentCache', pa.string()),
+    ('DuplicateOf', pa.string())
+])
+INVOICE_INDEX_SCHEMA = pa.schema([
+    ('InvoiceKey', pa.string()),
+    ('VendorKey', pa.string()),
+    ('AcctAssigned', pa.string())
+])
+VENDOR_INDEX_SCHEMA = pa.schema([
+    ('VendorKey', pa.string()),
+    ('AcctAssigned', pa.string()),
+    ('Invoices', pa.int64())
+])
+
+
+def partition_value(value: str) -> str:
+    return quote(value, safe='') if value else UNASSIGNED
+
+
+def partition_name(value: str) -> str:
+    return '' if value == UNASSIGNED else unquote(value)
+
+
+def invoices_key(month: str, accountant: str) -> str:
+    return f"{LEDGER_PREFIX}/invoices/month={month}/accountant={partition_value(accountant)}/invoices.parquet"
+
+
+def invoices_month_prefix(month: str) -> str:
+    return f"{LEDGER_PREFIX}/invoices/month={month}/"
+
+
+def logs_key(month: str) -> str:
+    return f"{LEDGER_PREFIX}/logs/month={month}/logs.parquet"
+
+
+def invoice_index_key(month: str) -> str:
+    return f"{LEDGER_PREFIX}/index/month={month}/by_invoice.parquet"
+
+
+def vendor_index_key(month: str) -> str:
+    return f"{LEDGER_PREFIX}/index/month={month}/by_vendor.parquet"
+
+
+def invoice_records(report_date: str, rows: List[Dict[str, str]]) -> List[dict]:
+    """Ledger records of the rows of a daily invoices CSV."""
+    return [
+        {
+            'ReportDate': report_date,
+            'ReceiptDate': row.get('ReceiptDate', ''),
+            'ReceiptTime': row.get('ReceiptTime', ''),
+            'InvoiceNbr': row.get('InvoiceNbr', ''),
+            'VendorName': row.get('VendorName', ''),
+            'Amount': row.get('Amount', ''),
+            'AmountValue': parse_amount(row.get('Amount', '')),
+            'AcctAssigned': row.get('AcctAssigned', ''),
+            'VendorKey': normalize_vendor(row.get('VendorName', '')),
+            'InvoiceKey': normalize_invoice_number(row.get('InvoiceNbr', ''))
+        }
+        for row in rows
+    ]
+
+
+def log_records(report_date: str, rows: List[Dict[str, str]]) -> List[dict]:
+    """Ledger records of the rows of a daily logs CSV; columns added later are empty in older days."""
+    return [
+        dict({name: row.get(name) or '' for name in LOG_SCHEMA.names}, ReportDate=report_date)
+        for row in rows
+    ]
+
+
+def to_parquet(records: List[dict], schema: pa.Schema, sort_by: List[str], row_group_size: int) -> bytes:
+    """Serialize records sorted on the columns lookups filter by, so row group statistics are selective."""
+    table = pa.Table.from_pylist(records, schema=schema)
+    if sort_by and table.num_rows:
+        table = table.sort_by([(column, 'ascending') for column in sort_by])
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer, row_group_size=row_group_size, compression='zstd', write_statistics=True)
+    return buffer.getvalue()
+
+
+def from_parquet(data: bytes) -> List[dict]:
+    return pq.read_table(io.BytesIO(data)).to_pylist()
+
+
+def invoice_index_records(records: List[dict]) -> List[dict]:
+    return [
+        {'InvoiceKey': record['InvoiceKey'], 'VendorKey': record['VendorKey'], 'AcctAssigned': record['AcctAssigned']}
+        for record in records
+    ]
+
+
+def vendor_index_records(records: List[dict]) -> List[dict]:
+    counts = {}
+    for record in records:
+        key = (record['VendorKey'], record['AcctAssigned'])
+        counts[key] = counts.get(key, 0) + 1
+    return [
+        {'VendorKey': vendor_key, 'AcctAssigned': accountant, 'Invoices': count}
+        for (vendor_key, accountant), count in counts.items()
+    ]
@@ -0,0 +1,198 @@
+"""Look up invoices in the Parquet ledger written by compactLedger.
+
+Lookups go through the month indexes first, so only the partitions that hold
+the vendor or invoice number are opened, and inside each file only the row
+groups whose min/max statistics can match are downloaded, with ranged GETs.
+
+    python ledger_query.py --bucket <ledger bucket> invoice INV-1042 [--vendor "Acme Supply Co"]
+    python ledger_query.py --bucket <ledger bucket> vendor "Acme Supply Co" --from 2024-07-01 --to 2024-09-30
+"""
+import datetime
+import io
+import os
+import sys
+from typing import List, Optional
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from botocore.exceptions import ClientError
+
+if __name__ == '__main__':
+    # Run from a checkout, the shared layer is not on the path as it is in Lambda
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'layers', 'common', 'python'))
+
+import ledger
+
+# Read with the first request on a file: as much as the Parquet reader asks for
+# when it looks for the footer, so a small file costs a single GET
+TAIL_SIZE = 64 * 1024
+DEFAULT_LOOKBACK_DAYS = 365
+
+
+class S3RangeFile(io.RawIOBase):
+    """Seekable read-only view of an S3 object that fetches only the byte ranges read."""
+
+    def __init__(self, s3_client, bucket: str, key: str, size: int, stats: dict):
+        self._s3 = s3_client
+        self._bucket = bucket
+        self._key = key
+        self._size = size
+        self._pos = 0
+        self._stats = stats
+        self._tail_start = max(0, size - TAIL_SIZE)
+        self._tail = None
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: self._size}[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def _get_range(self, start: int, end: int) -> bytes:
+        response = self._s3.get_object(Bucket=self._bucket, Key=self._key, Range=f'bytes={start}-{end - 1}')
+        data = response['Body'].read()
+        self._stats['requests'] += 1
+        self._stats['bytes'] += len(data)
+        return data
+
+    def readinto(self, buffer) -> int:
+        end = min(self._size, self._pos + len(buffer))
+        if end <= self._pos:
+            return 0
+        if self._pos >= self._tail_start:
+            if self._tail is None:
+                self._tail = self._get_range(self._tail_start, self._size)
+            data = self._tail[self._pos - self._tail_start:end - self._tail_start]
+        else:
+            data = self._get_range(self._pos, end)
+        buffer[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+
+def month_range(start: datetime.date, end: datetime.date) -> List[str]:
+    months = []
+    year, month = start.year, start.month
+    while (year, month) <= (end.year, end.month):
+        months.append(f'{year:04d}-{month:02d}')
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+def report_months(start: datetime.date, end: datetime.date) -> List[str]:
+    """Months whose partitions can hold invoices received between start and end.
+
+    Partitions are keyed by the report date, the next business day after
+    receipt, so invoices received at the end of a month can sit in the next one.
+    """
+    next_month = datetime.date(end.year + end.month // 12, end.month % 12 + 1, 1)
+    return month_range(start, next_month)
+
+
+class LedgerQuery:
+    def __init__(self, s3_client, bucket: str):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        # Requests and bytes of the reads so far
+        self.stats = {'requests': 0, 'bytes': 0}
+
+    def _open(self, key: str) -> Optional[pq.ParquetFile]:
+        try:
+            size = self.s3_client.head_object(Bucket=self.bucket, Key=key)['ContentLength']
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                return None
+            raise
+        self.stats['requests'] += 1
+        return pq.ParquetFile(S3RangeFile(self.s3_client, self.bucket, key, size, self.stats))
+
+    def read(self, key: str, column: str, low: str, high: Optional[str] = None, columns: Optional[List[str]] = None) -> pa.Table:
+        """Rows of a ledger file whose column lies in [low, high], reading only row groups that can hold them."""
+        high = low if high is None else high
+        parquet_file = self._open(key)
+        if parquet_file is None:
+            return pa.table({})
+        metadata = parquet_file.metadata
+        column_idx = parquet_file.schema_arrow.get_field_index(column)
+        row_groups = []
+        for i in range(metadata.num_row_groups):
+            statistics = metadata.row_group(i).column(column_idx).statistics
+            if statistics is None or not statistics.has_min_max or (statistics.min <= high and statistics.max >= low):
+                row_groups.append(i)
+        if not row_groups:
+            return parquet_file.schema_arrow.empty_table()
+        table = parquet_file.read_row_groups(row_groups, columns=columns)
+        mask = pc.and_(pc.greater_equal(table[column], low), pc.less_equal(table[column], high))
+        return table.filter(mask)
+
+    def find_invoice(self, invoice_number: str, vendor_name: Optional[str] = None,
+                     start: Optional[datetime.date] = None, end: Optional[datetime.date] = None) -> List[dict]:
+        """Ledger rows of an invoice number received between start and end, optionally for one vendor, newest months first."""
+        end = end or datetime.date.today()
+        start = start or end - datetime.timedelta(days=DEFAULT_LOOKBACK_DAYS)
+        invoice_key = ledger.normalize_invoice_number(invoice_number)
+        vendor_key = ledger.normalize_vendor(vendor_name) if vendor_name else None
+        rows = []
+        for month in reversed(report_months(start, end)):
+            index = self.read(ledger.invoice_index_key(month), 'InvoiceKey', invoice_key).to_pylist()
+            partitions = {(entry['AcctAssigned'], entry['VendorKey']) for entry in index
+                          if vendor_key is None or entry['VendorKey'] == vendor_key}
+            for accountant, entry_vendor in sorted(partitions):
+                # Files are sorted by vendor then invoice number, so the vendor narrows the row groups
+                table = self.read(ledger.invoices_key(month, accountant), 'VendorKey', entry_vendor)
+                rows.extend(row for row in table.to_pylist()
+                            if row['InvoiceKey'] == invoice_key and start.isoformat() <= row['ReceiptDate'] <= end.isoformat())
+        return rows
+
+    def invoices_by_vendor(self, vendor_name: str, start: datetime.date, end: datetime.date) -> List[dict]:
+        """Ledger rows of a vendor's invoices received between start and end, inclusive."""
+        vendor_key = ledger.normalize_vendor(vendor_name)
+        rows = []
+        for month in report_months(start, end):
+            index = self.read(ledger.vendor_index_key(month), 'VendorKey', vendor_key).to_pylist()
+            for accountant in sorted({entry['AcctAssigned'] for entry in index}):
+                table = self.read(ledger.invoices_key(month, accountant), 'VendorKey', vendor_key)
+                rows.extend(row for row in table.to_pylist()
+                            if start.isoformat() <= row['ReceiptDate'] <= end.isoformat())
+        return sorted(rows, key=lambda row: (row['ReceiptDate'], row['ReceiptTime']))
+
+
+def main():
+    import argparse
+    import csv
+    from aws_clients import get_client
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--bucket', default=os.environ.get('LEDGER_BUCKET_NAME'), required='LEDGER_BUCKET_NAME' not in os.environ)
+    commands = parser.add_subparsers(dest='command', required=True)
+    invoice = commands.add_parser('invoice', help='was this invoice number already processed?')
+    invoice.add_argument('invoice_number')
+    invoice.add_argument('--vendor')
+    vendor = commands.add_parser('vendor', help='invoices of a vendor over a period')
+    vendor.add_argument('vendor_name')
+    vendor.add_argument('--from', dest='start', type=datetime.date.fromisoformat, required=True)
+    vendor.add_argument('--to', dest='end', type=datetime.date.fromisoformat, required=True)
+    args = parser.parse_args()
+
+    query = LedgerQuery(get_client('s3'), args.bucket)
+    if args.command == 'invoice':
+        rows = query.find_invoice(args.invoice_number, args.vendor)
+    else:
+        rows = query.invoices_by_vendor(args.vendor_name, args.start, args.end)
+    writer = csv.DictWriter(sys.stdout, fieldnames=ledger.INVOICE_SCHEMA.names)
+    writer.writeheader()
+    writer.writerows(rows)
+    print(f"{len(rows)} row(s), {query.stats['requests']} request(s), {query.stats['bytes'] / 1024:.1f} KB read", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+import os
+import threading
+
+import boto3
+from botocore.config import Config
+
+# Above the number of threads any handler runs (processTextractResults, shard
+# compaction, attachment batches), so concurrent requests never queue for a connection
+MAX_POOL_CONNECTIONS = int(os.environ.get('AWS_MAX_POOL_CONNECTIONS', '50'))
+# Adaptive mode adds client-side rate limiting on top of the standard retries,
+# backing off the whole container once a service starts throttling
+RETRY_MODE = os.environ.get('AWS_RETRY_MODE', 'adaptive')
+# Attempts per request, including the first
+MAX_ATTEMPTS = int(os.environ.get('AWS_MAX_ATTEMPTS', '5'))
+
+_lock = threading.Lock()
+_session = None
+_clients = {}
+
+
+def client_config(**overrides) -> Config:
+    """Client configuration shared by every handler; overrides replace single options."""
+    options = {
+        'region_name': os.environ.get('AWS_REGION') or os.environ.get('AWS_DEFAULT_REGION'),
+        'max_pool_connections': MAX_POOL_CONNECTIONS,
+        'retries': {'mode': RETRY_MODE, 'total_max_attempts': MAX_ATTEMPTS},
+        'tcp_keepalive': True,
+        # Regional endpoint even in us-east-1, instead of the global one
+        's3': {'us_east_1_regional_endpoint': 'regional'}
+    }
+    options.update(overrides)
+    return Config(**options)
+
+
+def get_client(service_name: str, **config_overrides):
+    """Return the client for a service, created once per container.
+
+    Clients are thread-safe once built, but creating them is not, so
+    construction is serialized; warm invocations get the cached client.
+    """
+    key = (service_name, repr(sorted(config_overrides.items())))
+    client = _clients.get(key)
+    if client is not None:
+        return client
+    global _session
+    with _lock:
+        if key not in _clients:
+            if _session is None:
+                _session = boto3.session.Session()
+            _clients[key] = _session.client(service_name, config=client_config(**config_overrides))
+        return _clients[key]
@@ -0,0 +1,71 @@
+import datetime
+import hashlib
+import json
+from typing import Optional
+
+from botocore.exceptions import ClientError
+
+INDEX_PREFIX = 'content-index'
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def index_key(sha256: str) -> str:
+    return f'{INDEX_PREFIX}/{sha256}.json'
+
+
+def lookup(s3_client, bucket: str, sha256: str) -> Optional[dict]:
+    """Return the index entry of previously processed content, if any."""
+    try:
+        obj = s3_client.get_object(Bucket=bucket, Key=index_key(sha256))
+    except s3_client.exceptions.NoSuchKey:
+        return None
+    return json.loads(obj['Body'].read())
+
+
+def record(s3_client, bucket: str, sha256: str, message_id: str, job: dict) -> None:
+    """Point the content at the extraction results of a job, keeping the first email that sent it."""
+    entry = {
+        'contentHash': sha256,
+        'messageId': message_id,
+        'jobId': job.get('jobId'),
+        'summaryKey': job['summaryKey'],
+        'resultsKey': job.get('resultsKey') or job['summaryKey'],
+        'recordedAt': datetime.datetime.now(datetime.timezone.utc).isoformat()
+    }
+    try:
+        s3_client.put_object(
+            Bucket=bucket,
+            Key=index_key(sha256),
+            Body=json.dumps(entry),
+            ContentType='application/json',
+            IfNoneMatch='*'
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ('PreconditionFailed', 'ConditionalRequestConflict'):
+            raise
+        print(f"Content [{sha256}] already indexed")
+
+
+def find_duplicate(s3_client, bucket: str, message_id: str, data: bytes):
+    """Hash an attachment and return (hash, converter result) when its content was already extracted.
+
+    The result stands in for the converter's own: startTextractJob passes it
+    through as a succeeded job reusing the stored summary.
+    """
+    sha256 = content_hash(data)
+    entry = lookup(s3_client, bucket, sha256)
+    if entry is None:
+        return sha256, None
+    print(f"Attachment content [{sha256}] was already processed for email [{entry['messageId']}], reusing its results")
+    return sha256, {
+        'statusCode': 200,
+        'status': 'success',
+        'messageId': message_id,
+        'contentHash': sha256,
+        'summaryKey': entry['summaryKey'],
+        'resultsKey': entry['resultsKey'],
+        'duplicateOf': entry['messageId']
+    }
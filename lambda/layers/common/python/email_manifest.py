@@ -0,0 +1,134 @@
+import json
+import tempfile
+from email.message import EmailMessage
+from typing import Callable, Dict, Optional
+
+import metrics
+from mime_stream import decode_to, iter_parts, parse_message, read_text
+
+MANIFEST_PREFIX = 'emails'
+# Decoded attachments larger than this are spooled to disk while uploading
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
+
+def manifest_key(message_id: str) -> str:
+    """S3 key of the parsed manifest for an email."""
+    return f'{MANIFEST_PREFIX}/{message_id}/manifest.json'
+
+
+def part_key(message_id: str, index: int) -> str:
+    """S3 key of a pre-split (decoded) attachment part."""
+    return f'{MANIFEST_PREFIX}/{message_id}/parts/{index}'
+
+
+def build_manifest(message_id: str, stream, store_part: Callable[[str, EmailMessage], int]) -> dict:
+    """Parse a raw email from a binary stream and return its manifest.
+
+    Each attachment part is handed to store_part with its part key; store_part
+    returns the decoded size.
+    """
+    msg = parse_message(stream)
+    is_multipart = msg.get_content_maintype() == 'multipart'
+
+    body = None
+    attachments = []
+    for part in iter_parts(msg):
+        filename = part.get_filename()
+        if part.get_content_maintype() != 'application' or not filename:
+            # The first plain-text part is the body; a single-part message may be any text
+            is_body_candidate = not filename and (
+                part.get_content_type() == 'text/plain'
+                or (not is_multipart and part.get_content_maintype() == 'text')
+            )
+            if body is None and is_body_candidate:
+                body = read_text(part)
+            continue
+
+        index = len(attachments)
+        size = store_part(part_key(message_id, index), part)
+        attachments.append({
+            'index': index,
+            'filename': filename,
+            'contentType': part.get_content_type(),
+            'encoding': (part['Content-Transfer-Encoding'] or '7bit').strip().lower(),
+            'size': size,
+            'partKey': part_key(message_id, index)
+        })
+
+    manifest = {
+        'messageId': message_id,
+        'headers': {
+            'subject': msg['Subject'] or '',
+            'from': msg['From'] or '',
+            'to': msg['To'] or '',
+            'date': msg['Date'] or ''
+        },
+        'sender': msg['From'] or '',
+        'date': msg['Date'] or '',
+        'body': body or '',
+        'attachments': attachments
+    }
+    return manifest
+
+
+def publish_manifest(s3_client, email_bucket: str, artefact_bucket: str, message_id: str) -> dict:
+    """Stream the raw email from S3, storing its decoded parts and then its manifest."""
+    print(f"Building manifest for email [{message_id}] from bucket [{email_bucket}]")
+    obj = s3_client.get_object(Bucket=email_bucket, Key=message_id)
+
+    def store_part(key: str, part: EmailMessage) -> int:
+        # Small parts stay in memory, large ones spill to /tmp before the upload
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as spool:
+            size = decode_to(part, spool)
+            spool.seek(0)
+            with metrics.span('S3Put') as span:
+                s3_client.upload_fileobj(spool, artefact_bucket, key, ExtraArgs={'ContentType': part.get_content_type()})
+                span.add('Bytes', size, 'Bytes')
+        return size
+
+    # Includes the part uploads, made as each attachment part is reached
+    with metrics.span('MimeParse') as span:
+        manifest = build_manifest(message_id, obj['Body'], store_part)
+        span.add('Bytes', obj.get('ContentLength', 0), 'Bytes')
+        span.add('Attachments', len(manifest['attachments']))
+
+    body = json.dumps(manifest)
+    with metrics.span('S3Put') as span:
+        s3_client.put_object(
+            Bucket=artefact_bucket,
+            Key=manifest_key(message_id),
+            Body=body,
+            ContentType='application/json'
+        )
+        span.add('Bytes', len(body), 'Bytes')
+    print(f"Stored manifest with {len(manifest['attachments'])} attachment part(s) at [{manifest_key(message_id)}]")
+    return manifest
+
+
+def load_manifest(s3_client, artefact_bucket: str, message_id: str) -> dict:
+    """Read the manifest written by detectInvoice."""
+    with metrics.span('S3Get') as span:
+        data = s3_client.get_object(Bucket=artefact_bucket, Key=manifest_key(message_id))['Body'].read()
+        span.add('Bytes', len(data), 'Bytes')
+    return json.loads(data)
+
+
+def find_attachment(manifest: dict, filename: str) -> Optional[Dict]:
+    """Return the manifest entry of the attachment with the given filename."""
+    for attachment in manifest['attachments']:
+        if attachment['filename'] == filename:
+            return attachment
+    return None
+
+
+def load_attachment(s3_client, artefact_bucket: str, message_id: str, filename: str, attachment_key: Optional[str] = None) -> Optional[bytes]:
+    """Read a single decoded attachment part, resolving its key from the manifest if needed."""
+    if not attachment_key:
+        attachment = find_attachment(load_manifest(s3_client, artefact_bucket, message_id), filename)
+        if not attachment:
+            return None
+        attachment_key = attachment['partKey']
+    with metrics.span('S3Get') as span:
+        data = s3_client.get_object(Bucket=artefact_bucket, Key=attachment_key)['Body'].read()
+        span.add('Bytes', len(data), 'Bytes')
+    return data
@@ -0,0 +1,36 @@
+import hashlib
+import re
+from typing import Optional
+
+CORPORATE_SUFFIXES = {'inc', 'incorporated', 'llc', 'ltd', 'limited', 'co', 'corp', 'corporation', 'company', 'lp', 'llp', 'plc'}
+
+
+def normalize_vendor(name: str) -> str:
+    """Lowercase, drop punctuation and corporate suffixes, collapse whitespace."""
+    words = re.sub(r'[^a-z0-9&@ ]+', ' ', (name or '').lower()).split()
+    while words and words[-1] in CORPORATE_SUFFIXES:
+        words.pop()
+    return ' '.join(words)
+
+
+def normalize_invoice_number(invoice_number: str) -> str:
+    """Upper case letters and digits only (e.g. inv-2024/001 -> INV2024001)."""
+    return re.sub(r'[\W_]', '', invoice_number or '').upper()
+
+
+def parse_amount(amount) -> Optional[float]:
+    """Numeric value of an extracted amount such as '$1,234.50', or None."""
+    try:
+        return float(re.sub(r'[^\d.\-]', '', str(amount)))
+    except ValueError:
+        return None
+
+
+def invoice_key(vendor_name: str, invoice_number: str, amount) -> Optional[str]:
+    """SHA-256 identifying an invoice by vendor, number and amount, or None when vendor or number is missing."""
+    vendor = normalize_vendor(vendor_name)
+    number = normalize_invoice_number(invoice_number)
+    if not vendor or not number:
+        return None
+    value = parse_amount(amount)
+    return hashlib.sha256(f"{vendor}|{number}|{'' if value is None else f'{value:.2f}'}".encode('utf-8')).hexdigest()
@@ -0,0 +1,124 @@
+import contextlib
+import contextvars
+import json
+import os
+import time
+from typing import Iterator, Optional
+
+# Spans are printed as CloudWatch Embedded Metric Format records; Lambda ships
+# stdout to CloudWatch Logs, which extracts the metrics without any API call
+NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'InvoiceProcessing')
+SERVICE = os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'local')
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() != 'false'
+# Characters of an event logged on receipt
+EVENT_LOG_MAX_CHARS = int(os.environ.get('EVENT_LOG_MAX_CHARS', '1000'))
+# Items of a list shown when logging an event
+EVENT_LOG_MAX_ITEMS = 3
+
+_correlation_id = contextvars.ContextVar('correlation_id', default=None)
+
+
+def set_correlation_id(message_id: Optional[str]) -> None:
+    """Tag the metrics of the current thread with the SES messageId of the email being processed."""
+    _correlation_id.set(message_id)
+
+
+def correlation_id() -> Optional[str]:
+    return _correlation_id.get()
+
+
+class Span:
+    """Timing of one stage, with any counts added while it runs."""
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.values = {}
+        self.units = {}
+
+    def add(self, name: str, value: float, unit: str = 'Count') -> None:
+        self.values[name] = self.values.get(name, 0) + value
+        self.units[name] = unit
+
+
+def emit(stage: str, values: dict, units: dict) -> None:
+    """Print one Embedded Metric Format record for a stage."""
+    if not METRICS_ENABLED:
+        return
+    record = {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': NAMESPACE,
+                'Dimensions': [['Service', 'Stage']],
+                'Metrics': [{'Name': name, 'Unit': units.get(name, 'Count')} for name in values]
+            }]
+        },
+        'Service': SERVICE,
+        'Stage': stage,
+        **values
+    }
+    message_id = correlation_id()
+    if message_id:
+        # A property, not a dimension: searchable in Logs Insights without a metric per email
+        record['MessageId'] = message_id
+    print(json.dumps(record))
+
+
+@contextlib.contextmanager
+def span(stage: str) -> Iterator[Span]:
+    """Time a block and emit its duration and counts, flagging it when it raises.
+
+        with metrics.span('S3Get') as s:
+            data = s3.get_object(...)['Body'].read()
+            s.add('Bytes', len(data), 'Bytes')
+    """
+    current = Span(stage)
+    start = time.perf_counter()
+    try:
+        yield current
+    except Exception:
+        current.add('Errors', 1)
+        raise
+    finally:
+        current.add('Duration', round((time.perf_counter() - start) * 1000, 3), 'Milliseconds')
+        emit(stage, current.values, current.units)
+
+
+def _preview(value, budget: int) -> str:
+    """Compact JSON-like text of value, cut off once budget characters are spent.
+
+    Unlike json.dumps followed by slicing, only the part that is shown is ever
+    serialized, so large events cost no more to log than small ones.
+    """
+    if budget <= 0:
+        return '...'
+    if isinstance(value, dict):
+        parts = []
+        for key, item in value.items():
+            if budget <= 0:
+                parts.append('...')
+                break
+            text = f'{json.dumps(str(key))}: {_preview(item, budget)}'
+            parts.append(text)
+            budget -= len(text) + 2
+        return '{' + ', '.join(parts) + '}'
+    if isinstance(value, (list, tuple)):
+        parts = []
+        for item in value[:EVENT_LOG_MAX_ITEMS]:
+            if budget <= 0:
+                break
+            text = _preview(item, budget)
+            parts.append(text)
+            budget -= len(text) + 2
+        if len(value) > len(parts):
+            parts.append(f'... {len(value) - len(parts)} more')
+        return '[' + ', '.join(parts) + ']'
+    if isinstance(value, str):
+        value = value[:budget]
+    text = json.dumps(value, default=str)
+    return text if len(text) <= budget else text[:budget] + '...'
+
+
+def log_event(event, max_chars: int = EVENT_LOG_MAX_CHARS) -> None:
+    """Log a truncated preview of a Lambda event instead of the whole payload."""
+    print(f"Received event: {_preview(event, max_chars)}")
@@ -0,0 +1,57 @@
+import re
+from email import policy
+from email.message import EmailMessage
+from email.parser import BytesHeaderParser, BytesParser
+from typing import Iterator
+
+CHUNK_SIZE = 64 * 1024
+# A line break followed by an empty line ends the header block
+_HEADER_END = re.compile(rb'\r?\n\r?\n')
+
+
+def read_headers(stream) -> EmailMessage:
+    """Parse the header block of a raw email, reading the stream in chunks only until the blank line after it."""
+    data = b''
+    while True:
+        match = _HEADER_END.search(data)
+        if match:
+            data = data[:match.start() + 1]
+            break
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        data += chunk
+    return BytesHeaderParser(policy=policy.default).parsebytes(data)
+
+
+def parse_message(stream) -> EmailMessage:
+    """Parse a raw email straight from a binary stream, such as an S3 streaming body.
+
+    The stream is fed to the parser in chunks rather than read into one bytes
+    object first, and part bodies stay transfer-encoded until a part is decoded.
+    """
+    return BytesParser(policy=policy.default).parse(stream)
+
+
+def iter_parts(msg: EmailMessage) -> Iterator[EmailMessage]:
+    """Yield the leaf parts of a message in order, including those of attached messages; the message itself if it is not multipart."""
+    for part in msg.walk():
+        if not part.is_multipart():
+            yield part
+
+
+def decode_to(part: EmailMessage, fileobj) -> int:
+    """Write a part's body, decoded from its transfer encoding, to a binary file object and return its size."""
+    payload = part.get_payload(decode=True) or b''
+    fileobj.write(payload)
+    return len(payload)
+
+
+def read_text(part: EmailMessage) -> str:
+    """Return a part's decoded body as text, using its declared charset."""
+    payload = part.get_payload(decode=True) or b''
+    try:
+        return payload.decode(part.get_content_charset() or 'utf-8', errors='replace')
+    except LookupError:
+        # Unknown charset names fall back to UTF-8
+        return payload.decode('utf-8', errors='replace')
@@ -0,0 +1,99 @@
+import csv
+import io
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+import metrics
+
+SHARD_PREFIX = 'shards'
+COMPACTION_WORKERS = 10
+
+
+def daily_csv_key(date: str, suffix: str) -> str:
+    """Key of the compacted daily CSV, e.g. 2024-10-14_invoices.csv."""
+    return f'{date}_{suffix}.csv'
+
+
+def shard_prefix(date: str, suffix: str) -> str:
+    return f'{SHARD_PREFIX}/{date}/{suffix}/'
+
+
+def append_rows(s3_client, bucket: str, date: str, suffix: str, headers: List[str], rows: List[list]) -> str:
+    """Write rows as a new, immutable shard object under the date prefix.
+
+    Every call creates its own object, so concurrent writers never overwrite each
+    other. Keys start with a nanosecond timestamp to keep shards in arrival order.
+    """
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(headers)
+    writer.writerows(rows)
+
+    key = f'{shard_prefix(date, suffix)}{time.time_ns():020d}-{uuid.uuid4().hex}.csv'
+    print(f"Writing {len(rows)} row(s) to shard: {key}")
+    body = output.getvalue()
+    with metrics.span('S3Put') as span:
+        s3_client.put_object(
+            Bucket=bucket,
+            Key=key,
+            Body=body,
+            ContentType='text/csv'
+        )
+        span.add('Bytes', len(body), 'Bytes')
+    return key
+
+
+def _list_shards(s3_client, bucket: str, prefix: str) -> List[str]:
+    keys = []
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        keys.extend(obj['Key'] for obj in page.get('Contents', []))
+    return sorted(keys)
+
+
+def compact_daily(s3_client, bucket: str, date: str, suffix: str) -> Optional[bytes]:
+    """Merge all shards of a day into the daily CSV and return its content.
+
+    Columns are matched by header name, so shards with fewer columns get empty
+    values for the columns added since. Compaction always rebuilds the file
+    from the shards, so running it again (or concurrently) is safe. Returns
+    None when no shards exist for the day.
+    """
+    keys = _list_shards(s3_client, bucket, shard_prefix(date, suffix))
+    if not keys:
+        print(f"No shards found for {daily_csv_key(date, suffix)}")
+        return None
+
+    def read_shard(key):
+        body = s3_client.get_object(Bucket=bucket, Key=key)['Body'].read().decode('utf-8')
+        return list(csv.reader(io.StringIO(body)))
+
+    with ThreadPoolExecutor(max_workers=COMPACTION_WORKERS) as executor:
+        shards = list(executor.map(read_shard, keys))
+
+    # Shards written before and after a deploy can carry different columns:
+    # every row is placed under the union of their headers, by column name
+    headers = []
+    for shard in shards:
+        headers.extend(name for name in (shard[0] if shard else []) if name not in headers)
+    rows = [headers]
+    for shard in shards:
+        for values in shard[1:]:
+            row = dict(zip(shard[0], values))
+            rows.append([row.get(name, '') for name in headers])
+
+    output = io.StringIO()
+    csv.writer(output).writerows(rows)
+    content = output.getvalue().encode('utf-8')
+
+    csv_key = daily_csv_key(date, suffix)
+    print(f"Compacted {len(keys)} shard(s) into {csv_key} with {len(rows) - 1} row(s)")
+    s3_client.put_object(
+        Bucket=bucket,
+        Key=csv_key,
+        Body=content,
+        ContentType='text/csv'
+    )
+    return content
@@ -0,0 +1,174 @@
+import json
+import re
+from typing import Dict, Iterable, List, Optional
+
+from textract_summary import new_summary
+
+# Header/label text for each Textract SummaryFields type the invoice processing reads.
+# Quote and estimate numbers are labelled like invoice numbers, as Textract does, so
+# processTextractResults rejects them the same way.
+FIELD_LABELS = {
+    'INVOICE_RECEIPT_ID': r'(?:invoice|inv|bill|receipt|quote|estimate)\.?\s*(?:#|no\.?|num(?:ber)?|id)?',
+    'VENDOR_NAME': r'(?:vendor|supplier|seller|remit\s+to|pay\s+to|payee|company)(?:\s+name)?',
+    'TOTAL': r'(?:invoice\s+|grand\s+)?total(?:\s+(?:due|amount|amount\s+due))?|(?:amount|balance|total\s+amount)\s+due|total\s+amount'
+}
+REQUIRED_FIELDS = ('INVOICE_RECEIPT_ID', 'VENDOR_NAME', 'TOTAL')
+
+_LABEL_CELL = {
+    field_type: re.compile(rf'(?:{pattern})\s*:?', re.IGNORECASE)
+    for field_type, pattern in FIELD_LABELS.items()
+}
+# "Invoice #: 123", "Total: $10.00" or "Invoice # 123" within one paragraph or cell
+_INLINE_LABEL = {
+    field_type: re.compile(rf'(?P<label>{pattern})(?:\s*:|(?<=#))\s*(?P<value>\S.*)', re.IGNORECASE)
+    for field_type, pattern in FIELD_LABELS.items()
+}
+_VALUE_CHECKS = {
+    'INVOICE_RECEIPT_ID': re.compile(r'\w'),
+    'VENDOR_NAME': re.compile(r'[A-Za-z]'),
+    'TOTAL': re.compile(r'\d')
+}
+# Column headers of line-item and remittance tables, never a field value
+_HEADER_CELL = re.compile(
+    r'(?:(?:due\s+|invoice\s+)?date|description|item|qty|quantity|unit(?:\s+price)?|price|rate|amount|'
+    r'subtotal|tax|terms|(?:po|account|reference|ref)\.?\s*(?:#|no\.?|num(?:ber)?)?)\s*:?',
+    re.IGNORECASE
+)
+# Cells to the right of a label cell searched for its value
+VALUE_SEARCH_WIDTH = 3
+
+
+def summary_key(message_id: str, filename: str) -> str:
+    return f"emails/{message_id}/summaries/{filename}.json"
+
+
+def _is_label(cell: str) -> bool:
+    return any(p.fullmatch(cell) for p in _LABEL_CELL.values()) or bool(_HEADER_CELL.fullmatch(cell))
+
+
+class _FieldCollector:
+    def __init__(self):
+        # Values found beside their label, and values under a column header, which
+        # may belong to a line-item table rather than the invoice totals
+        self.beside: Dict[str, Dict[str, str]] = {}
+        self.below: Dict[str, Dict[str, str]] = {}
+        self.texts: Dict[str, None] = {}
+        # Fields whose header heads a column of several values
+        self.columns = set()
+        self.truncated = False
+
+    def add(self, field_type: str, label: str, value: str, below: bool = False) -> None:
+        value = value.strip()
+        if _VALUE_CHECKS[field_type].search(value) and not _is_label(value):
+            found = self.below if below else self.beside
+            found.setdefault(field_type, {}).setdefault(value, label.strip().rstrip(':').strip())
+
+    def add_line(self, text: str) -> None:
+        text = text.strip()
+        if not text:
+            return
+        self.texts.setdefault(text)
+        for field_type, pattern in _INLINE_LABEL.items():
+            match = pattern.fullmatch(text)
+            if match:
+                self.add(field_type, match['label'], match['value'])
+
+    def add_grid(self, rows: Iterable[List[str]], max_rows: Optional[int] = None) -> None:
+        """Match label cells with the value to their right, or else the one below.
+
+        A row of several labels is a table header: its labels only look down, and
+        a label with more than one value below it heads a column rather than a field.
+        """
+        previous_labels, header_columns = {}, {}
+        for row_idx, row in enumerate(rows):
+            if max_rows is not None and row_idx >= max_rows:
+                self.truncated = True
+                return
+            row = [cell.strip() for cell in row]
+            for col_idx, (field_type, label_text) in previous_labels.items():
+                if col_idx < len(row):
+                    self.add(field_type, label_text, row[col_idx], below=True)
+            for col_idx, field_type in header_columns.items():
+                if col_idx < len(row) and row[col_idx] and not _is_label(row[col_idx]):
+                    self.columns.add(field_type)
+            header_columns = {col_idx: field_type for col_idx, (field_type, _) in previous_labels.items()
+                              if col_idx < len(row) and row[col_idx]}
+            previous_labels = {}
+
+            labels = {}
+            for col_idx, cell in enumerate(row):
+                if not cell:
+                    continue
+                self.add_line(cell)
+                field_type = next((f for f, p in _LABEL_CELL.items() if p.fullmatch(cell)), None)
+                if field_type:
+                    labels[col_idx] = (field_type, cell)
+            # Merged cells repeat their text in every column they span
+            header_row = len({cell for cell in row if cell and _is_label(cell)}) > 1
+            for col_idx, (field_type, cell) in labels.items():
+                value = '' if header_row else next((v for v in row[col_idx + 1:col_idx + 1 + VALUE_SEARCH_WIDTH] if v and v != cell), '')
+                if value and not _is_label(value):
+                    self.add(field_type, cell, value)
+                else:
+                    previous_labels[col_idx] = (field_type, cell)
+
+    def _resolve(self, field_type: str) -> Optional[List[dict]]:
+        """The single value of a field, beside values first, or None when missing or ambiguous."""
+        values = self.beside.get(field_type)
+        if not values:
+            values = self.below.get(field_type)
+            if field_type in self.columns:
+                return None
+        if not values or len(values) > 1:
+            return None
+        (value, label), = values.items()
+        return [{'label': label, 'value': value}]
+
+    def document(self) -> Optional[dict]:
+        if self.truncated:
+            print("Direct extraction stopped before the end of a grid")
+            return None
+        fields = {field_type: self._resolve(field_type) for field_type in REQUIRED_FIELDS}
+        unresolved = [field_type for field_type, value in fields.items() if value is None]
+        if unresolved:
+            print(f"Direct extraction missing or ambiguous fields: {unresolved}")
+            return None
+        return {
+            'summaryFields': fields,
+            'blockTexts': list(self.texts)
+        }
+
+
+def extract_summary_document(lines: Iterable[str] = (), grids: Iterable[Iterable[List[str]]] = (),
+                             max_rows: Optional[int] = None) -> Optional[dict]:
+    """Build a summarized expense document, in the shape of textract_summary, from
+    document text and cell grids.
+
+    Returns None unless exactly one invoice number, vendor name and total were
+    found, or when a grid is longer than max_rows, in which case the caller
+    falls back to rendering the document for Textract.
+    """
+    collector = _FieldCollector()
+    for line in lines:
+        collector.add_line(line)
+    for grid in grids:
+        collector.add_grid(grid, max_rows)
+        if collector.truncated:
+            break
+    return collector.document()
+
+
+def publish_summary(s3_client, bucket: str, message_id: str, filename: str, document: dict) -> str:
+    """Store a directly extracted document as a one-document job summary and return its key."""
+    key = summary_key(message_id, filename)
+    summary = new_summary(None)
+    summary['pageCount'] = 1
+    summary['documents'].append(document)
+    s3_client.put_object(
+        Bucket=bucket,
+        Key=key,
+        Body=json.dumps(summary),
+        ContentType='application/json'
+    )
+    print(f"Saved directly extracted invoice summary to S3: {key}")
+    return key
@@ -0,0 +1,41 @@
+from typing import Dict, List
+
+
+def summarize_expense_document(expense_doc: dict) -> dict:
+    """Reduce a raw Textract expense document to what invoice processing reads.
+
+    Keeps the summary fields grouped by type (label and value text only) and the
+    deduplicated block texts in their original order, dropping geometry,
+    confidence scores and line items.
+    """
+    summary_fields: Dict[str, List[dict]] = {}
+    for field in expense_doc.get('SummaryFields', []):
+        field_type = field.get('Type', {}).get('Text', '')
+        summary_fields.setdefault(field_type, []).append({
+            'label': field.get('LabelDetection', {}).get('Text', ''),
+            'value': field.get('ValueDetection', {}).get('Text', '')
+        })
+
+    block_texts = list(dict.fromkeys(
+        block['Text'] for block in expense_doc.get('Blocks', []) if block.get('Text')
+    ))
+    return {
+        'summaryFields': summary_fields,
+        'blockTexts': block_texts
+    }
+
+
+def new_summary(job_id: str) -> dict:
+    return {
+        'jobId': job_id,
+        'pageCount': 0,
+        'documents': []
+    }
+
+
+def add_results_page(summary: dict, response: dict) -> None:
+    """Fold one get_expense_analysis response page into a job summary."""
+    summary['pageCount'] = max(summary['pageCount'], response.get('DocumentMetadata', {}).get('Pages', 0))
+    summary['documents'].extend(
+        summarize_expense_document(expense_doc) for expense_doc in response.get('ExpenseDocuments', [])
+    )
@@ -0,0 +1,46 @@
+import importlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# Single-attachment handlers bundled into this Lambda under these module names;
+# anything else is converted like the email body, as in the Process Attachment choice
+CONVERTERS = {
+    'pdf': 'pdf_attachment',
+    'excel': 'excel_attachment',
+    'doc': 'doc_attachment',
+    'body': 'email_body'
+}
+
+def process_attachment(attachment, message_id, bucket_name):
+    """Convert one attachment with the handler of its type, isolating its errors."""
+    event = {
+        'type': attachment['type'],
+        'filename': attachment['filename'],
+        'partKey': attachment.get('partKey'),
+        'messageId': message_id,
+        'bucketName': bucket_name
+    }
+    try:
+        # Imported on first use, so a batch of PDFs never loads the Excel or Word libraries
+        converter = importlib.import_module(CONVERTERS.get(attachment['type'], CONVERTERS['body']))
+        return converter.handler(event, None)
+    except Exception as e:
+        print(f"Error processing attachment [{attachment['filename']}]: {str(e)}")
+        return {
+            'statusCode': 500,
+            'status': 'error',
+            'error': str(e)
+        }
+
+def handler(event, context):
+    message_id = event['messageId']
+    attachments = event['attachments']
+    max_workers = max(int(os.environ.get('MAX_WORKERS', '4')), 1)
+    print(f"Processing {len(attachments)} attachment(s) of email [{message_id}] with up to {max_workers} workers")
+    
+    # Returns the same list of per-attachment results as the Process Attachments map
+    with ThreadPoolExecutor(max_workers=min(max_workers, max(len(attachments), 1))) as executor:
+        return list(executor.map(
+            lambda attachment: process_attachment(attachment, message_id, event['bucketName']),
+            attachments
+        ))
@@ -1,41 +1,93 @@
-import boto3
 import os
 import io
-import email
-from docx import Document
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter, landscape
-from reportlab.lib.utils import simpleSplit
+from aws_clients import get_client
+from content_index import find_duplicate
+from email_manifest import load_attachment
+from structured_extraction import extract_summary_document, publish_summary
+import metrics
 
-s3 = boto3.client('s3')
+s3 = get_client('s3')
 
-def extract_doc_data(doc_binary):
-    doc_buffer = io.BytesIO(doc_binary)
+# python-docx and reportlab are imported where they are used, keeping them out of
+# the cold start of invocations that never parse or render a document
+
+def open_document(doc_binary):
+    from docx import Document
+    
     try:
-        doc = Document(doc_buffer)
-        content = []
-        
-        for paragraph in doc.paragraphs:
-            if paragraph.text.strip():
-                content.append({
+        return Document(io.BytesIO(doc_binary))
+    except Exception as e:
+        raise Exception(f"Failed to read Word document: {str(e)}")
+
+def iter_body_blocks(doc):
+    """Yield the paragraphs and tables of the document body in document order."""
+    from docx.oxml.ns import qn
+    from docx.table import Table
+    from docx.text.paragraph import Paragraph
+    
+    for child in doc.element.body.iterchildren():
+        if child.tag == qn('w:p'):
+            yield Paragraph(child, doc)
+        elif child.tag == qn('w:tbl'):
+            yield Table(child, doc)
+
+def iter_table_rows(table, repeat_spans=True):
+    """Yield the stripped cell texts of each row, one per grid column, reading every cell once.
+    
+    Works on the row XML directly, so columns line up across rows: a horizontally
+    merged cell fills every column it spans, with its text repeated or, without
+    repeat_spans, in the first column only, and the continuation cells of a
+    vertical merge, like the columns a row skips, are ''.
+    """
+    from docx.table import _Cell
+    
+    for tr in table._tbl.tr_lst:
+        row = [''] * tr.grid_before
+        for tc in tr.tc_lst:
+            text = '' if tc.vMerge == 'continue' else _Cell(tc, table).text.strip()
+            row.append(text)
+            row.extend([text if repeat_spans else ''] * (tc.grid_span - 1))
+        row.extend([''] * tr.grid_after)
+        yield row
+
+def extract_doc_data(doc):
+    """Yield the text of each paragraph and table row, in document order."""
+    from docx.text.paragraph import Paragraph
+    
+    for block in iter_body_blocks(doc):
+        if isinstance(block, Paragraph):
+            text = block.text.strip()
+            if text:
+                yield {
                     'type': 'text',
-                    'text': paragraph.text.strip()
-                })
-        
-        for table in doc.tables:
-            for row in table.rows:
-                row_text = ' '.join(cell.text.strip() for cell in row.cells if cell.text.strip())
+                    'text': text
+                }
+        else:
+            for cells in iter_table_rows(block, repeat_spans=False):
+                row_text = ' '.join(cell for cell in cells if cell)
                 if row_text:
-                    content.append({
+                    yield {
                         'type': 'text',
                         'text': row_text
-                    })
-        
-        return content
-    except Exception as e:
-        raise Exception(f"Failed to read Word document: {str(e)}")
+                    }
+
+def extract_invoice_document(doc):
+    """Read vendor, invoice number and total directly from the paragraphs and tables."""
+    from docx.text.paragraph import Paragraph
+    
+    lines, grids = [], []
+    for block in iter_body_blocks(doc):
+        if isinstance(block, Paragraph):
+            lines.append(block.text)
+        else:
+            grids.append(iter_table_rows(block))
+    return extract_summary_document(lines=lines, grids=grids)
 
 def create_pdf_from_doc(content):
+    from reportlab.pdfgen import canvas
+    from reportlab.lib.pagesizes import letter, landscape
+    from reportlab.lib.utils import simpleSplit
+    
     buffer = io.BytesIO()
     page_width, page_height = landscape(letter)
     c = canvas.Canvas(buffer, pagesize=landscape(letter))
@@ -74,20 +126,12 @@ def create_pdf_from_doc(content):
 
 def handler(event, context):
     print(f"Processing Word Document attachment...")
-    email_bucket_name = os.environ['EMAIL_BUCKET_NAME']
     artefact_bucket_name = os.environ['ARTEFACT_BUCKET_NAME']
     message_id = event['messageId']
     attachment_filename = event['filename']
+    metrics.set_correlation_id(message_id)
     try:
-        obj = s3.get_object(Bucket=email_bucket_name, Key=message_id)
-        email_content = obj['Body'].read().decode('utf-8')
-        
-        doc_data = None
-        email_message = email.message_from_string(email_content)
-        for part in email_message.walk():
-            if part.get_content_maintype() == 'application' and part.get_filename() == attachment_filename:
-                doc_data = part.get_payload(decode=True)
-                break
+        doc_data = load_attachment(s3, artefact_bucket_name, message_id, attachment_filename, event.get('partKey'))
         
         if not doc_data:
             return {
@@ -96,22 +140,50 @@ def handler(event, context):
                 'body': f'No Word document attachment found'
             }
         
-        doc_content = extract_doc_data(doc_data)
-        pdf_data = create_pdf_from_doc(doc_content)
+        # The same file sent again reuses its earlier results
+        content_hash, duplicate = find_duplicate(s3, artefact_bucket_name, message_id, doc_data)
+        if duplicate:
+            return duplicate
+        
+        doc = open_document(doc_data)
+        
+        # Invoices with labelled fields skip the PDF and Textract round-trip
+        try:
+            invoice_document = extract_invoice_document(doc)
+        except Exception as e:
+            print(f"Direct extraction failed, falling back to PDF: {str(e)}")
+            invoice_document = None
+        if invoice_document:
+            summary_key = publish_summary(s3, artefact_bucket_name, message_id, attachment_filename, invoice_document)
+            return {
+                'statusCode': 200,
+                'status': 'success',
+                'messageId': message_id,
+                'summaryKey': summary_key,
+                'contentHash': content_hash
+            }
+        
+        # Stream the document, in order, straight onto the PDF canvas
+        with metrics.span('RenderPdf') as span:
+            pdf_data = create_pdf_from_doc(extract_doc_data(doc))
+            span.add('Bytes', len(pdf_data), 'Bytes')
         
         original_filename = os.path.splitext(attachment_filename)[0]
         pdf_key = f'invoices/{message_id}/{original_filename}.pdf'
-        s3.put_object(
-            Bucket=artefact_bucket_name,
-            Key=pdf_key,
-            Body=pdf_data,
-            ContentType='application/pdf'
-        )
+        with metrics.span('S3Put') as span:
+            s3.put_object(
+                Bucket=artefact_bucket_name,
+                Key=pdf_key,
+                Body=pdf_data,
+                ContentType='application/pdf'
+            )
+            span.add('Bytes', len(pdf_data), 'Bytes')
         
         return {
             'statusCode': 200,
             'status': 'success',
-            'pdfKey': pdf_key
+            'pdfKey': pdf_key,
+            'contentHash': content_hash
         }
         
     except Exception as e:
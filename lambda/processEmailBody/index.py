@@ -1,52 +1,47 @@
-import boto3
 import os
 import io
-import email
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Paragraph
-from reportlab.lib.styles import getSampleStyleSheet
+from aws_clients import get_client
+from email_manifest import load_manifest
+import metrics
 
-s3 = boto3.client('s3')
+s3 = get_client('s3')
 
 def handler(event, context):
     print(f"Converting Email body to PDF...")
-    email_bucket_name = os.environ['EMAIL_BUCKET_NAME']
     artefact_bucket_name = os.environ['ARTEFACT_BUCKET_NAME']
     message_id = event['messageId']
+    metrics.set_correlation_id(message_id)
     
     pdf_key = f'invoices/{message_id}/email_body.pdf'
-    obj =  s3.get_object(Bucket=email_bucket_name, Key=message_id)
-    email_content = obj['Body'].read().decode('utf-8')
-    
-    msg = email.message_from_string(email_content)
-    
-    text_content = ""
-    if msg.is_multipart():
-        for part in msg.walk():
-            if part.get_content_type() == 'text/plain':
-                text_content = part.get_payload(decode=True).decode('utf-8')
-                break
-    else:
-        text_content = msg.get_payload(decode=True).decode('utf-8')
+    manifest = load_manifest(s3, artefact_bucket_name, message_id)
+    text_content = manifest['body']
     
     if text_content:
+        # Only loaded when there is a body to render
+        from reportlab.lib.pagesizes import letter
+        from reportlab.platypus import SimpleDocTemplate, Paragraph
+        from reportlab.lib.styles import getSampleStyleSheet
+        
         buffer = io.BytesIO()
         pdf = SimpleDocTemplate(buffer, pagesize=letter)
         styles = getSampleStyleSheet()
         elements = [Paragraph(text_content, styles['Normal'])]
-        pdf.build(elements)
-        
-        pdf_data = buffer.getvalue()
+        with metrics.span('RenderPdf') as span:
+            pdf.build(elements)
+            pdf_data = buffer.getvalue()
+            span.add('Bytes', len(pdf_data), 'Bytes')
         
         try:
             print(f"Saving PDF to bucket [{artefact_bucket_name}], at location [{pdf_key}]...")
             
-            s3.put_object(
-                Bucket=artefact_bucket_name,
-                Key=pdf_key,
-                Body=pdf_data,
-                ContentType='application/pdf'
-            )
+            with metrics.span('S3Put') as span:
+                s3.put_object(
+                    Bucket=artefact_bucket_name,
+                    Key=pdf_key,
+                    Body=pdf_data,
+                    ContentType='application/pdf'
+                )
+                span.add('Bytes', len(pdf_data), 'Bytes')
             print(f"Successfully saved PDF to bucket [{artefact_bucket_name}], at location [{pdf_key}]!")
             result = {
                 'statusCode': 200,
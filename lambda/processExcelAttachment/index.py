@@ -1,56 +1,146 @@
-import boto3
 import os
 import io
-import email
-import pandas as pd
-import numpy as np
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter, landscape
-from reportlab.lib.utils import simpleSplit
+from aws_clients import get_client
+from content_index import find_duplicate
+from email_manifest import load_attachment
+from structured_extraction import extract_summary_document, publish_summary
+import metrics
 
-s3 = boto3.client('s3')
+s3 = get_client('s3')
 
-def extract_excel_data(excel_binary):
-    excel_buffer = io.BytesIO(excel_binary)
+# Widest Latin-1 glyph of the Helvetica fonts, in units of the font size; other
+# characters (CJK, emoji, ...) render with wider fallback glyphs and are measured
+MAX_GLYPH_WIDTH = 1.015
+MAX_FAST_PATH_CHAR = '\xff'
+
+# Rows searched for invoice header fields; longer sheets, whose totals may sit
+# further down, go to Textract
+SCAN_ROWS = 100
+
+XLSX_MAGIC = b'PK\x03\x04'  # Office Open XML workbooks are zip archives
+XLS_MAGIC = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'  # Legacy workbooks are OLE2 compound files
+
+def sniff_excel_format(excel_binary):
+    """Return 'xlsx' or 'xls' from the file's magic bytes."""
+    if excel_binary.startswith(XLSX_MAGIC):
+        return 'xlsx'
+    if excel_binary.startswith(XLS_MAGIC):
+        return 'xls'
+    raise Exception(f"Failed to read Excel file. Unrecognized file signature: {excel_binary[:8].hex()}")
+
+def cell_to_string(value):
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+def _is_blank(row):
+    return not any(row)
+
+def _pad(row, num_columns):
+    """Extend a row to the sheet's width, so a short first row does not narrow the rendered table."""
+    if len(row) < num_columns:
+        row.extend([''] * (num_columns - len(row)))
+    return row
+
+def _iter_xlsx_sheets(excel_binary):
+    from openpyxl import load_workbook
     
-    # Try different Excel engines
-    engines = ['openpyxl', 'xlrd']
-    last_error = None
+    # Read-only mode parses each sheet lazily, one row at a time
+    workbook = load_workbook(io.BytesIO(excel_binary), read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            if sheet.max_column is None:
+                # No stored dimensions: scan the sheet once so every row is padded to its widest
+                sheet.calculate_dimension(force=True)
+            num_columns = sheet.max_column or 0
+            rows = (
+                _pad([cell_to_string(value) for value in row], num_columns)
+                for row in sheet.iter_rows(values_only=True)
+            )
+            yield sheet.title, (row for row in rows if not _is_blank(row))
+    finally:
+        workbook.close()
+
+def _iter_xls_sheets(excel_binary):
+    import xlrd
     
-    for engine in engines:
-        try:
-            return pd.read_excel(excel_buffer, engine=engine)
-        except Exception as e:
-            last_error = str(e)
-            excel_buffer.seek(0)  # Reset buffer for next attempt
+    workbook = xlrd.open_workbook(file_contents=excel_binary, on_demand=True)
+    try:
+        for sheet_idx in range(workbook.nsheets):
+            sheet = workbook.sheet_by_index(sheet_idx)
+            
+            def rows(sheet=sheet):
+                for row_idx in range(sheet.nrows):
+                    row = []
+                    for cell in sheet.row(row_idx):
+                        if cell.ctype == xlrd.XL_CELL_DATE:
+                            row.append(cell_to_string(xlrd.xldate_as_datetime(cell.value, workbook.datemode)))
+                        elif cell.ctype == xlrd.XL_CELL_BOOLEAN:
+                            row.append(str(bool(cell.value)))
+                        elif cell.ctype in (xlrd.XL_CELL_EMPTY, xlrd.XL_CELL_BLANK, xlrd.XL_CELL_ERROR):
+                            row.append('')
+                        else:
+                            row.append(cell_to_string(cell.value))
+                    if not _is_blank(row):
+                        yield _pad(row, sheet.ncols)
+            
+            yield sheet.name, rows()
+            workbook.unload_sheet(sheet_idx)
+    finally:
+        workbook.release_resources()
+
+def extract_excel_data(excel_binary):
+    """Yield (sheet name, rows) for every sheet, each row a list of cell strings.
     
-    # If all engines fail, raise an error with helpful message
-    error_msg = f"Failed to read Excel file. Last error: {last_error}. "
-    error_msg += "Please ensure your Lambda layer includes pandas, openpyxl (for .xlsx), and xlrd (for .xls)"
-    raise Exception(error_msg)
+    Rows are produced lazily, so they must be consumed before moving to the next sheet.
+    """
+    excel_format = sniff_excel_format(excel_binary)
+    print(f"Detected {excel_format} workbook")
+    if excel_format == 'xlsx':
+        return _iter_xlsx_sheets(excel_binary)
+    return _iter_xls_sheets(excel_binary)
+
+def extract_invoice_document(excel_binary):
+    """Read vendor, invoice number and total directly from sheets of at most SCAN_ROWS rows."""
+    sheets = extract_excel_data(excel_binary)
+    return extract_summary_document(grids=(rows for _, rows in sheets), max_rows=SCAN_ROWS)
 
-def create_pdf_from_excel(df):
+def create_pdf_from_excel(sheets):
+    """Render every sheet, its first row as the header, starting each sheet on a new page.
+    
+    Rows are padded to the sheet's width, so the header spans every column.
+    """
+    from reportlab.pdfgen import canvas
+    from reportlab.lib.pagesizes import letter, landscape
+    from reportlab.lib.utils import simpleSplit
+    
     buffer = io.BytesIO()
     page_width, page_height = landscape(letter)
     c = canvas.Canvas(buffer, pagesize=landscape(letter))
     
     try:
-        # Calculate column widths and positions
-        num_columns = len(df.columns)
         margin = 50
         available_width = page_width - (2 * margin)
-        col_width = available_width / num_columns
+        
+        # Line wraps computed once per distinct cell text, font and width
+        wrapped_lines = {}
         
         def draw_text_cell(text, x, y, width, font_size=10):
-            if pd.isna(text):  # Check for NaN
-                return y
-            
-            text = str(text).strip()
             if not text:  # Skip empty strings
                 return y
             
-            # Split text into lines that fit within column width
-            lines = simpleSplit(text, c._fontname, font_size, width)
+            # Split text into lines that fit within column width; Latin-1 text short
+            # enough to fit even in the widest glyphs needs no measuring
+            if (len(text) * font_size * MAX_GLYPH_WIDTH <= width and text.isprintable()
+                    and max(text) <= MAX_FAST_PATH_CHAR and '  ' not in text):
+                lines = (text,)
+            else:
+                key = (c._fontname, width, text)
+                lines = wrapped_lines.get(key)
+                if lines is None:
+                    lines = wrapped_lines[key] = simpleSplit(text, c._fontname, font_size, width)
             
             for line in lines:
                 c.drawString(x, y, line)
@@ -58,35 +148,50 @@ def create_pdf_from_excel(df):
             
             return y
         
-        y = page_height - margin
-        row_height = 20
-        
-        # Write headers
-        c.setFont("Helvetica-Bold", 10)
-        min_y = y
-        for col_idx, col in enumerate(df.columns):
-            x = margin + (col_idx * col_width)
-            header_y = draw_text_cell(col, x, y, col_width)
-            min_y = min(min_y, header_y)
-        
-        y = min_y - 10  # Add some space after headers
-        
-        # Write data
-        c.setFont("Helvetica", 10)
-        for _, row in df.iterrows():
-            if y < margin + 50:  # Check if we need a new page
+        pages_started = False
+        for sheet_name, rows in sheets:
+            header = next(rows, None)
+            if header is None:
+                print(f"Skipping empty sheet: {sheet_name}")
+                continue
+            if pages_started:
                 c.showPage()
-                c.setFont("Helvetica", 10)
-                y = page_height - margin
+            pages_started = True
+            
+            # Calculate column widths and positions
+            num_columns = len(header)
+            col_width = available_width / num_columns
             
+            y = page_height - margin
+            
+            # Write headers
+            c.setFont("Helvetica-Bold", 10)
             min_y = y
-            for col_idx, value in enumerate(row):
+            for col_idx, col in enumerate(header):
                 x = margin + (col_idx * col_width)
-                cell_y = draw_text_cell(value, x, y, col_width)
-                min_y = min(min_y, cell_y)
+                header_y = draw_text_cell(col, x, y, col_width)
+                min_y = min(min_y, header_y)
+            
+            y = min_y - 10  # Add some space after headers
             
-            y = min_y - 10  # Move to next row, adding some space
+            # Write data
+            c.setFont("Helvetica", 10)
+            for row in rows:
+                if y < margin + 50:  # Check if we need a new page
+                    c.showPage()
+                    c.setFont("Helvetica", 10)
+                    y = page_height - margin
+                
+                min_y = y
+                for col_idx, value in enumerate(row[:num_columns]):
+                    x = margin + (col_idx * col_width)
+                    cell_y = draw_text_cell(value, x, y, col_width)
+                    min_y = min(min_y, cell_y)
+                
+                y = min_y - 10  # Move to next row, adding some space
         
+        if not pages_started:
+            raise Exception("Workbook has no data")
         c.save()
         return buffer.getvalue()
     except Exception as e:
@@ -95,26 +200,17 @@ def create_pdf_from_excel(df):
 def handler(event, context):
     print("Processing Excel attachment...")
     try:
-        email_bucket_name = os.environ['EMAIL_BUCKET_NAME']
         artefact_bucket_name = os.environ['ARTEFACT_BUCKET_NAME']
         message_id = event['messageId']
         attachment_filename = event['filename']
+        metrics.set_correlation_id(message_id)
         
-        # Get email from S3
+        # Get the pre-split Excel attachment from S3
         try:
-            obj = s3.get_object(Bucket=email_bucket_name, Key=message_id)
-            email_content = obj['Body'].read().decode('utf-8')
+            excel_data = load_attachment(s3, artefact_bucket_name, message_id, attachment_filename, event.get('partKey'))
         except Exception as e:
             print(f"Error reading from S3: {str(e)}")
-            raise Exception(f"Failed to read email from S3: {str(e)}")
-        
-        # Extract Excel attachment
-        excel_data = None
-        email_message = email.message_from_string(email_content)
-        for part in email_message.walk():
-            if part.get_content_maintype() == 'application' and part.get_filename() == attachment_filename:
-                excel_data = part.get_payload(decode=True)
-                break
+            raise Exception(f"Failed to read attachment from S3: {str(e)}")
         
         if not excel_data:
             return {
@@ -123,29 +219,56 @@ def handler(event, context):
                 'body': f'No Excel attachment found'
             }
         
+        # The same file sent again reuses its earlier results
+        content_hash, duplicate = find_duplicate(s3, artefact_bucket_name, message_id, excel_data)
+        if duplicate:
+            return duplicate
+        
+        # Invoices laid out as a cell grid skip the PDF and Textract round-trip
+        try:
+            print("Extracting invoice fields from Excel...")
+            invoice_document = extract_invoice_document(excel_data)
+        except Exception as e:
+            print(f"Direct extraction failed, falling back to PDF: {str(e)}")
+            invoice_document = None
+        if invoice_document:
+            summary_key = publish_summary(s3, artefact_bucket_name, message_id, attachment_filename, invoice_document)
+            return {
+                'statusCode': 200,
+                'status': 'success',
+                'messageId': message_id,
+                'summaryKey': summary_key,
+                'contentHash': content_hash
+            }
+        
         # Process Excel file
         print("Extracting data from Excel...")
-        df = extract_excel_data(excel_data)
+        sheets = extract_excel_data(excel_data)
         
-        # Create PDF
+        # Create PDF, streaming the rows of each sheet into it
         print("Creating PDF...")
-        pdf_data = create_pdf_from_excel(df)
+        with metrics.span('RenderPdf') as span:
+            pdf_data = create_pdf_from_excel(sheets)
+            span.add('Bytes', len(pdf_data), 'Bytes')
         
         # Save PDF to S3
         original_filename = os.path.splitext(attachment_filename)[0]
         pdf_key = f'invoices/{message_id}/{original_filename}.pdf'
         print(f"Saving PDF to S3: {pdf_key}")
-        s3.put_object(
-            Bucket=artefact_bucket_name,
-            Key=pdf_key,
-            Body=pdf_data,
-            ContentType='application/pdf'
-        )
+        with metrics.span('S3Put') as span:
+            s3.put_object(
+                Bucket=artefact_bucket_name,
+                Key=pdf_key,
+                Body=pdf_data,
+                ContentType='application/pdf'
+            )
+            span.add('Bytes', len(pdf_data), 'Bytes')
         
         return {
             'statusCode': 200,
             'status': 'success',
-            'pdfKey': pdf_key
+            'pdfKey': pdf_key,
+            'contentHash': content_hash
         }
         
     except Exception as e:
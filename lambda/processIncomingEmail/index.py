@@ -1,10 +1,10 @@
 import json
-import boto3
 import os
-import email
+from aws_clients import get_client
+from mime_stream import read_headers
 
-s3 = boto3.client('s3')
-stepfunctions = boto3.client('stepfunctions')
+s3 = get_client('s3')
+stepfunctions = get_client('stepfunctions')
 
 def handler(event, context):
     # Get the email details fromt he SES event
@@ -12,13 +12,14 @@ def handler(event, context):
     message_id = ses_notification['mail']['messageId']
     bucket_name = os.environ['BUCKET_NAME']
     
-    # Retrieve the mail from S3
-    obj = s3.get_object(Bucket=bucket_name, Key=message_id)
-    email_content = obj['Body'].read().decode('utf-8') 
-    
-    # Parse the email
-    msg = email.message_from_string(email_content)
-    subject = msg['subject']
+    # SES already parsed the common headers; only fall back to the raw mail if the subject is missing
+    subject = ses_notification['mail'].get('commonHeaders', {}).get('subject')
+    if subject is None:
+        obj = s3.get_object(Bucket=bucket_name, Key=message_id)
+        # Only the header block is read from the stream
+        headers = read_headers(obj['Body'])
+        obj['Body'].close()
+        subject = headers['subject'] or ''
     print(f'Email subject: f{subject}')
     # Check if the subject contains "UPDATED ACCOUNT ASSIGNMENTS"
     subject_contains_account_assignment = "UPDATED ACCOUNT ASSIGNMENTS" in subject.upper()
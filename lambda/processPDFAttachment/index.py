@@ -1,42 +1,44 @@
 import os
-import boto3
-import email
+from aws_clients import get_client
+from content_index import find_duplicate
+from email_manifest import load_attachment
+import metrics
 
-s3 = boto3.client('s3')
+s3 = get_client('s3')
 
 def handler(event, context):
     print(f"Extracting PDF attachment from the email...")
-    email_bucket_name = os.environ['EMAIL_BUCKET_NAME']
     artefact_bucket_name = os.environ['ARTEFACT_BUCKET_NAME']
     message_id = event['messageId']
     attachment_filename = event['filename']
+    metrics.set_correlation_id(message_id)
     
     pdf_key = f'invoices/{message_id}/{attachment_filename}'
-    pdf_data = None
-    
-    obj = s3.get_object(Bucket=email_bucket_name, Key=message_id)
-    email_content = obj['Body'].read().decode('utf-8')
-    msg = email.message_from_string(email_content)
-    for part in msg.walk():
-        if part.get_content_maintype() == 'application' and part.get_filename() == attachment_filename:
-            pdf_data = part.get_payload(decode=True)
-            break
+    pdf_data = load_attachment(s3, artefact_bucket_name, message_id, attachment_filename, event.get('partKey'))
     
     if pdf_data:
+        # The same file sent again reuses its Textract results
+        content_hash, duplicate = find_duplicate(s3, artefact_bucket_name, message_id, pdf_data)
+        if duplicate:
+            return duplicate
+        
         try:
             print(f"Saving PDF to bucket [{artefact_bucket_name}], at location [{pdf_key}]...")
             
-            s3.put_object(
-                Bucket=artefact_bucket_name,
-                Key=pdf_key,
-                Body=pdf_data,
-                ContentType='application/pdf'
-            )
+            with metrics.span('S3Put') as span:
+                s3.put_object(
+                    Bucket=artefact_bucket_name,
+                    Key=pdf_key,
+                    Body=pdf_data,
+                    ContentType='application/pdf'
+                )
+                span.add('Bytes', len(pdf_data), 'Bytes')
             print(f"Successfully saved PDF to bucket [{artefact_bucket_name}], at location [{pdf_key}]!")
             result = {
                 'statusCode': 200,
                 'status': 'success',
-                'pdfKey': pdf_key
+                'pdfKey': pdf_key,
+                'contentHash': content_hash
             }
         except Exception as e:
             print(f"Error saving PDF: {str(e)}")
@@ -0,0 +1,158 @@
+import hashlib
+import json
+import os
+import re
+import time
+from typing import Optional, Tuple
+
+from botocore.exceptions import ClientError
+
+from rule_engine import normalize_vendor, sender_address, sender_domain
+
+CACHE_KEY = 'assignment_cache.json'
+DEFAULT_TTL_SECONDS = int(os.environ.get('ASSIGNMENT_CACHE_TTL_DAYS', '30')) * 24 * 3600
+DEFAULT_MAX_ENTRIES = int(os.environ.get('ASSIGNMENT_CACHE_MAX_ENTRIES', '5000'))
+CACHEABLE_CONFIDENCE = {'high', 'medium'}
+# Assignments made by rules on inputs outside the key (the email body or subject,
+# the amount, a full sender address) would be wrong for the next invoice sharing it
+INPUT_DEPENDENT_RULE = re.compile(
+    r'\$|\b(?:over|under|above|below|greater|less|more|amount|total|contains?|mentions?|body|subject|keyword)\b|[\w.+-]+@[\w-]+\.',
+    re.IGNORECASE
+)
+# Attempts at writing the cache back while other invocations save theirs
+SAVE_ATTEMPTS = 3
+
+
+def invoice_number_shape(invoice_number: str) -> str:
+    """Keep letters and punctuation, replace every digit with 9 (e.g. INV-2024-001 -> INV-9999-999)."""
+    return re.sub(r'\d', '9', (invoice_number or '').strip().upper())
+
+
+class AssignmentCache:
+    """Persistent cache of model assignments, stored as one JSON object in S3.
+
+    Entries are keyed by a hash of the rules version, normalized vendor name,
+    sender domain and invoice-number shape, so publishing new rules invalidates
+    every entry. The cache is loaded once and saved once per invocation; saves
+    are conditional on the ETag that was read, and on a conflict the entries
+    of the other invocation are merged in before writing again.
+    """
+
+    def __init__(self, s3_client, bucket: str, rules_version: Optional[str], ttl_seconds: int = DEFAULT_TTL_SECONDS, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.rules_version = rules_version or ''
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self._dirty = False
+        # ETag of the stored cache the entries were read from, None when there was none
+        self._etag = None
+        self._load()
+
+    def _read(self) -> Tuple[Optional[dict], Optional[str], bool]:
+        """Return the stored cache's unexpired entries for the current rules, its ETag, and whether any were dropped."""
+        try:
+            obj = self.s3_client.get_object(Bucket=self.bucket, Key=CACHE_KEY)
+        except self.s3_client.exceptions.NoSuchKey:
+            return None, None, False
+        data = json.loads(obj['Body'].read())
+        if data.get('rulesVersion') != self.rules_version:
+            print("Assignment cache was built for other rules, discarding it")
+            return {}, obj['ETag'], True
+        now = time.time()
+        entries = {
+            key: entry for key, entry in data.get('entries', {}).items()
+            if now - entry['storedAt'] < self.ttl_seconds
+        }
+        return entries, obj['ETag'], len(entries) != len(data.get('entries', {}))
+
+    def _load(self) -> None:
+        try:
+            entries, self._etag, dropped = self._read()
+        except Exception as e:
+            print(f"Error loading assignment cache, starting empty: {str(e)}")
+            return
+        if entries is None:
+            print("No assignment cache found, starting empty")
+            return
+        self.entries = entries
+        self._dirty = dropped
+        print(f"Loaded {len(self.entries)} assignment cache entries")
+
+    def _merge(self, stored: dict) -> None:
+        """Fold in entries saved by other invocations, keeping the newest of each and the latest use."""
+        for key, entry in stored.items():
+            own = self.entries.get(key)
+            if own is None or entry['storedAt'] > own['storedAt']:
+                self.entries[key] = dict(entry, usedAt=max(entry['usedAt'], own['usedAt'] if own else 0))
+            else:
+                own['usedAt'] = max(own['usedAt'], entry['usedAt'])
+
+    def _key(self, vendor_name: str, sender_email: str, invoice_number: str) -> str:
+        features = '|'.join([
+            self.rules_version,
+            normalize_vendor(vendor_name),
+            sender_domain(sender_email),
+            invoice_number_shape(invoice_number)
+        ])
+        return hashlib.sha256(features.encode('utf-8')).hexdigest()
+
+    def get(self, vendor_name: str, sender_email: str, invoice_number: str) -> Optional[dict]:
+        entry = self.entries.get(self._key(vendor_name, sender_email, invoice_number))
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        entry['usedAt'] = time.time()
+        self._dirty = True
+        return dict(entry['assignment'])
+
+    def put(self, vendor_name: str, sender_email: str, invoice_number: str, assignment: Optional[dict]) -> None:
+        if not assignment or str(assignment.get('confidence', '')).lower() not in CACHEABLE_CONFIDENCE:
+            return
+        rule = str(assignment.get('rule_matched') or '')
+        address = sender_address(sender_email)
+        if INPUT_DEPENDENT_RULE.search(rule) or (address and address in rule.lower()):
+            print(f"Not caching assignment from a rule on the body, amount or sender address: {rule}")
+            return
+        now = time.time()
+        self.entries[self._key(vendor_name, sender_email, invoice_number)] = {
+            'assignment': {key: assignment.get(key) for key in ('accountant', 'rule_matched', 'confidence')},
+            'storedAt': now,
+            'usedAt': now
+        }
+        self._dirty = True
+
+    def save(self) -> None:
+        """Write the cache back, merging entries saved meanwhile and evicting the least recently used beyond the size bound."""
+        if not self._dirty:
+            return
+        for attempt in range(SAVE_ATTEMPTS):
+            if len(self.entries) > self.max_entries:
+                keep = sorted(self.entries.items(), key=lambda item: item[1]['usedAt'], reverse=True)[:self.max_entries]
+                self.entries = dict(keep)
+            condition = {'IfMatch': self._etag} if self._etag else {'IfNoneMatch': '*'}
+            try:
+                response = self.s3_client.put_object(
+                    Bucket=self.bucket,
+                    Key=CACHE_KEY,
+                    Body=json.dumps({'rulesVersion': self.rules_version, 'entries': self.entries}),
+                    ContentType='application/json',
+                    **condition
+                )
+                self._etag = response.get('ETag')
+                break
+            except ClientError as e:
+                if e.response['Error']['Code'] not in ('PreconditionFailed', 'ConditionalRequestConflict', 'NoSuchKey'):
+                    raise
+            print("Assignment cache changed since it was read, merging")
+            stored, self._etag, _ = self._read()
+            self._merge(stored or {})
+        else:
+            print("Gave up saving the assignment cache after concurrent updates")
+            return
+        self._dirty = False
+        print(f"Saved {len(self.entries)} assignment cache entries (hits: {self.hits}, misses: {self.misses})")
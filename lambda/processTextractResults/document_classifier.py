@@ -0,0 +1,82 @@
+import json
+import os
+import re
+from typing import Dict, Iterable, Optional
+
+# Keyword categories are matched case-insensitively; a category with an
+# ignoreReason marks the whole document as not an invoice.
+# Vendor invoice-number patterns are case-sensitive regexes, keyed by the
+# lowercased vendor name; the first block text they match is the invoice number.
+# Patterns may not contain named groups.
+DEFAULT_CONFIG = {
+    'categories': {
+        'statement': {
+            'keywords': ['statement', 'statements', 'statement as of', 'statement of'],
+            'ignoreReason': 'Statement document detected'
+        },
+        'quote': {
+            'keywords': ['quote', 'estimate']
+        }
+    },
+    'vendorInvoicePatterns': {
+        'workquest': 'TINV'
+    }
+}
+
+
+class DocumentClassifier:
+    """Labels a document in one pass over its texts with a single combined regex."""
+
+    def __init__(self, config: dict):
+        self.categories = config.get('categories', {})
+        self.vendor_patterns = {vendor.lower(): pattern for vendor, pattern in config.get('vendorInvoicePatterns', {}).items()}
+
+        self._group_targets = {}
+        alternatives = []
+        for i, (label, category) in enumerate(self.categories.items()):
+            keywords = sorted(category.get('keywords', []), key=len, reverse=True)
+            if keywords:
+                group = f'c{i}'
+                self._group_targets[group] = ('label', label)
+                alternatives.append(f"(?P<{group}>(?i:{'|'.join(map(re.escape, keywords))}))")
+        for i, (vendor, pattern) in enumerate(self.vendor_patterns.items()):
+            if re.compile(pattern).groupindex:
+                # The alternation is resolved through match.lastgroup, which an inner named group would take over
+                raise ValueError(f"Invoice number pattern for vendor [{vendor}] must not contain named groups: {pattern}")
+            group = f'v{i}'
+            self._group_targets[group] = ('vendor', vendor)
+            alternatives.append(f'(?P<{group}>{pattern})')
+        self._matcher = re.compile('|'.join(alternatives)) if alternatives else None
+
+    def classify(self, texts: Iterable[str]) -> dict:
+        """Return the labels and vendor invoice numbers found, each with the first text it occurred in."""
+        labels: Dict[str, str] = {}
+        vendor_invoice_numbers: Dict[str, str] = {}
+        if self._matcher is None:
+            return {'labels': labels, 'vendorInvoiceNumbers': vendor_invoice_numbers}
+
+        for text in texts:
+            for match in self._matcher.finditer(text):
+                kind, target = self._group_targets[match.lastgroup]
+                found = labels if kind == 'label' else vendor_invoice_numbers
+                found.setdefault(target, text)
+        return {'labels': labels, 'vendorInvoiceNumbers': vendor_invoice_numbers}
+
+    def ignore_reason(self, classification: dict) -> Optional[str]:
+        """Reason to ignore the document, if any of its labels is an ignored category."""
+        for label in classification['labels']:
+            reason = self.categories[label].get('ignoreReason')
+            if reason:
+                return reason
+        return None
+
+    def has_vendor_pattern(self, vendor_name: str) -> bool:
+        return vendor_name.lower() in self.vendor_patterns
+
+
+def load_classifier() -> DocumentClassifier:
+    """Build the classifier from DOCUMENT_CLASSIFIER_CONFIG (JSON), falling back to the defaults."""
+    config = DEFAULT_CONFIG
+    if os.environ.get('DOCUMENT_CLASSIFIER_CONFIG'):
+        config = json.loads(os.environ['DOCUMENT_CLASSIFIER_CONFIG'])
+    return DocumentClassifier(config)
@@ -0,0 +1,113 @@
+import datetime
+import json
+import time
+from typing import Optional, Tuple
+
+from botocore.exceptions import ClientError
+
+INDEX_PREFIX = 'duplicate-index'
+# Attempts at recording an invoice while another request writes or releases the same key
+CLAIM_ATTEMPTS = 3
+# Age after which a claim that was never confirmed is treated as free: well past the
+# processTextractResults timeout, so the invocation that made it is gone
+PENDING_TIMEOUT = datetime.timedelta(minutes=15)
+PENDING = 'pending'
+SAVED = 'saved'
+
+
+def index_key(key: str) -> str:
+    return f'{INDEX_PREFIX}/{key}.json'
+
+
+def _is_own(entry: dict, message_id: str, source: str) -> bool:
+    """Whether an entry was recorded for this very attachment, e.g. by an earlier attempt of the execution."""
+    return entry.get('messageId') == message_id and entry.get('source') == source
+
+
+def _is_stale(entry: dict) -> bool:
+    """Whether an entry is a claim whose invocation died before saving the invoice or releasing it."""
+    if entry.get('state') != PENDING:
+        return False
+    recorded_at = datetime.datetime.fromisoformat(entry['recordedAt'])
+    return datetime.datetime.now(datetime.timezone.utc) - recorded_at > PENDING_TIMEOUT
+
+
+def _read(s3_client, bucket: str, key: str) -> Tuple[Optional[dict], Optional[str]]:
+    try:
+        obj = s3_client.get_object(Bucket=bucket, Key=index_key(key))
+    except s3_client.exceptions.NoSuchKey:
+        return None, None
+    return json.loads(obj['Body'].read()), obj['ETag']
+
+
+def _put(s3_client, bucket: str, key: str, entry: dict, etag: Optional[str]) -> bool:
+    """Write an entry if the key is still absent, or still holds the version read; False if it changed."""
+    condition = {'IfMatch': etag} if etag else {'IfNoneMatch': '*'}
+    try:
+        s3_client.put_object(
+            Bucket=bucket,
+            Key=index_key(key),
+            Body=json.dumps(entry),
+            ContentType='application/json',
+            **condition
+        )
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ('PreconditionFailed', 'ConditionalRequestConflict', 'NoSuchKey'):
+            raise
+        return False
+
+
+def claim(s3_client, bucket: str, key: str, message_id: str, source: str, invoice_data: dict) -> Optional[dict]:
+    """Record an invoice as pending for an email, or return the entry of the email that saved it first.
+
+    Checking and recording are one conditional PUT, so two executions seeing the
+    same invoice at once cannot both treat it as new. Entries are not cached:
+    the owner of an entry may release it, so a duplicate is only reported once
+    its entry has been read back from S3. The entry stays pending until the
+    invoice is saved and confirm() is called; a pending entry older than
+    PENDING_TIMEOUT is taken over, as its invocation died (timeout, out of
+    memory) without saving or releasing it.
+    """
+    entry = {
+        'messageId': message_id,
+        'source': source,
+        'invoiceNumber': invoice_data.get('invoice_number', ''),
+        'vendorName': invoice_data.get('vendor_name', ''),
+        'amount': str(invoice_data.get('amount', '')),
+        'state': PENDING,
+        'recordedAt': datetime.datetime.now(datetime.timezone.utc).isoformat()
+    }
+    etag = None
+    for attempt in range(CLAIM_ATTEMPTS):
+        if _put(s3_client, bucket, key, entry, etag):
+            return None
+        existing, etag = _read(s3_client, bucket, key)
+        if existing is not None:
+            if _is_own(existing, message_id, source):
+                return None
+            if not _is_stale(existing):
+                return existing
+            print(f"Taking over invoice [{key}] left pending by message_id: {existing['messageId']}")
+            continue
+        # A concurrent write of the key has not landed yet, or the entry was just released
+        time.sleep(0.1 * (attempt + 1))
+    raise RuntimeError(f"Could not record invoice [{key}] in the duplicate index")
+
+
+def confirm(s3_client, bucket: str, key: str, message_id: str, source: str) -> None:
+    """Mark an invoice recorded by this attachment as saved, so its entry never expires."""
+    entry, etag = _read(s3_client, bucket, key)
+    if entry is None or not _is_own(entry, message_id, source) or entry.get('state') != PENDING:
+        return
+    entry['state'] = SAVED
+    if not _put(s3_client, bucket, key, entry, etag):
+        print(f"Invoice [{key}] changed while being confirmed for message_id: {message_id}")
+
+
+def release(s3_client, bucket: str, key: str, message_id: str, source: str) -> None:
+    """Forget an invoice recorded by this attachment that ended up not being saved."""
+    entry, _ = _read(s3_client, bucket, key)
+    if entry is None or not _is_own(entry, message_id, source):
+        return
+    s3_client.delete_object(Bucket=bucket, Key=index_key(key))
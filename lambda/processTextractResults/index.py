@@ -1,47 +1,68 @@
 import json
-import boto3
 import os
 import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
 import pytz
-import csv
-import io
-from email import parser
 from email.utils import parsedate_to_datetime
-from typing import Dict, List, Tuple, Optional
+from typing import Dict, Iterator, List, Tuple, Optional
+from aws_clients import get_client
+from email_manifest import load_manifest
+from result_store import append_rows
+from textract_summary import summarize_expense_document
+from rule_engine import CompiledRules, compile_rules
+import rules_cache
+from document_classifier import load_classifier
+import content_index
+import duplicate_index
+import metrics
+from invoice_keys import invoice_key
+from assignment_cache import AssignmentCache
+
+
+# Built once per container from the configurable category and vendor pattern table
+classifier = load_classifier()
 
 
 class InvoiceProcessor:
-    def __init__(self, email_bucket: str, artefact_bucket: str, result_bucket: str, timezone: str):
+    def __init__(self, email_bucket: str, artefact_bucket: str, result_bucket: str, timezone: str, ledger_bucket: Optional[str] = None):
         print(f"Initializing InvoiceProcessor with buckets: email={email_bucket}, artefact={artefact_bucket}, result={result_bucket}")
         self.email_bucket = email_bucket
         self.artefact_bucket = artefact_bucket
         self.result_bucket = result_bucket
+        # The duplicate index outlives the daily results, next to the ledger
+        self.duplicate_bucket = ledger_bucket or result_bucket
         self.timezone = timezone
-        self.bedrock_runtime = boto3.client('bedrock-runtime')
-        self.s3_client = boto3.client('s3')
+        self.bedrock_runtime = get_client('bedrock-runtime')
+        self.s3_client = get_client('s3')
+        self._email_details = {}
+        self._email_details_locks = {}
+        self._lock = threading.Lock()
+        self._rules_revalidated = False
+        self._assignment_cache = None
+        self.assignment_batch_size = int(os.environ.get('ASSIGNMENT_BATCH_SIZE', '10'))
+        self.max_workers = max(int(os.environ.get('MAX_WORKERS', '8')), 1)
         
         self.INVOICE_HEADERS = ['ReceiptDate', 'ReceiptTime', 'InvoiceNbr', 'VendorName', 'Amount', 'AcctAssigned']
-        self.LOG_HEADERS = ['Timestamp', 'MessageId', 'InvoiceNbr', 'Status', 'ErrorReason', 'LLMConfidence']
+        self.LOG_HEADERS = ['Timestamp', 'MessageId', 'InvoiceNbr', 'Status', 'ErrorReason', 'LLMConfidence', 'AssignmentCache', 'DuplicateOf']
     
     def _extract_email_details(self, message_id: str) -> datetime:
-        """Extract datetime from email metadata."""
-        print(f"Extracting datetime from email with message_id: {message_id}")
-        obj = self.s3_client.get_object(Bucket=self.email_bucket, Key=message_id)
-        email_content = obj['Body'].read().decode('utf-8')
-        email_message = parser.Parser().parsestr(email_content)
-        # Extract body based on content type
-        if email_message.is_multipart():
-            for part in email_message.walk():
-                if part.get_content_type() == "text/plain":
-                    email_body = part.get_payload(decode=True).decode()
-                    break
-        else:
-            email_body = email_message.get_payload(decode=True).decode()
-        email_sender = email_message['From']
-        email_datetime = parsedate_to_datetime(email_message['Date'])
-        local_tz = pytz.timezone(self.timezone)
-        return email_datetime.astimezone(local_tz), email_sender, email_body
+        """Extract datetime, sender and body from the parsed email manifest."""
+        with self._lock:
+            message_lock = self._email_details_locks.setdefault(message_id, threading.Lock())
+        # Jobs of the same email run concurrently; only the first one reads the manifest
+        with message_lock:
+            if message_id in self._email_details:
+                return self._email_details[message_id]
+            print(f"Extracting datetime from email manifest with message_id: {message_id}")
+            manifest = load_manifest(self.s3_client, self.artefact_bucket, message_id)
+            email_body = manifest['body']
+            email_sender = manifest['sender']
+            email_datetime = parsedate_to_datetime(manifest['date'])
+            local_tz = pytz.timezone(self.timezone)
+            self._email_details[message_id] = (email_datetime.astimezone(local_tz), email_sender, email_body)
+            return self._email_details[message_id]
     
     def _get_next_business_day(self, date) -> datetime:
         """Calculate the next business day."""
@@ -71,7 +92,9 @@ class InvoiceProcessor:
             'InvoiceNbr': '',
             'Status': 'Success',
             'ErrorReason': '',
-            'LLMConfidence': ''
+            'LLMConfidence': '',
+            'AssignmentCache': '',
+            'DuplicateOf': ''
         }
         
     def _is_valid_job(self, job: dict, log_data: dict) -> bool:
@@ -84,73 +107,69 @@ class InvoiceProcessor:
             return False
         return True
 
-    def _get_or_create_csv(self, date: datetime, suffix: str, headers: List[str]) -> Tuple[str, List[List[str]]]:
-        """Get existing CSV or create new one with headers."""
-        csv_filename = f"{date.strftime('%Y-%m-%d')}_{suffix}.csv"
-        print(f"Accessing CSV file: {csv_filename}")
-        
-        try:
-            csv_obj = self.s3_client.get_object(Bucket=self.result_bucket, Key=csv_filename)
-            csv_content = csv_obj['Body'].read().decode('utf-8')
-            print(f"Existing CSV file found: {csv_filename}")
-            return csv_filename, list(csv.reader(io.StringIO(csv_content)))
-        except self.s3_client.exceptions.NoSuchKey:
-            print(f"Creating new CSV file: {csv_filename}")
-            return csv_filename, [headers]
-        
-    def _write_csv(self, filename: str, rows: List[List[str]]) -> None:
-        """Write CSV data to S3."""
-        print(f"Writing {len(rows)} rows to CSV file: {filename}")
-        output = io.StringIO()
-        csv.writer(output).writerows(rows)
-        self.s3_client.put_object(
-            Bucket=self.result_bucket,
-            Key=filename,
-            Body=output.getvalue()
-        )
-        print(f"Successfully wrote data to {filename}")
+    def _append_rows(self, date: datetime, suffix: str, headers: List[str], rows: List[list]) -> None:
+        """Append rows to the day's sharded result store."""
+        print(f"Appending {len(rows)} row(s) to {suffix} for date: {date.strftime('%Y-%m-%d')}")
+        append_rows(self.s3_client, self.result_bucket, date.strftime('%Y-%m-%d'), suffix, headers, rows)
 
-    def _update_logs(self, target_date: datetime, log_data: dict) -> None:
-        """Update the logs CSV file with new log data."""
+    def _log_row(self, target_date: datetime, log_data: dict) -> list:
+        """Build the log row of a job for the day's logs."""
         print(f"Updating logs for date: {target_date}, Status: {log_data['Status']}")
-        log_csv_filename, log_rows = self._get_or_create_csv(
-            target_date,
-            'logs',
-            self.LOG_HEADERS
-        )
+        return [log_data[header] for header in self.LOG_HEADERS]
+
+    def _commit_rows(self, invoice_rows: Dict[str, List[list]], log_rows: Dict[str, List[list]], dates: Dict[str, datetime], records: List[dict]) -> None:
+        """Write the invocation's rows as one invoices shard and one logs shard per target date.
         
-        log_rows.append([log_data[header] for header in self.LOG_HEADERS])
-        self._write_csv(log_csv_filename, log_rows)
+        The duplicate index entries of the invoices of a date are confirmed once its
+        invoices shard is written. If a shard cannot be written, the entries of the
+        invoices of that date and of the dates not written yet are released, so a
+        retry or a later email can save them; invoices already written keep theirs.
+        """
+        written = set()
+        for key, rows in invoice_rows.items():
+            try:
+                self._append_rows(dates[key], 'invoices', self.INVOICE_HEADERS, rows)
+            except Exception:
+                for record in records:
+                    if record['target_date'].strftime('%Y-%m-%d') not in written:
+                        self._release_duplicate_key(record)
+                raise
+            written.add(key)
+            for record in records:
+                if record['target_date'].strftime('%Y-%m-%d') == key:
+                    self._confirm_duplicate_key(record)
+        for key, rows in log_rows.items():
+            self._append_rows(dates[key], 'logs', self.LOG_HEADERS, rows)
         
-    def _is_invalid_document(self, expense_doc: dict, log_data: dict) -> bool:
+    def _is_invalid_document(self, classification: dict, log_data: dict) -> bool:
         """Check if the document is invalid (e.g., statement, quote, etc.)."""
         print("Checking for invalid document types...")
-        statement_keywords = ['statement', 'statements', 'statement as of', 'statement of']
-        
-        # Check for statements
-        for block in expense_doc.get('Blocks', []):
-            block_text = block.get('Text', '').lower()
-            if any(keyword in block_text for keyword in statement_keywords):
-                print(f"Invalid document detected - Statement keyword found: {block_text}")
-                log_data['Status'] = 'Ignore'
-                log_data['ErrorReason'] = 'Statement document detected'
-                return True
+        reason = classifier.ignore_reason(classification)
+        if reason:
+            print(f"Invalid document detected - {reason}: {list(classification['labels'].values())}")
+            log_data['Status'] = 'Ignore'
+            log_data['ErrorReason'] = reason
+            return True
         return False
 
     def _is_quote_or_estimate(self, field_label: str) -> bool:
         """Check if the document is a quote or estimate."""
-        result = "quote" in field_label.lower() or "estimate" in field_label.lower()
+        result = 'quote' in classifier.classify([field_label])['labels']
         if result:
             print(f"Quote or estimate detected in field label: {field_label}")
         return result
 
     def _extract_invoice_fields(self, expense_doc: dict, invoice_data: dict) -> dict:
-        """Extract invoice fields from Textract expense document."""
+        """Extract invoice fields from a summarized Textract expense document."""
         print("Extracting invoice fields from expense document...")
-        for field in expense_doc.get('SummaryFields', []):
-            field_type = field.get('Type', {}).get('Text', '')
-            field_value = field.get('ValueDetection', {}).get('Text', '')
-            field_label = field.get('LabelDetection', {}).get('Text', '')
+        fields = expense_doc['summaryFields']
+        for field_type, field in (
+            (field_type, field)
+            for field_type in ('INVOICE_RECEIPT_ID', 'VENDOR_NAME', 'TOTAL')
+            for field in fields.get(field_type, [])
+        ):
+            field_value = field['value']
+            field_label = field['label']
             
             if field_type == 'INVOICE_RECEIPT_ID':
                 if self._is_quote_or_estimate(field_label):
@@ -176,30 +195,25 @@ class InvoiceProcessor:
         print(f"Extracted invoice data: {json.dumps(invoice_data)}")
         return invoice_data
     
-    def _process_workquest_invoice(self, expense_doc: dict, invoice_data: dict) -> dict:
-        """Special processing for Workquest invoices."""
-        print("Processing Workquest invoice...")
-        workquest_invoice_number_keywords = ['TINV']
-        
-        for block in expense_doc.get('Blocks', []):
-            block_text = block.get('Text', '')
-            if any(keyword in block_text for keyword in workquest_invoice_number_keywords):
-                print(f"Found Workquest invoice number: {block_text}")
-                invoice_data['invoice_number'] = block_text
-                break
+    def _apply_vendor_invoice_pattern(self, classification: dict, invoice_data: dict) -> dict:
+        """Special processing for vendors whose invoice numbers Textract does not detect (e.g. Workquest)."""
+        vendor = invoice_data['vendor_name'].lower()
+        print(f"Applying invoice number pattern for vendor: {vendor}")
+        block_text = classification['vendorInvoiceNumbers'].get(vendor)
+        if block_text:
+            print(f"Found {vendor} invoice number: {block_text}")
+            invoice_data['invoice_number'] = block_text
         
         return invoice_data   
     
-    def _get_account_assignment_rules(self) -> dict:
-        """Fetch account assignment rules from S3."""
-        print("Fetching account assignment rules from S3...")
+    def _get_account_assignment_rules(self) -> str:
+        """Fetch account assignment rules, from the container cache when still current."""
+        print("Fetching account assignment rules...")
         try:
-            response = self.s3_client.get_object(
-                Bucket=self.artefact_bucket,
-                Key='account_assignment_rules.txt'
-            )
-            rules = response['Body'].read().decode('utf-8')
-            print(f"Successfully loaded {len(rules)} account assignment rules")
+            # Revalidate once per invocation so a newly published rules file is picked up right away
+            rules = rules_cache.get_rules(self.s3_client, self.artefact_bucket, force=not self._rules_revalidated)
+            self._rules_revalidated = True
+            print(f"Successfully loaded {len(rules)} characters of account assignment rules (version {rules_cache.rules_version()})")
             return rules
         except Exception as e:
             print(f"Error getting account assignment rules: {str(e)}")
@@ -245,54 +259,205 @@ Response format:
     "confidence": "high/medium/low"
 }}"""
 
-    def determine_account_assignment(self, vendor_name: str, invoice_number: str, sender_email: str, email_body: str) -> Optional[dict]:
-        """Determine account assignment using Claude."""
-        print(f"Determining account assignment for vendor: {vendor_name}, invoice: {invoice_number}")
-        rules = self._get_account_assignment_rules()
-        if not rules:
-            print("No account assignment rules found")
-            return None
+    def _construct_batch_claude_prompt(self, invoices: List[dict], rules: str) -> str:
+        """Construct a single prompt asking Claude to assign several invoices at once."""
+        print(f"Constructing batched Claude prompt for {len(invoices)} invoices")
+        invoice_lines = "\n".join(
+            f"""{i}. Vendor name: "{invoice['vendor_name']}" | Invoice number: "{invoice['invoice_number']}" | Sender email: "{invoice['sender_email']}" | Email body excerpt: "{invoice['email_body'][:500]}..." """
+            for i, invoice in enumerate(invoices)
+        )
+        return f"""Given the following invoices, each identified by its id:
+{invoice_lines}
 
-        prompt = self._construct_claude_prompt(vendor_name, invoice_number, sender_email, email_body, rules)
-        
-        try:
-            print("Invoking Claude model for account assignment...")
+Determine the appropriate accountant assignment for each invoice based on these rules:
+
+{rules}
+Context about the rules:
+1. The rules are written in plain English and may reference any combination of:
+   - Vendor names or patterns
+   - Invoice number patterns
+   - Sender email addresses or domains
+   - Keywords or patterns in the email body
+2. Some rules are marked as exceptions and should take precedence
+3. Rules may have multiple conditions that all need to be met
+
+Assignment logic, applied to each invoice independently:
+1. First, check for any matching exception rules
+2. Look for rules that match multiple criteria (vendor, invoice, email, content)
+3. If no specific matches, use the most relevant general rule
+4. Consider the sender's email domain and email content for additional context
+
+Return your response as a JSON array with one object per invoice and these fields only:
+- id: the id of the invoice
+- accountant: the assigned accountant's name
+- rule_matched: description of the rule that was matched
+- confidence: "high" if there's a clear match, "medium" if it's a probable match, "low" if uncertain
+Do not provide anything else in the response. Your response must strictly be in JSON format.
+
+Response format:
+[
+    {{
+        "id": 0,
+        "accountant": "accountant name",
+        "rule_matched": "description of the matched rule",
+        "confidence": "high/medium/low"
+    }}
+]"""
+
+    def _invoke_claude(self, prompt: str, max_tokens: int) -> str:
+        """Invoke Claude on Bedrock and return the text of the response."""
+        with metrics.span('BedrockInvoke') as span:
             response = self.bedrock_runtime.invoke_model(
                 modelId="anthropic.claude-3-haiku-20240307-v1:0",
                 body=json.dumps({
                     "anthropic_version": "bedrock-2023-05-31",
-                    "max_tokens": 200,
+                    "max_tokens": max_tokens,
                     "temperature": 0,
                     "messages": [{"role": "user", "content": prompt}]
                 }).encode()
             )
             response_body = json.loads(response['body'].read())
-            result = json.loads(response_body['content'][0]['text'])
+            usage = response_body.get('usage', {})
+            span.add('InputTokens', usage.get('input_tokens', 0))
+            span.add('OutputTokens', usage.get('output_tokens', 0))
+        return response_body['content'][0]['text']
+
+    def _get_compiled_rules(self) -> CompiledRules:
+        """Compile the cached rules into the deterministic matcher, once per rules version."""
+        return rules_cache.get_derived('compiled_rules', compile_rules)
+
+    def _match_rules(self, vendor_name: str, invoice_number: str, sender_email: str) -> Optional[dict]:
+        """Try to assign the invoice with the deterministic rule matcher."""
+        result = self._get_compiled_rules().match(vendor_name, invoice_number, sender_email)
+        if result:
+            print(f"Rule engine assignment result: {json.dumps(result)}")
+            result['source'] = 'rules'
+        return result
+
+    def _get_assignment_cache(self) -> AssignmentCache:
+        """Load the persistent assignment cache for the current rules version, once per invocation."""
+        if self._assignment_cache is None or self._assignment_cache.rules_version != (rules_cache.rules_version() or ''):
+            self._assignment_cache = AssignmentCache(self.s3_client, self.artefact_bucket, rules_cache.rules_version())
+        return self._assignment_cache
+
+    def save_assignment_cache(self) -> None:
+        """Write back the assignment cache if it changed during this invocation."""
+        if self._assignment_cache is not None:
+            try:
+                self._assignment_cache.save()
+            except Exception as e:
+                print(f"Error saving assignment cache: {str(e)}")
+
+    def _assign_with_claude(self, vendor_name: str, invoice_number: str, sender_email: str, email_body: str, rules: str) -> Optional[dict]:
+        """Ask Claude for the account assignment of a single invoice."""
+        prompt = self._construct_claude_prompt(vendor_name, invoice_number, sender_email, email_body, rules)
+        
+        try:
+            print("Invoking Claude model for account assignment...")
+            result = json.loads(self._invoke_claude(prompt, 200))
             print(f"Claude assignment result: {json.dumps(result)}")
             return result
         except Exception as e:
             print(f"Error in account assignment: {str(e)}")
             return None
+
+    def determine_account_assignment(self, vendor_name: str, invoice_number: str, sender_email: str, email_body: str) -> Optional[dict]:
+        """Determine account assignment using the rule engine, the assignment cache, then Claude."""
+        print(f"Determining account assignment for vendor: {vendor_name}, invoice: {invoice_number}")
+        return self.determine_account_assignments([{
+            'vendor_name': vendor_name,
+            'invoice_number': invoice_number,
+            'sender_email': sender_email,
+            'email_body': email_body
+        }])[0]
+
+    def _determine_batch_assignment(self, invoices: List[dict], rules: str) -> List[Optional[dict]]:
+        """Assign a batch of invoices with one Claude call, falling back to single calls."""
+        results = [None] * len(invoices)
+        try:
+            print(f"Invoking Claude model for batched account assignment of {len(invoices)} invoices...")
+            prompt = self._construct_batch_claude_prompt(invoices, rules)
+            response = json.loads(self._invoke_claude(prompt, min(200 * len(invoices), 4096)))
+            for item in response:
+                index = item.get('id')
+                if isinstance(index, int) and 0 <= index < len(invoices) and item.get('accountant') is not None:
+                    results[index] = {key: item.get(key) for key in ('accountant', 'rule_matched', 'confidence')}
+            print(f"Claude batched assignment result: {json.dumps(results)}")
+        except Exception as e:
+            print(f"Error parsing batched account assignment, falling back to single calls: {str(e)}")
+
+        for i, invoice in enumerate(invoices):
+            if results[i] is None:
+                results[i] = self._assign_with_claude(
+                    invoice['vendor_name'],
+                    invoice['invoice_number'],
+                    invoice['sender_email'],
+                    invoice['email_body'],
+                    rules
+                )
+        return results
+
+    def determine_account_assignments(self, invoices: List[dict]) -> List[Optional[dict]]:
+        """Determine account assignments for several invoices, batching the Claude calls
+        for those neither the rule engine nor the assignment cache can answer.
+
+        Each invoice is a dict with vendor_name, invoice_number, sender_email and email_body.
+        """
+        if not invoices:
+            return []
+        print(f"Determining account assignments for {len(invoices)} invoices in batches of {self.assignment_batch_size}")
+        rules = self._get_account_assignment_rules()
+        if not rules:
+            print("No account assignment rules found")
+            return [None] * len(invoices)
+
+        results = [
+            self._match_rules(invoice['vendor_name'], invoice['invoice_number'], invoice['sender_email'])
+            for invoice in invoices
+        ]
+        unmatched = [i for i, result in enumerate(results) if result is None]
+        print(f"Rule engine assigned {len(invoices) - len(unmatched)} of {len(invoices)} invoices")
+
+        cache = self._get_assignment_cache()
+        for i in unmatched:
+            cached = cache.get(invoices[i]['vendor_name'], invoices[i]['sender_email'], invoices[i]['invoice_number'])
+            if cached:
+                print(f"Assignment cache hit for vendor: {invoices[i]['vendor_name']}, invoice: {invoices[i]['invoice_number']}")
+                cached['source'] = 'cache'
+                results[i] = cached
+        unmatched = [i for i in unmatched if results[i] is None]
+
+        batch_size = max(self.assignment_batch_size, 1)
+        batches = [unmatched[start:start + batch_size] for start in range(0, len(unmatched), batch_size)]
+
+        def assign_batch(batch: List[int]) -> List[Optional[dict]]:
+            if len(batch) == 1:
+                invoice = invoices[batch[0]]
+                return [self._assign_with_claude(
+                    invoice['vendor_name'],
+                    invoice['invoice_number'],
+                    invoice['sender_email'],
+                    invoice['email_body'],
+                    rules
+                )]
+            return self._determine_batch_assignment([invoices[i] for i in batch], rules)
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, max(len(batches), 1))) as executor:
+            for batch, batch_results in zip(batches, executor.map(assign_batch, batches)):
+                for i, result in zip(batch, batch_results):
+                    if result:
+                        cache.put(invoices[i]['vendor_name'], invoices[i]['sender_email'], invoices[i]['invoice_number'], result)
+                        result['source'] = 'llm'
+                    results[i] = result
+        return results
     
-    def _save_invoice_data(self, invoice_data: dict, email_datetime: datetime, sender_email: str, email_body: str, target_date: datetime, log_data: dict) -> None:
-        """Save processed invoice data to S3."""
-        print(f"Saving invoice data for date: {target_date}")
-        account_assignment = self.determine_account_assignment(
-            invoice_data['vendor_name'],
-            invoice_data['invoice_number'],
-            sender_email,
-            email_body
-        )
-        
+    def _invoice_row(self, invoice_data: dict, email_datetime: datetime, target_date: datetime, log_data: dict, account_assignment: Optional[dict]) -> list:
+        """Build the invoice row of processed invoice data and record it in the log data."""
+        print(f"Building invoice row for date: {target_date}")
         log_data['InvoiceNbr'] = invoice_data['invoice_number']
         log_data['LLMConfidence'] = account_assignment['confidence'] if account_assignment else ''
+        log_data['AssignmentCache'] = {'cache': 'Hit', 'llm': 'Miss'}.get(account_assignment.get('source'), '') if account_assignment else ''
 
-        csv_filename, existing_rows = self._get_or_create_csv(
-            target_date,
-            "invoices",
-            self.INVOICE_HEADERS
-        )
-        
         new_row = [
             email_datetime.strftime('%Y-%m-%d'),
             email_datetime.strftime('%H:%M:%S'),
@@ -303,81 +468,242 @@ Response format:
         ]
         
         print(f"Adding new invoice row: {new_row}")
-        self._write_csv(csv_filename, existing_rows + [new_row])
+        return new_row
+
+    def _read_json(self, key: str) -> dict:
+        """Read a JSON object from the artefact bucket."""
+        with metrics.span('S3Get') as span:
+            data = self.s3_client.get_object(Bucket=self.artefact_bucket, Key=key)['Body'].read()
+            span.add('Bytes', len(data), 'Bytes')
+        return json.loads(data.decode('utf-8'))
+
+    def _iter_expense_documents(self, job: dict) -> Iterator[dict]:
+        """Yield the summarized expense documents of a job.
+
+        Reads the compact summary written by the Textract completion step when
+        available, otherwise summarizes the raw results one page at a time.
+        """
+        if job.get('summaryKey'):
+            yield from self._read_json(job['summaryKey'])['documents']
+            return
+        
+        results = self._read_json(job['resultsKey'])
+        if 'pages' not in results:
+            # Single-object results written before pagination
+            yield from map(summarize_expense_document, results.get('ExpenseDocuments', []))
+            return
+        
+        for page_key in results['pages']:
+            page = self._read_json(page_key)
+            yield from map(summarize_expense_document, page.get('ExpenseDocuments', []))
 
     def _process_textract_results(self, job: dict, log_data: dict) -> dict:
         """Process Textract results and extract invoice information."""
         print(f"Processing Textract results for job: {job.get('jobId')}")
-        results_obj = self.s3_client.get_object(
-            Bucket=self.artefact_bucket,
-            Key=job['resultsKey']
-        )
-        results = json.loads(results_obj['Body'].read().decode('utf-8'))
-        
         invoice_data = {
             'invoice_number': '',
             'vendor_name': '',
             'amount': 0.0
         }
         
-        for expense_doc in results.get('ExpenseDocuments', []):
+        for expense_doc in self._iter_expense_documents(job):
             print("Processing expense document...")
-            if self._is_invalid_document(expense_doc, log_data):
+            classification = classifier.classify(expense_doc['blockTexts'])
+            if self._is_invalid_document(classification, log_data):
                 return invoice_data
             
             invoice_data = self._extract_invoice_fields(expense_doc, invoice_data)
             
-            if invoice_data['vendor_name'].lower() == 'workquest':
-                print("Workquest vendor detected - using special processing")
-                invoice_data = self._process_workquest_invoice(expense_doc, invoice_data)
+            if classifier.has_vendor_pattern(invoice_data['vendor_name']):
+                print(f"{invoice_data['vendor_name']} vendor detected - using special processing")
+                invoice_data = self._apply_vendor_invoice_pattern(classification, invoice_data)
                 return invoice_data
             
         return invoice_data
         
-    def process_textract_job(self, job: dict) -> None:
-        """Process a single Textract job."""
-        message_id = job['pdfKey'].split('/')[1]
+    def _index_content(self, job: dict, message_id: str) -> None:
+        """Make the job's results reusable for later copies of the same attachment."""
+        if not job.get('contentHash') or job.get('duplicateOf') or not job.get('summaryKey'):
+            return
+        try:
+            content_index.record(self.s3_client, self.artefact_bucket, job['contentHash'], message_id, job)
+        except Exception as e:
+            print(f"Error indexing content [{job['contentHash']}] for message_id: {message_id}: {str(e)}")
+
+    def _check_duplicate(self, record: dict, job: dict) -> None:
+        """Flag an invoice already saved for an earlier email, so it is neither assigned nor saved again."""
+        invoice_data = record['invoice_data']
+        key = invoice_key(invoice_data['vendor_name'], invoice_data['invoice_number'], invoice_data['amount'])
+        if key is None:
+            return
+        source = job.get('pdfKey') or job.get('summaryKey') or job.get('jobId') or ''
+        try:
+            with metrics.span('DuplicateCheck') as span:
+                entry = duplicate_index.claim(self.s3_client, self.duplicate_bucket, key, record['message_id'], source, invoice_data)
+                span.add('Duplicates', 1 if entry else 0)
+        except Exception as e:
+            print(f"Error checking duplicate index for message_id: {record['message_id']}: {str(e)}")
+            return
+        if entry is None:
+            record['duplicate_key'] = (key, source)
+            return
+        print(f"Duplicate invoice {invoice_data['invoice_number']} from {invoice_data['vendor_name']}, already saved for message_id: {entry['messageId']}")
+        log_data = record['log_data']
+        log_data['Status'] = 'Duplicate'
+        log_data['InvoiceNbr'] = invoice_data['invoice_number']
+        log_data['DuplicateOf'] = entry['messageId']
+        record['invoice_data'] = None
+
+    def _confirm_duplicate_key(self, record: dict) -> None:
+        """Mark the duplicate index entry of a saved invoice as no longer pending."""
+        if not record.get('duplicate_key'):
+            return
+        key, source = record.pop('duplicate_key')
+        try:
+            duplicate_index.confirm(self.s3_client, self.duplicate_bucket, key, record['message_id'], source)
+        except Exception as e:
+            print(f"Error confirming duplicate index entry for message_id: {record['message_id']}: {str(e)}")
+
+    def _release_duplicate_key(self, record: dict) -> None:
+        """Remove the duplicate index entry of an invoice that was not saved after all."""
+        if not record.get('duplicate_key'):
+            return
+        key, source = record.pop('duplicate_key')
+        try:
+            duplicate_index.release(self.s3_client, self.duplicate_bucket, key, record['message_id'], source)
+        except Exception as e:
+            print(f"Error releasing duplicate index entry for message_id: {record['message_id']}: {str(e)}")
+
+    def _prepare_textract_job(self, job: dict) -> dict:
+        """Extract the invoice of a single Textract job, without assigning or saving it."""
+        message_id = job.get('messageId') or job['pdfKey'].split('/')[1]
+        metrics.set_correlation_id(message_id)
         print(f"\nProcessing Textract job for message_id: {message_id}")
-        email_datetime, email_sender, email_body = self._extract_email_details(message_id)
-        target_date = self._get_next_business_day(email_datetime)
-        
-        log_data = self._initialize_log_data(message_id, email_datetime)
+        try:
+            email_datetime, email_sender, email_body = self._extract_email_details(message_id)
+        except Exception as e:
+            print(f"Error reading email details for message_id: {message_id}: {str(e)}")
+            email_datetime = datetime.datetime.now(pytz.timezone(self.timezone))
+            record = {
+                'message_id': message_id,
+                'email_datetime': email_datetime,
+                'email_sender': '',
+                'email_body': '',
+                'target_date': self._get_next_business_day(email_datetime),
+                'log_data': self._initialize_log_data(message_id, email_datetime),
+                'invoice_data': None
+            }
+            record['log_data']['Status'] = 'Error'
+            record['log_data']['ErrorReason'] = str(e)
+            return record
+        record = {
+            'message_id': message_id,
+            'email_datetime': email_datetime,
+            'email_sender': email_sender,
+            'email_body': email_body,
+            'target_date': self._get_next_business_day(email_datetime),
+            'log_data': self._initialize_log_data(message_id, email_datetime),
+            'invoice_data': None
+        }
+        log_data = record['log_data']
+        log_data['DuplicateOf'] = job.get('duplicateOf') or ''
         
         if not self._is_valid_job(job, log_data):
             print(f"Invalid job detected for message_id: {message_id}")
-            self._update_logs(target_date, log_data)
-            return
+            return record
 
         try:
             invoice_data = self._process_textract_results(job, log_data)
+            self._index_content(job, message_id)
             if log_data['Status'] != 'Ignore':
                 print(f"Processing valid invoice for message_id: {message_id}")
-                self._save_invoice_data(invoice_data, email_datetime, email_sender, email_body, target_date, log_data)
+                record['invoice_data'] = invoice_data
+                self._check_duplicate(record, job)
         except Exception as e:
             log_data['Status'] = 'Error'
             log_data['ErrorReason'] = str(e)
             print(f"Error processing invoice for message_id: {message_id}: {str(e)}")
+        return record
+
+    def _complete_textract_job(self, record: dict, account_assignment: Optional[dict]) -> Tuple[Optional[list], list]:
+        """Build the invoice row of a prepared job and its log row."""
+        message_id = record['message_id']
+        log_data = record['log_data']
+        invoice_row = None
+        if record['invoice_data'] is not None:
+            try:
+                invoice_row = self._invoice_row(record['invoice_data'], record['email_datetime'], record['target_date'], log_data, account_assignment)
+            except Exception as e:
+                log_data['Status'] = 'Error'
+                log_data['ErrorReason'] = str(e)
+                print(f"Error processing invoice for message_id: {message_id}: {str(e)}")
         
-        self._update_logs(target_date, log_data)
+        log_row = self._log_row(record['target_date'], log_data)
         print(f"Completed processing for message_id: {message_id}, Status: {log_data['Status']}\n")
+        return invoice_row, log_row
+
+    def process_textract_jobs(self, jobs: List[dict]) -> None:
+        """Process several Textract jobs, assigning all their invoices together.
+
+        Jobs are read and checked against the duplicate index concurrently on up
+        to max_workers threads, so duplicates never reach the model; the rows of
+        the whole invocation are then written as one shard per target date.
+        """
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, max(len(jobs), 1))) as executor:
+            records = list(executor.map(self._prepare_textract_job, jobs))
+        pending = [record for record in records if record['invoice_data'] is not None]
+        try:
+            assignments = self.determine_account_assignments([
+                {
+                    'vendor_name': record['invoice_data']['vendor_name'],
+                    'invoice_number': record['invoice_data']['invoice_number'],
+                    'sender_email': record['email_sender'],
+                    'email_body': record['email_body']
+                }
+                for record in pending
+            ])
+        except Exception as e:
+            print(f"Error determining account assignments: {str(e)}")
+            for record in pending:
+                record['invoice_data'] = None
+                record['log_data']['Status'] = 'Error'
+                record['log_data']['ErrorReason'] = str(e)
+            assignments = []
+        assignment_by_record = {id(record): assignment for record, assignment in zip(pending, assignments)}
+        
+        invoice_rows, log_rows, dates = {}, {}, {}
+        for record in records:
+            invoice_row, log_row = self._complete_textract_job(record, assignment_by_record.get(id(record)))
+            date_key = record['target_date'].strftime('%Y-%m-%d')
+            dates[date_key] = record['target_date']
+            if invoice_row is not None:
+                invoice_rows.setdefault(date_key, []).append(invoice_row)
+            else:
+                self._release_duplicate_key(record)
+            log_rows.setdefault(date_key, []).append(log_row)
+        self._commit_rows(invoice_rows, log_rows, dates, records)
+        self.save_assignment_cache()
+
+    def process_textract_job(self, job: dict) -> None:
+        """Process a single Textract job."""
+        self.process_textract_jobs([job])
 
 def handler(event, context):
     """AWS Lambda handler function."""
-    print(f"Received event: {json.dumps(event)}")
+    metrics.log_event(event)
     
     processor = InvoiceProcessor(
         email_bucket=os.environ['INPUT_BUCKET_NAME'],
         artefact_bucket=os.environ['ARTEFACT_BUCKET_NAME'],
         result_bucket=os.environ['RESULT_BUCKET_NAME'],
-        timezone=os.environ['TIMEZONE']
+        timezone=os.environ['TIMEZONE'],
+        ledger_bucket=os.environ.get('LEDGER_BUCKET_NAME')
     )
     
     total_jobs = len(event['textractJobs'])
     print(f"Processing {total_jobs} Textract jobs")
     
-    for i, job in enumerate(event['textractJobs'], 1):
-        print(f"\nProcessing job {i} of {total_jobs}")
-        processor.process_textract_job(job)
+    processor.process_textract_jobs(event['textractJobs'])
     
     print("Lambda handler execution completed successfully")
 
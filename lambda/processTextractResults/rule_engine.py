@@ -0,0 +1,145 @@
+import re
+from email.utils import parseaddr
+from typing import Dict, List, Optional, Pattern, Set, Tuple
+from invoice_keys import normalize_vendor
+
+# Lines mentioning any of these words carry extra conditions or exceptions and are
+# left to the model; they also veto deterministic matches for what they mention.
+CONDITIONAL_WORDS = re.compile(
+    r'\b(?:except|exception|exceptions|unless|but|only|if|when|over|under|above|below|greater|less|more|amount|contains?|body|subject|otherwise|default|all other|any other|else)\b',
+    re.IGNORECASE
+)
+# Conditions that depend on the invoice amount, the email's body or subject, or that
+# catch everything else: they can override any plain rule, whatever it names, so
+# while one exists every invoice is left to the model
+GLOBAL_CONDITION_WORDS = re.compile(
+    r'\$|\b(?:over|under|above|below|greater|less|more|amount|total|contains?|mentions?|body|subject|otherwise|default|all other|any other|all invoices|any invoices?|else)\b',
+    re.IGNORECASE
+)
+
+_ASSIGN = r'\s+(?:->|=>|(?:should\s+)?(?:go|goes|be\s+assigned|is\s+assigned|are\s+assigned|assigned|belongs?|routed?)\s+to|to)\s+(?:accountant\s+)?(?P<accountant>[^,;]+?)\.?\s*$'
+_QUOTED = r'["\']?(?P<{name}>[^"\']+?)["\']?'
+
+VENDOR_RULE = re.compile(r'^(?:invoices?\s+from\s+)?vendor(?:\s+name)?\s*[:=]?\s*' + _QUOTED.format(name='vendor') + r'(?:\s+invoices?)?' + _ASSIGN, re.IGNORECASE)
+SENDER_RULE = re.compile(r'^(?:(?:invoices?|emails?)\s+from\s+)?(?:sender(?:\s+(?:email|domain|address))?\s*[:=]?\s*|(?:email\s+)?domain\s*[:=]?\s*)?' + r'["\']?(?P<sender>[\w.+-]*@[\w-]+(?:\.[\w-]+)+|[\w-]+(?:\.[\w-]+)*\.[a-z]{2,})["\']?' + _ASSIGN, re.IGNORECASE)
+INVOICE_RULE = re.compile(r'^invoice(?:\s+numbers?|\s+#|\s+nbr)?\s+(?P<kind>starting\s+with|beginning\s+with|that\s+starts?\s+with|prefixed\s+(?:with|by)|matching|like)\s+' + _QUOTED.format(name='pattern') + _ASSIGN, re.IGNORECASE)
+GENERIC_RULE = re.compile(r'^(?:invoices?\s+from\s+)?' + _QUOTED.format(name='vendor') + r'(?:\s+invoices?)?' + r'\s+(?:should\s+)?(?:go|goes|is\s+assigned|are\s+assigned)\s+to\s+(?:accountant\s+)?(?P<accountant>[^,;]+?)\.?\s*$', re.IGNORECASE)
+LIST_MARKER = re.compile(r'^\s*(?:[-*•]+|\d+[.)])\s*')
+
+
+def sender_address(sender: str) -> str:
+    return parseaddr(sender or '')[1].lower()
+
+
+def sender_domain(sender: str) -> str:
+    address = sender_address(sender)
+    return address.rsplit('@', 1)[1] if '@' in address else ''
+
+
+def _pattern_to_regex(kind: str, pattern: str) -> Pattern:
+    """Turn a plain-English invoice number pattern into a compiled regex.
+
+    '#' stands for a digit and '*' for any run of characters.
+    """
+    body = ''.join(r'\d' if c == '#' else '.*' if c == '*' else re.escape(c) for c in pattern.strip())
+    if kind.lower().startswith(('matching', 'like')):
+        return re.compile(f'^{body}$', re.IGNORECASE)
+    return re.compile(f'^{body}', re.IGNORECASE)
+
+
+class CompiledRules:
+    """Indexed matcher for the plain "X goes to Y" lines of the account assignment rules."""
+
+    def __init__(self):
+        self.vendors: Dict[str, Set[Tuple[str, str]]] = {}
+        self.senders: Dict[str, Set[Tuple[str, str]]] = {}
+        self.domains: Dict[str, Set[Tuple[str, str]]] = {}
+        self.invoice_patterns: List[Tuple[Pattern, str, str]] = []
+        self.conditional_rules: List[str] = []
+        # Conditional rules that can apply to any invoice, see GLOBAL_CONDITION_WORDS
+        self.global_rules: List[str] = []
+
+    def _add(self, index: Dict[str, Set[Tuple[str, str]]], key: str, accountant: str, rule: str) -> None:
+        index.setdefault(key, set()).add((accountant.strip().strip('"\''), rule))
+
+    def _mentioned_in_conditional_rule(self, *terms: str) -> bool:
+        terms = [term for term in terms if term]
+        for rule in self.conditional_rules:
+            normalized_rule = normalize_vendor(rule)
+            if any(term in normalized_rule or term in rule for term in terms):
+                return True
+        return False
+
+    def match(self, vendor_name: str, invoice_number: str, sender_email: str) -> Optional[dict]:
+        """Return an assignment when the compiled rules agree on exactly one accountant.
+
+        Nothing is matched while a global conditional rule exists, since the model
+        must weigh it against the plain rules.
+        """
+        if self.global_rules:
+            print(f"{len(self.global_rules)} conditional rule(s) may apply to any invoice - deferring to the model")
+            return None
+        vendor = normalize_vendor(vendor_name)
+        address = sender_address(sender_email)
+        domain = sender_domain(sender_email)
+
+        candidates = set()
+        candidates |= self.vendors.get(vendor, set())
+        candidates |= self.senders.get(address, set())
+        candidates |= self.domains.get(domain, set())
+        for regex, accountant, rule in self.invoice_patterns:
+            if invoice_number and regex.search(invoice_number):
+                candidates.add((accountant, rule))
+
+        accountants = {accountant.lower() for accountant, _ in candidates}
+        if len(accountants) != 1:
+            if len(accountants) > 1:
+                print(f"Conflicting rule matches for vendor [{vendor_name}]: {sorted(accountants)}")
+            return None
+        if self._mentioned_in_conditional_rule(vendor, address, domain):
+            print(f"Conditional rule mentions vendor [{vendor_name}] or sender [{address}] - deferring to the model")
+            return None
+
+        accountant, rule = sorted(candidates)[0]
+        return {
+            'accountant': accountant,
+            'rule_matched': rule,
+            'confidence': 'high'
+        }
+
+
+def compile_rules(rules_text: str) -> CompiledRules:
+    """Compile the plain-English rules into hash indexes and invoice-number regexes."""
+    compiled = CompiledRules()
+    for raw_line in (rules_text or '').splitlines():
+        line = LIST_MARKER.sub('', raw_line).strip()
+        if not line:
+            continue
+        if CONDITIONAL_WORDS.search(line):
+            compiled.conditional_rules.append(line.lower())
+            if GLOBAL_CONDITION_WORDS.search(line):
+                compiled.global_rules.append(line.lower())
+            continue
+
+        match = INVOICE_RULE.match(line)
+        if match:
+            compiled.invoice_patterns.append((_pattern_to_regex(match['kind'], match['pattern']), match['accountant'].strip().strip('"\''), line))
+            continue
+        match = SENDER_RULE.match(line)
+        if match:
+            sender = match['sender'].lower()
+            if sender.startswith('@') or '@' not in sender:
+                compiled._add(compiled.domains, sender.lstrip('@'), match['accountant'], line)
+            else:
+                compiled._add(compiled.senders, sender, match['accountant'], line)
+            continue
+        match = VENDOR_RULE.match(line) or GENERIC_RULE.match(line)
+        if match:
+            compiled._add(compiled.vendors, normalize_vendor(match['vendor']), match['accountant'], line)
+            continue
+        compiled.conditional_rules.append(line.lower())
+
+    print(f"Compiled rules: {len(compiled.vendors)} vendors, {len(compiled.senders)} senders, "
+          f"{len(compiled.domains)} domains, {len(compiled.invoice_patterns)} invoice patterns, "
+          f"{len(compiled.conditional_rules)} rules left to the model ({len(compiled.global_rules)} global)")
+    return compiled
@@ -0,0 +1,74 @@
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Optional
+
+from botocore.exceptions import ClientError
+
+RULES_KEY = 'account_assignment_rules.txt'
+VERSION_KEY = 'account_assignment_rules.version.json'
+DEFAULT_TTL_SECONDS = int(os.environ.get('RULES_CACHE_TTL_SECONDS', '300'))
+
+# Lives for the life of the Lambda container, shared by all invocations it serves
+_cache = {
+    'text': None,
+    'etag': None,
+    'checked_at': 0.0,
+    'derived': {}
+}
+_lock = threading.Lock()
+
+
+def _read_version_marker(s3_client, bucket: str) -> Optional[str]:
+    """Return the rules ETag published by updateAccountAssignment, if any."""
+    try:
+        marker = s3_client.get_object(Bucket=bucket, Key=VERSION_KEY)
+        return json.loads(marker['Body'].read()).get('etag')
+    except s3_client.exceptions.NoSuchKey:
+        return None
+
+
+def _conditional_get(s3_client, bucket: str) -> None:
+    """Download the rules unless the cached ETag is still current."""
+    kwargs = {'Bucket': bucket, 'Key': RULES_KEY}
+    if _cache['etag']:
+        kwargs['IfNoneMatch'] = _cache['etag']
+    try:
+        response = s3_client.get_object(**kwargs)
+    except ClientError as e:
+        if e.response.get('ResponseMetadata', {}).get('HTTPStatusCode') == 304 or e.response['Error']['Code'] in ('304', 'NotModified'):
+            print("Account assignment rules not modified since last download")
+            return
+        raise
+    _cache['text'] = response['Body'].read().decode('utf-8')
+    _cache['etag'] = response.get('ETag')
+    _cache['derived'] = {}
+    print(f"Downloaded account assignment rules version {_cache['etag']}")
+
+
+def get_rules(s3_client, bucket: str, ttl: Optional[int] = None, force: bool = False) -> str:
+    """Return the rules text, revalidating against S3 at most once per TTL."""
+    ttl = DEFAULT_TTL_SECONDS if ttl is None else ttl
+    with _lock:
+        if _cache['text'] is not None and not force and time.monotonic() - _cache['checked_at'] < ttl:
+            return _cache['text']
+
+        published_etag = _read_version_marker(s3_client, bucket) if _cache['text'] is not None else None
+        if published_etag is None or published_etag != _cache['etag']:
+            _conditional_get(s3_client, bucket)
+        _cache['checked_at'] = time.monotonic()
+        return _cache['text']
+
+
+def rules_version() -> Optional[str]:
+    """ETag of the cached rules, used to key anything derived from them."""
+    return _cache['etag']
+
+
+def get_derived(name: str, factory: Callable[[str], Any]) -> Any:
+    """Return a structure derived from the cached rules, building it once per version."""
+    with _lock:
+        if name not in _cache['derived']:
+            _cache['derived'][name] = factory(_cache['text'])
+        return _cache['derived'][name]
@@ -1,12 +1,12 @@
-import boto3
 import os
 import base64
-import json
+from aws_clients import get_client
+import metrics
 
-s3 = boto3.client('s3')
+s3 = get_client('s3')
 
 def handler(event, context):
-    print(f"Received event: {json.dumps(event)}")
+    metrics.log_event(event)
     bucket_name = os.environ['BUCKET_NAME']
     
     if not isinstance(event, list):
@@ -1,10 +1,11 @@
-import boto3
 import datetime
 import os
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.application import MIMEApplication
 from botocore.exceptions import ClientError
+from aws_clients import get_client
+from result_store import compact_daily
 
 def check_file_exists(s3_client, bucket, key):
     """Check if a file exists in S3 bucket"""
@@ -61,9 +62,9 @@ def create_email_message(sender, recipients, date, invoice_data=None, log_data=N
     return msg
 
 def handler(event, context):
-    # Initialize AWS clients
-    s3 = boto3.client('s3')
-    ses = boto3.client('ses')
+    # Cached per container, so warm invocations reuse the clients and their connections
+    s3 = get_client('s3')
+    ses = get_client('ses')
     
     # Get current date in CST
     cst_tz = datetime.timezone(datetime.timedelta(hours=-6))
@@ -87,9 +88,9 @@ def handler(event, context):
     log_csv_key = f"{current_date}_logs.csv"
     
     try:
-        # Check and get files if they exist
-        invoice_data = get_s3_file(s3, bucket_name, invoice_csv_key)
-        log_data = get_s3_file(s3, bucket_name, log_csv_key)
+        # Merge the day's append-only shards into the daily CSVs, falling back to existing files
+        invoice_data = compact_daily(s3, bucket_name, current_date, 'invoices') or get_s3_file(s3, bucket_name, invoice_csv_key)
+        log_data = compact_daily(s3, bucket_name, current_date, 'logs') or get_s3_file(s3, bucket_name, log_csv_key)
         
         # If both files are missing, still send an email but with a "no files" message
         if not invoice_data and not log_data:
@@ -1,45 +1,128 @@
-import json
-import boto3
 import os
+import time
+import uuid
+from aws_clients import get_client
+from textractBatch import save_batch, try_complete_batch
+from textractScheduler import start_jobs
+import metrics
 
-s3_client = boto3.client('s3')
-textract_client = boto3.client('textract')
+s3_client = get_client('s3')
+# textractScheduler retries throttled starts itself, within the Lambda's deadline
+textract_client = get_client('textract', retries={'mode': 'standard', 'total_max_attempts': 1})
+stepfunctions_client = get_client('stepfunctions')
+
+# Time kept in reserve to save the batch after the last retry
+DEADLINE_MARGIN_SECONDS = 10
+
+def _message_id(item):
+    if 'messageId' in item:
+        return item['messageId']
+    # PDFs are saved under invoices/<messageId>/
+    return item['pdfKey'].split('/')[1] if 'pdfKey' in item else None
 
 def handler(event, context):
-    print(f"Received event: {json.dumps(event)}")
+    metrics.log_event(event)
     artefact_bucket_name = os.environ['ARTEFACT_BUCKET_NAME']
     
+    # With a task token, jobs report completion through SNS instead of being polled
+    task_token = event.get('taskToken') if isinstance(event, dict) else None
+    items = event['items'] if task_token else event
+    batch_id = uuid.uuid4().hex
+    # All items of an execution come from the same email
+    metrics.set_correlation_id(next(filter(None, map(_message_id, items)), None))
+    
     try:
         # Start a Textract job for each PDF in the processed attachments
         textract_jobs = []
+        pdf_items = []
+        requests = []
         
-        for item in event:
-            if item['statusCode'] == 200 and 'pdfKey' in item:
-                print(f"Starting Textract job for PDF: {item['pdfKey']}")
-                
-                response = textract_client.start_expense_analysis(
-                    DocumentLocation={
+        for item in items:
+            if item['statusCode'] == 200 and 'summaryKey' in item:
+                # Extracted directly from a spreadsheet or Word document, or content
+                # already processed for an earlier email: nothing to OCR
+                print(f"Using existing summary: {item['summaryKey']}")
+                textract_jobs.append({
+                    'jobId': None,
+                    'messageId': item['messageId'],
+                    'jobStatus': 'SUCCEEDED',
+                    'resultsKey': item.get('resultsKey', item['summaryKey']),
+                    'summaryKey': item['summaryKey'],
+                    'contentHash': item.get('contentHash'),
+                    'duplicateOf': item.get('duplicateOf')
+                })
+            elif item['statusCode'] == 200 and 'pdfKey' in item:
+                request = {
+                    'DocumentLocation': {
                         'S3Object': {
                             'Bucket': artefact_bucket_name,
                             'Name': item['pdfKey']
                         }
                     }
-                )
-                
+                }
+                if task_token:
+                    request['JobTag'] = batch_id
+                    request['NotificationChannel'] = {
+                        'SNSTopicArn': os.environ['TEXTRACT_SNS_TOPIC_ARN'],
+                        'RoleArn': os.environ['TEXTRACT_ROLE_ARN']
+                    }
+                pdf_items.append(item)
+                requests.append(request)
+        
+        print(f"Starting {len(requests)} Textract job(s)")
+        deadline = None
+        if context is not None:
+            deadline = time.monotonic() + context.get_remaining_time_in_millis() / 1000 - DEADLINE_MARGIN_SECONDS
+        with metrics.span('TextractStart') as span:
+            results = start_jobs(
+                textract_client,
+                requests,
+                max_in_flight=int(os.environ.get('TEXTRACT_MAX_IN_FLIGHT', '5')),
+                max_attempts=int(os.environ.get('TEXTRACT_START_MAX_ATTEMPTS', '6')),
+                deadline=deadline
+            )
+            span.add('Jobs', len(results))
+            span.add('StartFailures', sum(1 for result in results if 'error' in result))
+        
+        # Jobs that could not be started are reported as failed; the others still run
+        for item, result in zip(pdf_items, results):
+            if 'jobId' in result:
+                print(f"Started Textract job [{result['jobId']}] for PDF: {item['pdfKey']}")
+                textract_jobs.append({
+                    'jobId': result['jobId'],
+                    'pdfKey': item['pdfKey'],
+                    'jobStatus': 'IN_PROGRESS',
+                    'contentHash': item.get('contentHash')
+                })
+            else:
+                print(f"Failed to start Textract job for PDF: {item['pdfKey']}: {result['error']}")
                 textract_jobs.append({
-                    'jobId': response['JobId'],
+                    'jobId': None,
                     'pdfKey': item['pdfKey'],
-                    'jobStatus': 'IN_PROGRESS'
+                    'jobStatus': 'FAILED',
+                    'error': result['error']
                 })
         
+        if task_token:
+            save_batch(s3_client, artefact_bucket_name, batch_id, task_token, textract_jobs)
+            # Jobs that finished before the batch was saved could not resume the execution
+            try_complete_batch(s3_client, stepfunctions_client, artefact_bucket_name, batch_id)
+        
         return {
             'statusCode': 200,
+            'batchId': batch_id,
             'textractJobs': textract_jobs
         }
     
     except Exception as e:
         print(f"Error starting Textract jobs: {str(e)}")
+        if task_token:
+            stepfunctions_client.send_task_failure(
+                taskToken=task_token,
+                error='TextractJobError',
+                cause=str(e)[:256]
+            )
         return {
             'statusCode': 500,
             'error': str(e)
-        }
\ No newline at end of file
+        }
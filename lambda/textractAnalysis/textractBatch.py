@@ -0,0 +1,70 @@
+import json
+
+BATCH_PREFIX = 'textract-batches'
+
+def batch_key(batch_id):
+    return f"{BATCH_PREFIX}/{batch_id}/batch.json"
+
+def job_marker_key(batch_id, job_id):
+    return f"{BATCH_PREFIX}/{batch_id}/jobs/{job_id}.json"
+
+def save_batch(s3_client, bucket, batch_id, task_token, jobs):
+    """Store the task token and submitted jobs of a Step Functions execution."""
+    s3_client.put_object(
+        Bucket=bucket,
+        Key=batch_key(batch_id),
+        Body=json.dumps({'taskToken': task_token, 'textractJobs': jobs}),
+        ContentType='application/json'
+    )
+
+def record_job(s3_client, bucket, batch_id, job_id, job_result):
+    """Record the final status of one job; each job writes its own marker, so there are no races."""
+    s3_client.put_object(
+        Bucket=bucket,
+        Key=job_marker_key(batch_id, job_id),
+        Body=json.dumps(job_result),
+        ContentType='application/json'
+    )
+
+def try_complete_batch(s3_client, stepfunctions_client, bucket, batch_id):
+    """Resume the waiting execution once every job of the batch has reported back.
+
+    Called by both the job starter and the completion handler, so whichever runs
+    last sends the callback. Returns True when the callback was sent.
+    """
+    try:
+        batch = json.loads(s3_client.get_object(Bucket=bucket, Key=batch_key(batch_id))['Body'].read())
+    except s3_client.exceptions.NoSuchKey:
+        print(f"Batch [{batch_id}] not registered yet, the starter will complete it")
+        return False
+    
+    jobs = batch['textractJobs']
+    pending = [job for job in jobs if job['jobStatus'] == 'IN_PROGRESS']
+    if pending:
+        reported = set()
+        # A batch can have more than the 1000 markers a single listing returns
+        paginator = s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket, Prefix=f"{BATCH_PREFIX}/{batch_id}/jobs/"):
+            reported.update(obj['Key'] for obj in page.get('Contents', []))
+        waiting = [job for job in pending if job_marker_key(batch_id, job['jobId']) not in reported]
+        if waiting:
+            print(f"Batch [{batch_id}]: {len(waiting)} job(s) still in progress")
+            return False
+        for job in pending:
+            marker = s3_client.get_object(Bucket=bucket, Key=job_marker_key(batch_id, job['jobId']))
+            job.update(json.loads(marker['Body'].read()))
+    
+    print(f"All {len(jobs)} Textract job(s) of batch [{batch_id}] completed, resuming execution")
+    try:
+        stepfunctions_client.send_task_success(
+            taskToken=batch['taskToken'],
+            output=json.dumps({
+                'statusCode': 200,
+                'jobStatus': 'SUCCEEDED',
+                'textractJobs': jobs
+            })
+        )
+    except (stepfunctions_client.exceptions.TaskTimedOut, stepfunctions_client.exceptions.InvalidToken) as e:
+        print(f"Execution for batch [{batch_id}] was already resumed or timed out: {str(e)}")
+        return False
+    return True
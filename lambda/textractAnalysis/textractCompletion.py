@@ -0,0 +1,115 @@
+import json
+import os
+from aws_clients import get_client
+from textract_summary import add_results_page, new_summary
+from textractBatch import record_job, try_complete_batch
+import metrics
+
+textract_client = get_client('textract')
+s3_client = get_client('s3')
+stepfunctions_client = get_client('stepfunctions')
+
+def results_index_key(job_id):
+    return f"textract-results/{job_id}/index.json"
+
+def results_summary_key(job_id):
+    return f"textract-results/{job_id}/summary.json"
+
+def _save_results_pages(job_id, first_response, artefact_bucket_name):
+    """Stream every page of a succeeded job to its own S3 object and write a small index.
+
+    Only one page is held in memory at a time. Alongside the raw pages a compact
+    summary (summary fields by type, deduplicated block texts, page count) is
+    built for processTextractResults.
+    """
+    summary = new_summary(job_id)
+    pages = []
+    document_count = 0
+    response = first_response
+    with metrics.span('TextractResults') as span:
+        while True:
+            page_key = f"textract-results/{job_id}/page-{len(pages) + 1:04d}.json"
+            body = json.dumps(response)
+            s3_client.put_object(
+                Bucket=artefact_bucket_name,
+                Key=page_key,
+                Body=body,
+                ContentType='application/json'
+            )
+            span.add('Bytes', len(body), 'Bytes')
+            pages.append(page_key)
+            add_results_page(summary, response)
+            document_count += len(response.get('ExpenseDocuments', []))
+            
+            next_token = response.get('NextToken')
+            if not next_token:
+                break
+            response = textract_client.get_expense_analysis(
+                JobId=job_id,
+                NextToken=next_token
+            )
+        span.add('Pages', len(pages))
+        span.add('Documents', document_count)
+    
+    index_key = results_index_key(job_id)
+    s3_client.put_object(
+        Bucket=artefact_bucket_name,
+        Key=index_key,
+        Body=json.dumps({
+            'jobId': job_id,
+            'pages': pages,
+            'documentCount': document_count,
+            'pageCount': first_response.get('DocumentMetadata', {}).get('Pages', 0)
+        }),
+        ContentType='application/json'
+    )
+    s3_client.put_object(
+        Bucket=artefact_bucket_name,
+        Key=results_summary_key(job_id),
+        Body=json.dumps(summary),
+        ContentType='application/json'
+    )
+    print(f"Stored {len(pages)} result page(s) with {document_count} expense document(s) for job [{job_id}]")
+    return index_key
+
+def save_expense_results(job_id, artefact_bucket_name):
+    """Fetch the results of a Textract expense analysis job and store them in S3 once it succeeded."""
+    with metrics.span('TextractGet'):
+        response = textract_client.get_expense_analysis(
+            JobId=job_id
+        )
+    
+    result = {'jobStatus': response['JobStatus']}
+    if response['JobStatus'] == 'SUCCEEDED':
+        result['resultsKey'] = _save_results_pages(job_id, response, artefact_bucket_name)
+        result['summaryKey'] = results_summary_key(job_id)
+    elif response['JobStatus'] == 'FAILED':
+        result['error'] = response.get('StatusMessage', 'Unknown error')
+    return result
+
+def handler(event, context):
+    artefact_bucket_name = os.environ['ARTEFACT_BUCKET_NAME']
+    
+    for record in event['Records']:
+        message = json.loads(record['Sns']['Message'])
+        job_id = message['JobId']
+        batch_id = message.get('JobTag')
+        print(f"Textract job [{job_id}] of batch [{batch_id}] finished with status [{message['Status']}]")
+        if not batch_id:
+            print(f"Ignoring notification without a batch tag for job [{job_id}]")
+            continue
+        
+        if message['Status'] == 'SUCCEEDED':
+            job_result = save_expense_results(job_id, artefact_bucket_name)
+        else:
+            job_result = {
+                'jobStatus': 'FAILED',
+                'error': message.get('StatusMessage', f"Textract job status: {message['Status']}")
+            }
+        
+        record_job(s3_client, artefact_bucket_name, batch_id, job_id, job_result)
+        try_complete_batch(s3_client, stepfunctions_client, artefact_bucket_name, batch_id)
+    
+    return {
+        'statusCode': 200
+    }
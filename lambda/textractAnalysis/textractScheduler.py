@@ -0,0 +1,52 @@
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+# Errors worth retrying: Textract TPS and concurrent job quotas, and transient faults
+RETRYABLE_ERRORS = {
+    'ProvisionedThroughputExceededException',
+    'ThrottlingException',
+    'Throttling',
+    'LimitExceededException',
+    'InternalServerError'
+}
+
+def _is_retryable(error):
+    return isinstance(error, ClientError) and error.response.get('Error', {}).get('Code') in RETRYABLE_ERRORS
+
+def _backoff_delay(attempt, base_delay, max_delay):
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+def _start_job(textract_client, request, max_attempts, base_delay, max_delay, deadline):
+    for attempt in range(max_attempts):
+        try:
+            response = textract_client.start_expense_analysis(**request)
+            return {'jobId': response['JobId']}
+        except Exception as e:
+            if not _is_retryable(e) or attempt == max_attempts - 1:
+                return {'error': str(e)}
+            delay = _backoff_delay(attempt, base_delay, max_delay)
+            if deadline is not None and time.monotonic() + delay > deadline:
+                return {'error': f"Gave up retrying before the Lambda timeout: {str(e)}"}
+            print(f"Throttled starting Textract job for [{request['DocumentLocation']['S3Object']['Name']}], "
+                  f"retrying in {delay:.1f}s (attempt {attempt + 1}/{max_attempts})")
+            time.sleep(delay)
+
+def start_jobs(textract_client, requests, max_in_flight=5, max_attempts=6, base_delay=0.5, max_delay=20.0, deadline=None):
+    """Start an expense analysis for each request, at most max_in_flight at a time.
+
+    Returns one result per request, in order: {'jobId': ...} for a started job or
+    {'error': ...} once its retries are exhausted, so one job's failure never
+    discards the jobs already started. deadline is a time.monotonic() value after
+    which no further retry is scheduled.
+    """
+    if not requests:
+        return []
+    with ThreadPoolExecutor(max_workers=min(max_in_flight, len(requests))) as executor:
+        return list(executor.map(
+            lambda request: _start_job(textract_client, request, max_attempts, base_delay, max_delay, deadline),
+            requests
+        ))
@@ -1,8 +1,10 @@
-import boto3
 import os
-from email import parser
+import json
+import datetime
+from aws_clients import get_client
+from mime_stream import iter_parts, parse_message, read_text
 
-s3_client = boto3.client('s3')
+s3_client = get_client('s3')
 
 def handler(event, context):
     message_id = event['messageId']
@@ -14,29 +16,45 @@ def handler(event, context):
         Bucket=email_bucket_name,
         Key=message_id
     )
-    email_content = response['Body'].read().decode('utf-8')
     
-    # Parse email to get body
-    email_message = parser.Parser().parsestr(email_content)
-    
-    # Extract body based on content type
-    if email_message.is_multipart():
-        for part in email_message.walk():
-            if part.get_content_type() == "text/plain":
-                email_body = part.get_payload(decode=True).decode()
-                break
-    else:
-        email_body = email_message.get_payload(decode=True).decode()
+    # Parse the email from the stream and take its plain text body, decoded with its own charset
+    msg = parse_message(response['Body'])
+    is_multipart = msg.get_content_maintype() == 'multipart'
+    email_body = None
+    for part in iter_parts(msg):
+        if part.get_content_type() == "text/plain" or not is_multipart:
+            email_body = read_text(part)
+            break
+    response['Body'].close()
+    if email_body is None:
+        raise ValueError(f"No plain text body found in account assignment email [{message_id}]")
     
     # Upload the file to S3
     s3_key = 'account_assignment_rules.txt'
-    s3_client.put_object(
+    put_response = s3_client.put_object(
         Bucket=artefact_bucket_name,
         Key=s3_key,
         Body=email_body.encode('utf-8'),
         ContentType='text/plain'
     )
     
+    # Publish a version marker so warm processTextractResults containers revalidate their cached rules
+    s3_client.put_object(
+        Bucket=artefact_bucket_name,
+        Key='account_assignment_rules.version.json',
+        Body=json.dumps({
+            'etag': put_response['ETag'],
+            'updatedAt': datetime.datetime.now(datetime.timezone.utc).isoformat()
+        }),
+        ContentType='application/json'
+    )
+    
+    # Cached assignments were made with the previous rules
+    s3_client.delete_object(
+        Bucket=artefact_bucket_name,
+        Key='assignment_cache.json'
+    )
+    
     return {
         'statusCode': 200,
         'body': f'Successfully updated account assignment rules.'
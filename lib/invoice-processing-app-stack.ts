@@ -6,6 +6,8 @@ import * as lambda from 'aws-cdk-lib/aws-lambda';
 import * as stepfunctions from 'aws-cdk-lib/aws-stepfunctions';
 import * as stepfunctions_tasks from 'aws-cdk-lib/aws-stepfunctions-tasks';
 import * as iam from 'aws-cdk-lib/aws-iam';
+import * as sns from 'aws-cdk-lib/aws-sns';
+import * as snsSubscriptions from 'aws-cdk-lib/aws-sns-subscriptions';
 import { Construct } from 'constructs';
 import * as events from 'aws-cdk-lib/aws-events';
 import * as targets from 'aws-cdk-lib/aws-events-targets';
@@ -61,6 +63,24 @@ export class InvoiceProcessingStack extends cdk.Stack {
           noncurrentVersionExpiration: cdk.Duration.days(60),  // Keep versions for 60 days
           expiration: cdk.Duration.days(90)  // Delete after 90 days
         },
+        {
+          // Rule for parsed email manifests and pre-split attachment parts
+          prefix: 'emails/',
+          noncurrentVersionExpiration: cdk.Duration.days(60),  // Keep versions for 60 days
+          expiration: cdk.Duration.days(90)  // Delete after 90 days
+        },
+        {
+          // Rule for Textract batch bookkeeping, only needed while an execution waits
+          prefix: 'textract-batches/',
+          noncurrentVersionExpiration: cdk.Duration.days(1),
+          expiration: cdk.Duration.days(7)
+        },
+        {
+          // Rule for the attachment content index; entries must not outlive the summaries they point to
+          prefix: 'content-index/',
+          noncurrentVersionExpiration: cdk.Duration.days(1),
+          expiration: cdk.Duration.days(60)
+        },
         {
           // Rule for invoices directory
           prefix: 'invoices/',
@@ -102,11 +122,44 @@ export class InvoiceProcessingStack extends cdk.Stack {
       ]
     });
 
+    // Long-term Parquet ledger compacted from the daily CSVs, which expire with the result bucket,
+    // and the index of saved invoices used to detect duplicates
+    const ledgerBucket = new s3.Bucket(this, 'twc-ledger-bucket', {
+      autoDeleteObjects: true,
+      removalPolicy: cdk.RemovalPolicy.DESTROY,
+      versioned: true,
+      encryption: s3.BucketEncryption.S3_MANAGED,
+      lifecycleRules: [
+        {
+          // Months are rewritten while they are compacted, older versions are not needed
+          noncurrentVersionExpiration: cdk.Duration.days(7)
+        },
+        {
+          // Past months are rarely read, and only by ranged reads
+          prefix: 'ledger/invoices/',
+          transitions: [
+            {
+              storageClass: s3.StorageClass.INFREQUENT_ACCESS,
+              transitionAfter: cdk.Duration.days(90)
+            }
+          ]
+        }
+      ]
+    });
+
+    // Shared Python modules, available to the handlers under /opt/python
+    const commonLayer = new lambda.LayerVersion(this, 'commonLayer', {
+      code: lambda.Code.fromAsset('lambda/layers/common'),
+      compatibleRuntimes: [lambda.Runtime.PYTHON_3_12],
+      description: 'Shared modules for the invoice processing Lambdas'
+    });
+
     // Create Lambda functions
     const processIncomingEmailLambda = new lambda.Function(this, 'processIncomingEmail', {
       runtime: lambda.Runtime.PYTHON_3_12,
       handler: 'index.handler',
       code: lambda.Code.fromAsset('lambda/processIncomingEmail'),
+      layers: [commonLayer],
       environment: {
         BUCKET_NAME: incomingEmailBucket.bucketName
       },
@@ -117,6 +170,7 @@ export class InvoiceProcessingStack extends cdk.Stack {
       runtime: lambda.Runtime.PYTHON_3_12,
       handler: 'index.handler',
       code: lambda.Code.fromAsset('lambda/updateAccountAssignment'),
+      layers: [commonLayer],
       environment: {
         EMAIL_BUCKET_NAME: incomingEmailBucket.bucketName,
         ARTEFACT_BUCKET_NAME: artefactBucket.bucketName
@@ -129,25 +183,29 @@ export class InvoiceProcessingStack extends cdk.Stack {
       runtime: lambda.Runtime.PYTHON_3_12,
       handler: 'index.handler',
       code: lambda.Code.fromAsset('lambda/detectInvoice'),
+      layers: [commonLayer],
       environment: {
         EMAIL_BUCKET_NAME: incomingEmailBucket.bucketName,
-      }
+        ARTEFACT_BUCKET_NAME: artefactBucket.bucketName
+      },
+      timeout: cdk.Duration.seconds(60),
+      memorySize: 256
     });
     incomingEmailBucket.grantReadWrite(detectInvoiceLambda);
+    artefactBucket.grantWrite(detectInvoiceLambda);
 
     const processPDFAttachmentLambda = new lambda.Function(this, 'processPDFAttachment', {
       runtime: lambda.Runtime.PYTHON_3_12,
       handler: 'index.handler',
       code: lambda.Code.fromAsset('lambda/processPDFAttachment'),
+      layers: [commonLayer],
       environment: {
-        EMAIL_BUCKET_NAME: incomingEmailBucket.bucketName,
         ARTEFACT_BUCKET_NAME: artefactBucket.bucketName
       },
       timeout: cdk.Duration.seconds(60),
       memorySize: 256
     });
-    incomingEmailBucket.grantRead(processPDFAttachmentLambda);
-    artefactBucket.grantWrite(processPDFAttachmentLambda);
+    artefactBucket.grantReadWrite(processPDFAttachmentLambda);
 
     const processExcelAttachmentLambda = new lambda.Function(this, 'processExcelAttachment', {
       runtime: lambda.Runtime.PYTHON_3_12,
@@ -163,15 +221,14 @@ export class InvoiceProcessingStack extends cdk.Stack {
           },
         }
       ),    
+      layers: [commonLayer],
       environment: {
-        EMAIL_BUCKET_NAME: incomingEmailBucket.bucketName,
         ARTEFACT_BUCKET_NAME: artefactBucket.bucketName
       },
       timeout: cdk.Duration.seconds(60),
       memorySize: 256
     });
-    incomingEmailBucket.grantRead(processExcelAttachmentLambda);
-    artefactBucket.grantWrite(processExcelAttachmentLambda);
+    artefactBucket.grantReadWrite(processExcelAttachmentLambda);
 
     const processDocAttachmentLambda = new lambda.Function(this, 'processDocAttachment', {
       runtime: lambda.Runtime.PYTHON_3_12,
@@ -187,15 +244,14 @@ export class InvoiceProcessingStack extends cdk.Stack {
           },
         }
       ),    
+      layers: [commonLayer],
       environment: {
-        EMAIL_BUCKET_NAME: incomingEmailBucket.bucketName,
         ARTEFACT_BUCKET_NAME: artefactBucket.bucketName
       },
       timeout: cdk.Duration.seconds(60),
       memorySize: 256
     });
-    incomingEmailBucket.grantRead(processDocAttachmentLambda);
-    artefactBucket.grantWrite(processDocAttachmentLambda);
+    artefactBucket.grantReadWrite(processDocAttachmentLambda);
 
     const processEmailBodyLambda = new lambda.Function(this, 'processEmailBody', {
       runtime: lambda.Runtime.PYTHON_3_12,
@@ -210,43 +266,97 @@ export class InvoiceProcessingStack extends cdk.Stack {
             ],
           },
         }),   
+        layers: [commonLayer],
         environment: {
-          EMAIL_BUCKET_NAME: incomingEmailBucket.bucketName,
           ARTEFACT_BUCKET_NAME: artefactBucket.bucketName
         }, 
         timeout: cdk.Duration.seconds(60),
         memorySize: 256
     });
-    incomingEmailBucket.grantRead(processEmailBodyLambda);
-    artefactBucket.grantWrite(processEmailBodyLambda);
+    artefactBucket.grantReadWrite(processEmailBodyLambda);
+
+    // Converts all attachments of an email in one invocation, reusing the handlers above
+    const processAttachmentsLambda = new lambda.Function(this, 'processAttachments', {
+      runtime: lambda.Runtime.PYTHON_3_12,
+      handler: 'index.handler',
+      code: lambda.Code.fromAsset('lambda',
+        {
+          bundling: {
+            image: lambda.Runtime.PYTHON_3_12.bundlingImage,
+            command: [
+              'bash', '-c',
+              'pip install -r processAttachments/requirements.txt -t /asset-output && ' +
+              'cp processAttachments/index.py /asset-output && ' +
+              'cp processPDFAttachment/index.py /asset-output/pdf_attachment.py && ' +
+              'cp processExcelAttachment/index.py /asset-output/excel_attachment.py && ' +
+              'cp processDocAttachment/index.py /asset-output/doc_attachment.py && ' +
+              'cp processEmailBody/index.py /asset-output/email_body.py'
+            ],
+          },
+        }
+      ),
+      layers: [commonLayer],
+      environment: {
+        ARTEFACT_BUCKET_NAME: artefactBucket.bucketName,
+        MAX_WORKERS: '4'  // Attachments converted concurrently
+      },
+      timeout: cdk.Duration.minutes(5),
+      memorySize: 1024
+    });
+    artefactBucket.grantReadWrite(processAttachmentsLambda);
+
+    // Textract publishes job completion to this topic instead of being polled
+    const textractCompletionTopic = new sns.Topic(this, 'textractCompletionTopic');
+    const textractNotificationRole = new iam.Role(this, 'textractNotificationRole', {
+      assumedBy: new iam.ServicePrincipal('textract.amazonaws.com')
+    });
+    textractCompletionTopic.grantPublish(textractNotificationRole);
 
     const startTextractJobLambda = new lambda.Function(this, 'startTextractJob', {
       runtime: lambda.Runtime.PYTHON_3_12,
       handler: 'startTextractJob.handler',
       code: lambda.Code.fromAsset('lambda/textractAnalysis'),
+      layers: [commonLayer],
       environment: {
         ARTEFACT_BUCKET_NAME: artefactBucket.bucketName,
+        TEXTRACT_SNS_TOPIC_ARN: textractCompletionTopic.topicArn,
+        TEXTRACT_ROLE_ARN: textractNotificationRole.roleArn,
+        TEXTRACT_MAX_IN_FLIGHT: '5',  // Concurrent StartExpenseAnalysis calls, keep within the account's TPS quota
+        TEXTRACT_START_MAX_ATTEMPTS: '6'  // Per job, with exponential backoff on throttling
       },
+      timeout: cdk.Duration.minutes(5)  // Room for backoff during month-end bursts
     });
     startTextractJobLambda.addToRolePolicy(new iam.PolicyStatement({
       actions: ['textract:StartExpenseAnalysis'],
       resources: ['*']
     }));
-    artefactBucket.grantRead(startTextractJobLambda);
+    startTextractJobLambda.addToRolePolicy(new iam.PolicyStatement({
+      actions: ['states:SendTaskSuccess', 'states:SendTaskFailure'],
+      resources: ['*']
+    }));
+    textractNotificationRole.grantPassRole(startTextractJobLambda.grantPrincipal);
+    artefactBucket.grantReadWrite(startTextractJobLambda);
 
-    const getTextractResultsLambda = new lambda.Function(this, 'getTextractResults', {
+    const textractCompletionLambda = new lambda.Function(this, 'textractCompletion', {
       runtime: lambda.Runtime.PYTHON_3_12,
-      handler: 'getTextractResults.handler',
+      handler: 'textractCompletion.handler',
       code: lambda.Code.fromAsset('lambda/textractAnalysis'),
+      layers: [commonLayer],
       environment: {
         ARTEFACT_BUCKET_NAME: artefactBucket.bucketName,
       },
+      timeout: cdk.Duration.seconds(60)
     });
-    artefactBucket.grantWrite(getTextractResultsLambda);
-    getTextractResultsLambda.addToRolePolicy(new iam.PolicyStatement({
+    artefactBucket.grantReadWrite(textractCompletionLambda);
+    textractCompletionLambda.addToRolePolicy(new iam.PolicyStatement({
       actions: ['textract:GetExpenseAnalysis'],
       resources: ['*']
     }));
+    textractCompletionLambda.addToRolePolicy(new iam.PolicyStatement({
+      actions: ['states:SendTaskSuccess'],
+      resources: ['*']
+    }));
+    textractCompletionTopic.addSubscription(new snsSubscriptions.LambdaSubscription(textractCompletionLambda));
     
     const processTextractResultsLambda = new lambda.Function(this, 'processTextractResults', {
       runtime: lambda.Runtime.PYTHON_3_12,
@@ -257,22 +367,32 @@ export class InvoiceProcessingStack extends cdk.Stack {
             image: lambda.Runtime.PYTHON_3_12.bundlingImage,
             command: [
               'bash', '-c',
-              'pip install -r requirements.txt -t /asset-output && cp index.py /asset-output'
+              'pip install -r requirements.txt -t /asset-output && cp *.py /asset-output'
             ],
           },
         }),
+      layers: [commonLayer],
       timeout: cdk.Duration.seconds(300),
-      memorySize: 1024,
+      memorySize: 512,  // Reads compact Textract summaries rather than the raw results
       environment: {
         INPUT_BUCKET_NAME: incomingEmailBucket.bucketName,
         ARTEFACT_BUCKET_NAME: artefactBucket.bucketName,
         RESULT_BUCKET_NAME: resultBucket.bucketName, 
-        TIMEZONE: 'America/Chicago'  // TODO: make env var
+        LEDGER_BUCKET_NAME: ledgerBucket.bucketName,  // Holds the duplicate invoice index under duplicate-index/
+        TIMEZONE: 'America/Chicago',  // TODO: make env var
+        ASSIGNMENT_BATCH_SIZE: '10',  // Invoices sent to Claude per account assignment request
+        MAX_WORKERS: '8',  // Textract jobs and Claude batches processed concurrently
+        RULES_CACHE_TTL_SECONDS: '300',  // How long a warm container trusts its cached rules
+        ASSIGNMENT_CACHE_TTL_DAYS: '30',
+        ASSIGNMENT_CACHE_MAX_ENTRIES: '5000',
+        // Document categories and vendor invoice number patterns default to DEFAULT_CONFIG in
+        // document_classifier.py; set DOCUMENT_CLASSIFIER_CONFIG (JSON) only to override them
       },
     });
     incomingEmailBucket.grantRead(processTextractResultsLambda);
-    artefactBucket.grantRead(processTextractResultsLambda)
+    artefactBucket.grantReadWrite(processTextractResultsLambda);
     resultBucket.grantReadWrite(processTextractResultsLambda);
+    ledgerBucket.grantReadWrite(processTextractResultsLambda);
     processTextractResultsLambda.addToRolePolicy(new iam.PolicyStatement({
       actions: ['bedrock:InvokeModel'],
       resources: ['*']
@@ -304,19 +424,25 @@ export class InvoiceProcessingStack extends cdk.Stack {
       outputPath: '$.Payload'
     });
 
+    const processAttachmentsTask = new stepfunctions_tasks.LambdaInvoke(this, 'Process Attachments Batch', {
+      lambdaFunction: processAttachmentsLambda,
+      outputPath: '$.Payload'
+    });
+
     const processEmailBodyTask = new stepfunctions_tasks.LambdaInvoke(this, 'Process Email Body', {
       lambdaFunction: processEmailBodyLambda,
       outputPath: '$.Payload'
     });
 
+    // Waits until textractCompletion (or startTextractJob itself) returns the task token
     const startTextractJobTask = new stepfunctions_tasks.LambdaInvoke(this, 'Start Textract Jobs', {
       lambdaFunction: startTextractJobLambda,
-      outputPath: '$.Payload',
-    });
-    
-    const getTextractResultsTask = new stepfunctions_tasks.LambdaInvoke(this, 'Get Textract Results', {
-      lambdaFunction: getTextractResultsLambda,
-      outputPath: '$.Payload',
+      integrationPattern: stepfunctions.IntegrationPattern.WAIT_FOR_TASK_TOKEN,
+      payload: stepfunctions.TaskInput.fromObject({
+        taskToken: stepfunctions.JsonPath.taskToken,
+        items: stepfunctions.JsonPath.entirePayload
+      }),
+      taskTimeout: stepfunctions.Timeout.duration(cdk.Duration.minutes(10)),
     });
     
     const processTextractResultsTask = new stepfunctions_tasks.LambdaInvoke(this, 'Process Textract Results', {
@@ -325,20 +451,12 @@ export class InvoiceProcessingStack extends cdk.Stack {
     });
 
     // Create Step function States
-    const wait30Seconds = new stepfunctions.Wait(this, 'Wait 30 Seconds', {
-      time: stepfunctions.WaitTime.duration(cdk.Duration.seconds(30)),
-    });
-
     const asyncTextractProcessing = 
       startTextractJobTask
-        .next(wait30Seconds)
-        .next(getTextractResultsTask)
         .next(
           new stepfunctions.Choice(this, 'Job Complete?')
             .when(stepfunctions.Condition.stringEquals('$.jobStatus', 'SUCCEEDED'), 
               processTextractResultsTask)
-            .when(stepfunctions.Condition.stringEquals('$.jobStatus', 'IN_PROGRESS'), 
-              wait30Seconds)
             .otherwise(
               new stepfunctions.Fail(this, 'Textract Job Failed', {
                 cause: 'Textract job failed or timed out',
@@ -356,12 +474,16 @@ export class InvoiceProcessingStack extends cdk.Stack {
         processDocAttachmentTask)
       .otherwise(processEmailBodyTask);
 
+    // Emails with more attachments than this are converted by the map, one invocation per attachment
+    const MAP_ATTACHMENT_THRESHOLD = 20;
+
     const processAttachmentMap = new stepfunctions.Map(this, 'Process Attachments', {
       maxConcurrency: 5, // Adjust this value based on your requirements
       itemsPath: stepfunctions.JsonPath.stringAt('$.attachments'),
       parameters: {
         'type.$': '$$.Map.Item.Value.type',
         'filename.$': '$$.Map.Item.Value.filename',
+        'partKey.$': '$$.Map.Item.Value.partKey',
         'messageId.$': '$.messageId',
         'bucketName.$': '$.bucketName'
       }
@@ -374,10 +496,15 @@ export class InvoiceProcessingStack extends cdk.Stack {
       .otherwise(
         detectInvoiceTask
           .next(new stepfunctions.Choice(this, 'Check Attachments')
-            .when(stepfunctions.Condition.isPresent('$.attachments[0]'),
+            // Very large batches fan out over the map, the rest are converted in one invocation
+            .when(stepfunctions.Condition.isPresent(`$.attachments[${MAP_ATTACHMENT_THRESHOLD}]`),
               processAttachmentMap
                 .next(asyncTextractProcessing)
             )
+            .when(stepfunctions.Condition.isPresent('$.attachments[0]'),
+              processAttachmentsTask
+                .next(asyncTextractProcessing)
+            )
           )
       );
 
@@ -392,6 +519,7 @@ export class InvoiceProcessingStack extends cdk.Stack {
       runtime: lambda.Runtime.PYTHON_3_12,
       handler: 'index.handler',
       code: lambda.Code.fromAsset('lambda/sendDailyEmail'),
+      layers: [commonLayer],
       environment: {
         RESULT_BUCKET_NAME: resultBucket.bucketName,
         SENDER_EMAIL: props.senderEmail,
@@ -401,7 +529,7 @@ export class InvoiceProcessingStack extends cdk.Stack {
     });
     
     // Grant permissions
-    resultBucket.grantRead(sendDailyEmailLambda);
+    resultBucket.grantReadWrite(sendDailyEmailLambda);
     sendDailyEmailLambda.addToRolePolicy(new iam.PolicyStatement({
       actions: ['ses:SendRawEmail'],
       resources: ['*']
@@ -417,6 +545,43 @@ export class InvoiceProcessingStack extends cdk.Stack {
       }),
       targets: [new targets.LambdaFunction(sendDailyEmailLambda)]
     });
+
+    const compactLedgerLambda = new lambda.Function(this, 'compactLedger', {
+      runtime: lambda.Runtime.PYTHON_3_12,
+      handler: 'index.handler',
+      code: lambda.Code.fromAsset('lambda/compactLedger',
+        {
+          bundling: {
+            image: lambda.Runtime.PYTHON_3_12.bundlingImage,
+            command: [
+              'bash', '-c',
+              'pip install -r requirements.txt -t /asset-output && cp *.py /asset-output'
+            ],
+          },
+        }
+      ),
+      layers: [commonLayer],
+      environment: {
+        RESULT_BUCKET_NAME: resultBucket.bucketName,
+        LEDGER_BUCKET_NAME: ledgerBucket.bucketName
+      },
+      timeout: cdk.Duration.minutes(5),
+      memorySize: 1024
+    });
+    resultBucket.grantRead(compactLedgerLambda);
+    ledgerBucket.grantReadWrite(compactLedgerLambda);
+
+    // After the daily report, once the day's CSVs are complete
+    new events.Rule(this, 'weekdayLedgerSchedule', {
+      schedule: events.Schedule.cron({
+        minute: '30',
+        hour: '23',
+        weekDay: 'MON-FRI',
+        month: '*',
+        year: '*'
+      }),
+      targets: [new targets.LambdaFunction(compactLedgerLambda)]
+    });
     
     // Verify sender email in SES
     new ses.EmailIdentity(this, 'SenderEmailIdentity', {
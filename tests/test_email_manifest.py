@@ -0,0 +1,88 @@
+import io
+import os
+import sys
+import unittest
+from email.message import EmailMessage
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'lambda', 'layers', 'common', 'python')]
+
+from email_manifest import build_manifest  # noqa: E402
+from mime_stream import decode_to, read_headers  # noqa: E402
+
+PDF = b'%PDF-1.4\n' + bytes(range(256)) * 64
+
+
+def build(raw: bytes):
+    stored = {}
+
+    def store_part(key, part):
+        buffer = io.BytesIO()
+        size = decode_to(part, buffer)
+        stored[key] = buffer.getvalue()
+        return size
+
+    return build_manifest('msg-1', io.BytesIO(raw), store_part), stored
+
+
+def invoice_email(body='Please find the invoice attached.', charset='utf-8') -> EmailMessage:
+    msg = EmailMessage()
+    msg['Subject'] = 'Invoice INV-1042'
+    msg['From'] = 'Billing <billing@acme.com>'
+    msg['To'] = 'ap@example.com'
+    msg.set_content(body, charset=charset)
+    msg.add_attachment(PDF, maintype='application', subtype='pdf', filename='INV-1042.pdf')
+    return msg
+
+
+class BuildManifestTest(unittest.TestCase):
+    def test_attachment_is_stored_decoded(self):
+        manifest, stored = build(invoice_email().as_bytes())
+        self.assertEqual(manifest['body'].strip(), 'Please find the invoice attached.')
+        self.assertEqual(manifest['headers']['subject'], 'Invoice INV-1042')
+        attachment, = manifest['attachments']
+        self.assertEqual(attachment['filename'], 'INV-1042.pdf')
+        self.assertEqual(attachment['encoding'], 'base64')
+        self.assertEqual(attachment['size'], len(PDF))
+        self.assertEqual(stored[attachment['partKey']], PDF)
+
+    def test_body_uses_declared_charset(self):
+        manifest, _ = build(invoice_email(body='Facture réglée à 100 €', charset='iso-8859-15').as_bytes())
+        self.assertEqual(manifest['body'].strip(), 'Facture réglée à 100 €')
+
+    def test_forwarded_message_attachments_are_found(self):
+        outer = EmailMessage()
+        outer['Subject'] = 'Fwd: Invoice INV-1042'
+        outer['From'] = 'ap-lead@example.com'
+        outer.set_content('See the forwarded invoice below.')
+        outer.add_attachment(invoice_email())
+        manifest, stored = build(outer.as_bytes())
+        self.assertEqual(manifest['body'].strip(), 'See the forwarded invoice below.')
+        attachment, = manifest['attachments']
+        self.assertEqual(stored[attachment['partKey']], PDF)
+
+    def test_named_text_part_is_not_the_body(self):
+        msg = EmailMessage()
+        msg['Subject'] = 'Invoice'
+        msg.add_attachment('vendor,total\nAcme,10\n', filename='lines.csv')
+        msg.add_attachment('Thanks for your business.')
+        manifest, _ = build(msg.as_bytes())
+        self.assertEqual(manifest['body'].strip(), 'Thanks for your business.')
+        self.assertEqual(manifest['attachments'], [])
+
+    def test_single_part_message(self):
+        manifest, _ = build(b'Subject: Hello\r\nContent-Type: text/html\r\n\r\n<p>Invoice attached</p>\r\n')
+        self.assertEqual(manifest['body'].strip(), '<p>Invoice attached</p>')
+        self.assertEqual(manifest['attachments'], [])
+
+
+class ReadHeadersTest(unittest.TestCase):
+    def test_reads_only_the_header_block(self):
+        stream = io.BytesIO(b'Subject: =?utf-8?q?Factura_n=C2=BA_7?=\r\nFrom: a@b.com\r\n\r\nFrom: body text\r\n')
+        headers = read_headers(stream)
+        self.assertEqual(headers['subject'], 'Factura nº 7')
+        self.assertEqual(headers.get_all('from'), ['a@b.com'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [
+    os.path.join(ROOT, 'lambda', 'layers', 'common', 'python'),
+    os.path.join(ROOT, 'lambda', 'processTextractResults')
+]
+
+from rule_engine import compile_rules  # noqa: E402
+
+SENDER = 'Billing <billing@acme.com>'
+
+
+class CompiledRulesTest(unittest.TestCase):
+    def test_plain_vendor_rule_matches(self):
+        rules = compile_rules("Invoices from Acme Supply go to Alice")
+        result = rules.match('Acme Supply', 'INV-1', SENDER)
+        self.assertEqual(result['accountant'], 'Alice')
+        self.assertEqual(result['confidence'], 'high')
+
+    def test_amount_rule_defers_to_model(self):
+        rules = compile_rules("Invoices from Acme Supply go to Alice\nInvoices over $10,000 go to Bob")
+        self.assertIsNone(rules.match('Acme Supply', 'INV-1', SENDER))
+
+    def test_body_rule_defers_to_model(self):
+        rules = compile_rules("Invoices from Acme Supply go to Alice\nIf the email body mentions Project X, assign to Carol")
+        self.assertIsNone(rules.match('Acme Supply', 'INV-1', SENDER))
+
+    def test_subject_rule_defers_to_model(self):
+        rules = compile_rules("Sender domain @acme.com goes to Bob\nWhen the subject contains URGENT, assign to Dan")
+        self.assertIsNone(rules.match('Acme Supply', 'INV-1', SENDER))
+
+    def test_catch_all_rule_defers_to_model(self):
+        rules = compile_rules("Invoices from Acme Supply go to Alice\nAll other invoices go to Erin")
+        self.assertIsNone(rules.match('Acme Supply', 'INV-1', SENDER))
+
+    def test_exception_naming_vendor_defers_to_model(self):
+        rules = compile_rules("Invoices from Acme Supply go to Alice\nExcept Acme Supply freight invoices, which go to Bob")
+        self.assertIsNone(rules.match('Acme Supply', 'INV-1', SENDER))
+
+    def test_exception_naming_other_vendor_keeps_match(self):
+        rules = compile_rules("Invoices from Acme Supply go to Alice\nExcept Globex freight invoices, which go to Bob")
+        self.assertEqual(rules.match('Acme Supply', 'INV-1', SENDER)['accountant'], 'Alice')
+
+    def test_conflicting_rules_defer_to_model(self):
+        rules = compile_rules("Invoices from Acme Supply go to Alice\nSender domain @acme.com goes to Bob")
+        self.assertIsNone(rules.match('Acme Supply', 'INV-1', SENDER))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'lambda', 'layers', 'common', 'python')]
+
+from structured_extraction import extract_summary_document  # noqa: E402
+
+
+def field_values(document):
+    return {field_type: fields[0]['value'] for field_type, fields in document['summaryFields'].items()}
+
+
+class ExtractSummaryDocumentTest(unittest.TestCase):
+    def test_label_value_pairs(self):
+        grid = [
+            ['Vendor', 'Acme Supply'],
+            ['Invoice #', 'INV-1042'],
+            ['Total due', '$1,250.00']
+        ]
+        document = extract_summary_document(grids=[grid])
+        self.assertEqual(field_values(document), {
+            'INVOICE_RECEIPT_ID': 'INV-1042',
+            'VENDOR_NAME': 'Acme Supply',
+            'TOTAL': '$1,250.00'
+        })
+
+    def test_labels_above_values(self):
+        grid = [
+            ['Invoice #', 'Vendor', 'Total'],
+            ['INV-7', 'Acme Supply', '$30.00']
+        ]
+        document = extract_summary_document(grids=[grid])
+        self.assertEqual(field_values(document)['VENDOR_NAME'], 'Acme Supply')
+        self.assertEqual(field_values(document)['TOTAL'], '$30.00')
+
+    def test_line_item_grid_uses_total_beside_label(self):
+        grid = [
+            ['Acme Supply', '', ''],
+            ['Vendor:', 'Acme Supply', ''],
+            ['Invoice #:', 'INV-1042', ''],
+            ['Description', 'Qty', 'Total'],
+            ['Widgets', '2', '$20.00'],
+            ['Gadgets', '4', '$40.00'],
+            ['', 'Grand total', '$60.00']
+        ]
+        document = extract_summary_document(grids=[grid])
+        self.assertEqual(field_values(document), {
+            'INVOICE_RECEIPT_ID': 'INV-1042',
+            'VENDOR_NAME': 'Acme Supply',
+            'TOTAL': '$60.00'
+        })
+
+    def test_remittance_grid_falls_back(self):
+        grid = [
+            ['Invoice #', 'Vendor', 'Date', 'Total'],
+            ['A-100', 'Acme Supply', '2024-07-01', '$10.00'],
+            ['A-101', 'Acme Supply', '2024-07-02', '$20.00'],
+            ['A-102', 'Acme Supply', '2024-07-03', '$30.00'],
+            ['', '', 'Grand total', '$60.00']
+        ]
+        self.assertIsNone(extract_summary_document(grids=[grid]))
+
+    def test_header_cell_is_not_a_value(self):
+        grid = [
+            ['Vendor', 'Date', 'Amount'],
+            ['Acme Supply', '2024-07-01', '$10.00'],
+            ['Invoice #', 'INV-9', ''],
+            ['Total', '$10.00', '']
+        ]
+        document = extract_summary_document(grids=[grid])
+        self.assertEqual(field_values(document)['VENDOR_NAME'], 'Acme Supply')
+
+    def test_conflicting_values_fall_back(self):
+        lines = ['Vendor: Acme Supply', 'Invoice #: INV-1', 'Total: $10.00', 'Total: $12.00']
+        self.assertIsNone(extract_summary_document(lines=lines))
+
+    def test_missing_field_falls_back(self):
+        self.assertIsNone(extract_summary_document(lines=['Vendor: Acme Supply', 'Total: $10.00']))
+
+    def test_grid_longer_than_max_rows_falls_back(self):
+        grid = [['Vendor', 'Acme Supply'], ['Invoice #', 'INV-1']]
+        grid += [['Widget', '$1.00']] * 5 + [['Total', '$5.00']]
+        self.assertIsNotNone(extract_summary_document(grids=[grid]))
+        self.assertIsNone(extract_summary_document(grids=[grid], max_rows=4))
+
+
+if __name__ == '__main__':
+    unittest.main()